@@ -1,9 +1,18 @@
 import boto3
 import csv
 import io
-import datetime
 import os
-from datetime import datetime, timezone
+import sqlite3
+from datetime import datetime, timezone, timedelta
+from botocore.exceptions import ClientError
+
+# Local copy of the lineage catalog, persisted to the report bucket between runs
+CATALOG_PATH = '/tmp/lineage_catalog.db'
+CATALOG_KEY = os.environ.get('CATALOG_KEY', 'catalog/lineage_catalog.db')
+# Days between full rescans, which also drop deleted snapshots and deregistered AMIs from the catalog
+CATALOG_FULL_SYNC_DAYS = int(os.environ.get('CATALOG_FULL_SYNC_DAYS', '7'))
+# Snapshots older than this and not used by an AMI are reported as idle
+IDLE_SNAPSHOT_DAYS = 30
 
 def lambda_handler(event, context):
     # Initialize AWS clients
@@ -20,6 +29,10 @@ def lambda_handler(event, context):
     # Lists to store findings
     idle_resources = []
     
+    # Refresh the snapshot -> volume -> instance -> AMI lineage catalog
+    catalog = load_catalog(s3_client, bucket_name)
+    full_sync = sync_catalog(ec2_client, catalog, datetime.now(timezone.utc))
+    
     # Find stopped EC2 instances
     stopped_instances = find_stopped_ec2_instances(ec2_client)
     for instance in stopped_instances:
@@ -32,7 +45,7 @@ def lambda_handler(event, context):
         })
     
     # Find unattached EBS volumes
-    unattached_volumes = find_unattached_volumes(ec2_client)
+    unattached_volumes = find_unattached_volumes(catalog)
     for volume in unattached_volumes:
         idle_resources.append({
             'ResourceType': 'EBS Volume',
@@ -43,12 +56,12 @@ def lambda_handler(event, context):
         })
     
     # Find idle snapshots (older than 30 days and not associated with AMIs)
-    idle_snapshots = find_idle_snapshots(ec2_client)
+    idle_snapshots = find_idle_snapshots(ec2_client, catalog, verify=not full_sync)
     for snapshot in idle_snapshots:
         idle_resources.append({
             'ResourceType': 'EBS Snapshot',
             'ResourceId': snapshot['SnapshotId'],
-            'Status': 'Idle',
+            'Status': 'Orphaned (source volume deleted)' if snapshot['Orphaned'] else 'Idle',
             'IdleSince': snapshot.get('StartTime', 'Unknown'),
             'AdditionalInfo': f"Size: {snapshot.get('Size', 'N/A')} GB, Description: {snapshot.get('Description', 'N/A')}"
         })
@@ -62,6 +75,8 @@ def lambda_handler(event, context):
     for resource in idle_resources:
         writer.writerow(resource)
     
+    save_catalog(s3_client, bucket_name, catalog)
+    
     # Upload to S3
     s3_client.put_object(
         Bucket=bucket_name,
@@ -77,7 +92,8 @@ def lambda_handler(event, context):
 
 def find_stopped_ec2_instances(ec2_client):
     instances = []
-    response = ec2_client.describe_instances(
+    paginator = ec2_client.get_paginator('describe_instances')
+    pages = paginator.paginate(
         Filters=[
             {
                 'Name': 'instance-state-name',
@@ -86,72 +102,232 @@ def find_stopped_ec2_instances(ec2_client):
         ]
     )
     
-    for reservation in response['Reservations']:
-        for instance in reservation['Instances']:
-            name = 'N/A'
-            for tag in instance.get('Tags', []):
-                if tag['Key'] == 'Name':
-                    name = tag['Value']
-                    break
-                    
-            instances.append({
-                'InstanceId': instance['InstanceId'],
-                'Name': name,
-                'StoppedSince': instance.get('StateTransitionReason', 'Unknown').replace('User initiated (', '').replace(')', '') if 'User initiated' in instance.get('StateTransitionReason', '') else 'Unknown'
-            })
+    for page in pages:
+        for reservation in page['Reservations']:
+            for instance in reservation['Instances']:
+                name = 'N/A'
+                for tag in instance.get('Tags', []):
+                    if tag['Key'] == 'Name':
+                        name = tag['Value']
+                        break
+                        
+                instances.append({
+                    'InstanceId': instance['InstanceId'],
+                    'Name': name,
+                    'StoppedSince': instance.get('StateTransitionReason', 'Unknown').replace('User initiated (', '').replace(')', '') if 'User initiated' in instance.get('StateTransitionReason', '') else 'Unknown'
+                })
     
     return instances
 
-def find_unattached_volumes(ec2_client):
+# Lineage catalog: snapshot -> volume -> instance -> AMI relationships with creation times.
+# Times are stored as ISO 8601 UTC strings so range queries can use the indexes.
+CATALOG_SCHEMA = """
+CREATE TABLE IF NOT EXISTS snapshots (
+    snapshot_id TEXT PRIMARY KEY,
+    volume_id TEXT,
+    instance_id TEXT,
+    image_id TEXT,
+    start_time TEXT NOT NULL,
+    volume_size INTEGER,
+    description TEXT
+);
+CREATE INDEX IF NOT EXISTS snapshots_start_time ON snapshots (start_time);
+CREATE INDEX IF NOT EXISTS snapshots_volume_id ON snapshots (volume_id);
+
+CREATE TABLE IF NOT EXISTS images (
+    image_id TEXT PRIMARY KEY,
+    instance_id TEXT,
+    name TEXT,
+    creation_date TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS image_snapshots (
+    snapshot_id TEXT NOT NULL,
+    image_id TEXT NOT NULL,
+    PRIMARY KEY (snapshot_id, image_id)
+);
+
+CREATE TABLE IF NOT EXISTS volumes (
+    volume_id TEXT PRIMARY KEY,
+    instance_id TEXT,
+    state TEXT NOT NULL,
+    size INTEGER,
+    volume_type TEXT,
+    create_time TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS volumes_state ON volumes (state);
+
+CREATE TABLE IF NOT EXISTS sync_state (
+    name TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+"""
+
+def catalog_time(value):
+    # boto3 returns datetimes for snapshots and volumes but ISO strings for AMIs
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    return value.astimezone(timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
+
+def parse_create_image_description(description):
+    # Snapshots taken by CreateImage are described as "Created by CreateImage(i-...) for ami-..."
+    instance_id = image_id = None
+    if description.startswith('Created by CreateImage('):
+        instance_id = description[len('Created by CreateImage('):].split(')', 1)[0]
+        if ' for ami-' in description:
+            image_id = 'ami-' + description.split(' for ami-', 1)[1].split()[0]
+    return instance_id, image_id
+
+def load_catalog(s3_client, bucket_name):
+    try:
+        s3_client.download_file(bucket_name, CATALOG_KEY, CATALOG_PATH)
+    except ClientError as e:
+        print(f"No lineage catalog at s3://{bucket_name}/{CATALOG_KEY} ({e.response['Error']['Code']}), building a new one")
+        if os.path.exists(CATALOG_PATH):
+            os.remove(CATALOG_PATH)
+    catalog = sqlite3.connect(CATALOG_PATH)
+    catalog.executescript(CATALOG_SCHEMA)
+    return catalog
+
+def save_catalog(s3_client, bucket_name, catalog):
+    catalog.commit()
+    catalog.close()
+    s3_client.upload_file(CATALOG_PATH, bucket_name, CATALOG_KEY)
+
+def get_sync_state(catalog, name):
+    row = catalog.execute("SELECT value FROM sync_state WHERE name = ?", (name,)).fetchone()
+    return datetime.fromisoformat(row[0]) if row else None
+
+def sync_catalog(ec2_client, catalog, now):
+    last_sync = get_sync_state(catalog, 'last_sync')
+    last_full_sync = get_sync_state(catalog, 'last_full_sync')
+    full_sync = last_full_sync is None or now - last_full_sync >= timedelta(days=CATALOG_FULL_SYNC_DAYS)
+    
+    if full_sync:
+        snapshot_filters = []
+        image_filters = []
+    else:
+        # EC2 has no "created since" filter, so fetch one wildcard day per value from the day before the last sync
+        day = (last_sync - timedelta(days=1)).date()
+        days = []
+        while day <= now.date():
+            days.append(f"{day.isoformat()}T*")
+            day += timedelta(days=1)
+        snapshot_filters = [{'Name': 'start-time', 'Values': days}]
+        image_filters = [{'Name': 'creation-date', 'Values': days}]
+    
+    with catalog:
+        if full_sync:
+            catalog.execute("DELETE FROM snapshots")
+            catalog.execute("DELETE FROM images")
+            catalog.execute("DELETE FROM image_snapshots")
+        
+        snapshot_count = 0
+        for page in ec2_client.get_paginator('describe_snapshots').paginate(OwnerIds=['self'], Filters=snapshot_filters):
+            rows = []
+            for snapshot in page['Snapshots']:
+                description = snapshot.get('Description', '')
+                instance_id, image_id = parse_create_image_description(description)
+                rows.append((
+                    snapshot['SnapshotId'], snapshot.get('VolumeId'), instance_id, image_id,
+                    catalog_time(snapshot['StartTime']), snapshot.get('VolumeSize'), description
+                ))
+            # Snapshots already in the catalog are kept as they are
+            snapshot_count += catalog.executemany("INSERT OR IGNORE INTO snapshots VALUES (?, ?, ?, ?, ?, ?, ?)", rows).rowcount
+        
+        image_count = 0
+        for page in ec2_client.get_paginator('describe_images').paginate(Owners=['self'], Filters=image_filters):
+            for image in page['Images']:
+                inserted = catalog.execute(
+                    "INSERT OR IGNORE INTO images VALUES (?, ?, ?, ?)",
+                    (image['ImageId'], image.get('SourceInstanceId'), image.get('Name'), catalog_time(image['CreationDate']))
+                ).rowcount
+                if not inserted:
+                    continue
+                image_count += 1
+                catalog.executemany(
+                    "INSERT OR IGNORE INTO image_snapshots VALUES (?, ?)",
+                    [(block_device['Ebs']['SnapshotId'], image['ImageId'])
+                     for block_device in image.get('BlockDeviceMappings', [])
+                     if 'SnapshotId' in block_device.get('Ebs', {})]
+                )
+        
+        # Volumes are live state (attachments change), so they are refreshed in full every run
+        catalog.execute("DELETE FROM volumes")
+        for page in ec2_client.get_paginator('describe_volumes').paginate():
+            catalog.executemany("INSERT INTO volumes VALUES (?, ?, ?, ?, ?, ?)", [
+                (
+                    volume['VolumeId'],
+                    volume['Attachments'][0]['InstanceId'] if volume.get('Attachments') else None,
+                    volume['State'], volume.get('Size'), volume.get('VolumeType'), catalog_time(volume['CreateTime'])
+                )
+                for volume in page['Volumes']
+            ])
+        
+        catalog.execute("INSERT OR REPLACE INTO sync_state VALUES ('last_sync', ?)", (now.isoformat(),))
+        if full_sync:
+            catalog.execute("INSERT OR REPLACE INTO sync_state VALUES ('last_full_sync', ?)", (now.isoformat(),))
+    
+    print(f"Lineage catalog {'rebuilt' if full_sync else 'refreshed'}: {snapshot_count} new snapshots, {image_count} new AMIs")
+    return full_sync
+
+def find_unattached_volumes(catalog):
     volumes = []
-    response = ec2_client.describe_volumes(
-        Filters=[
-            {
-                'Name': 'status',
-                'Values': ['available']
-            }
-        ]
+    rows = catalog.execute(
+        "SELECT volume_id, size, volume_type, create_time FROM volumes WHERE state = 'available' ORDER BY create_time"
     )
     
-    for volume in response['Volumes']:
+    for volume_id, size, volume_type, create_time in rows:
         volumes.append({
-            'VolumeId': volume['VolumeId'],
-            'Size': volume['Size'],
-            'VolumeType': volume['VolumeType'],
-            'CreatedSince': volume['CreateTime'].strftime('%Y-%m-%d')
+            'VolumeId': volume_id,
+            'Size': size,
+            'VolumeType': volume_type,
+            'CreatedSince': create_time[:10]
         })
     
     return volumes
 
-def find_idle_snapshots(ec2_client):
-    # Get all snapshots owned by this account
-    snapshots = []
-    response = ec2_client.describe_snapshots(OwnerIds=['self'])
+def prune_deleted_snapshots(ec2_client, catalog, snapshot_ids):
+    # Incremental runs do not see deletions, so confirm the candidates still exist (200 IDs per filter)
+    existing = set()
+    paginator = ec2_client.get_paginator('describe_snapshots')
+    for start in range(0, len(snapshot_ids), 200):
+        batch = snapshot_ids[start:start + 200]
+        for page in paginator.paginate(OwnerIds=['self'], Filters=[{'Name': 'snapshot-id', 'Values': batch}]):
+            existing.update(snapshot['SnapshotId'] for snapshot in page['Snapshots'])
     
-    # Get snapshots used by AMIs
-    images = ec2_client.describe_images(Owners=['self'])
-    used_snapshot_ids = set()
+    deleted = [(snapshot_id,) for snapshot_id in snapshot_ids if snapshot_id not in existing]
+    with catalog:
+        catalog.executemany("DELETE FROM snapshots WHERE snapshot_id = ?", deleted)
+        catalog.executemany("DELETE FROM image_snapshots WHERE snapshot_id = ?", deleted)
+    return existing
+
+def find_idle_snapshots(ec2_client, catalog, verify=True):
+    # Threshold for idle snapshots (30 days)
+    threshold_date = datetime.now(timezone.utc) - timedelta(days=IDLE_SNAPSHOT_DAYS)
     
-    for image in images['Images']:
-        for block_device in image.get('BlockDeviceMappings', []):
-            if 'Ebs' in block_device and 'SnapshotId' in block_device['Ebs']:
-                used_snapshot_ids.add(block_device['Ebs']['SnapshotId'])
+    # Older than the threshold and not used by any AMI; orphaned when the source volume no longer exists
+    rows = catalog.execute("""
+        SELECT s.snapshot_id, s.start_time, s.volume_size, s.description, v.volume_id IS NULL
+        FROM snapshots s
+        LEFT JOIN volumes v ON v.volume_id = s.volume_id
+        WHERE s.start_time < ?
+          AND NOT EXISTS (SELECT 1 FROM image_snapshots i WHERE i.snapshot_id = s.snapshot_id)
+        ORDER BY s.start_time
+    """, (catalog_time(threshold_date),)).fetchall()
     
-    # Threshold for idle snapshots (30 days)
-    threshold_date = datetime.now(timezone.utc) - datetime.timedelta(days=30)
+    if verify:
+        existing = prune_deleted_snapshots(ec2_client, catalog, [row[0] for row in rows])
+        rows = [row for row in rows if row[0] in existing]
     
-    for snapshot in response['Snapshots']:
-        # Skip if used by an AMI
-        if snapshot['SnapshotId'] in used_snapshot_ids:
-            continue
-        
-        # Check if older than threshold
-        if snapshot['StartTime'] < threshold_date:
-            snapshots.append({
-                'SnapshotId': snapshot['SnapshotId'],
-                'StartTime': snapshot['StartTime'].strftime('%Y-%m-%d'),
-                'Size': snapshot.get('VolumeSize', 'N/A'),
-                'Description': snapshot.get('Description', 'N/A')
-            })
+    snapshots = []
+    for snapshot_id, start_time, volume_size, description, orphaned in rows:
+        snapshots.append({
+            'SnapshotId': snapshot_id,
+            'StartTime': start_time[:10],
+            'Size': volume_size if volume_size is not None else 'N/A',
+            'Description': description or 'N/A',
+            'Orphaned': bool(orphaned)
+        })
     
     return snapshots
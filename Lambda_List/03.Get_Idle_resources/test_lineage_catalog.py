@@ -0,0 +1,135 @@
+import importlib.util
+import os
+import sqlite3
+from datetime import datetime, timedelta, timezone
+
+import boto3
+import pytest
+from botocore.stub import Stubber
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def load_lambda():
+    """Helper function to import this folder's idle_resources_lambda.py under its own module name"""
+    spec = importlib.util.spec_from_file_location('lineage_idle_resources', os.path.join(HERE, 'idle_resources_lambda.py'))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+idle = load_lambda()
+
+NOW = datetime(2024, 6, 10, 12, 0, tzinfo=timezone.utc)
+
+
+@pytest.fixture
+def catalog(tmp_path):
+    connection = sqlite3.connect(str(tmp_path / 'lineage_catalog.db'))
+    connection.executescript(idle.CATALOG_SCHEMA)
+    yield connection
+    connection.close()
+
+
+@pytest.fixture
+def ec2():
+    client = boto3.client(
+        'ec2', region_name='us-east-1',
+        aws_access_key_id='testing', aws_secret_access_key='testing'
+    )
+    with Stubber(client) as stubber:
+        yield client, stubber
+        stubber.assert_no_pending_responses()
+
+
+def snapshot(snapshot_id, start_time, volume_id='vol-1', description=''):
+    return {'SnapshotId': snapshot_id, 'VolumeId': volume_id, 'StartTime': start_time, 'VolumeSize': 8, 'Description': description}
+
+
+def image(image_id, creation_date, snapshot_ids):
+    return {
+        'ImageId': image_id, 'Name': image_id, 'CreationDate': creation_date, 'SourceInstanceId': 'i-1',
+        'BlockDeviceMappings': [{'DeviceName': '/dev/xvda', 'Ebs': {'SnapshotId': snapshot_id}} for snapshot_id in snapshot_ids],
+    }
+
+
+def add_sync(stubber, snapshots, images, filter_values=None):
+    """Helper function to stub one sync_catalog run, filtered by day when filter_values is given"""
+    snapshot_filters = [{'Name': 'start-time', 'Values': filter_values}] if filter_values else []
+    image_filters = [{'Name': 'creation-date', 'Values': filter_values}] if filter_values else []
+    stubber.add_response('describe_snapshots', {'Snapshots': snapshots}, {'OwnerIds': ['self'], 'Filters': snapshot_filters})
+    stubber.add_response('describe_images', {'Images': images}, {'Owners': ['self'], 'Filters': image_filters})
+    stubber.add_response('describe_volumes', {'Volumes': [
+        {'VolumeId': 'vol-1', 'State': 'in-use', 'Size': 8, 'VolumeType': 'gp3', 'CreateTime': datetime(2024, 1, 1, tzinfo=timezone.utc),
+         'Attachments': [{'InstanceId': 'i-1'}]},
+    ]}, {})
+
+
+def snapshot_ids(catalog):
+    return [row[0] for row in catalog.execute("SELECT snapshot_id FROM snapshots ORDER BY snapshot_id")]
+
+
+def test_first_sync_is_a_full_scan(ec2, catalog):
+    client, stubber = ec2
+    add_sync(stubber, [
+        snapshot('snap-1', datetime(2024, 1, 1, tzinfo=timezone.utc)),
+        snapshot('snap-2', datetime(2024, 1, 2, tzinfo=timezone.utc), description='Created by CreateImage(i-1) for ami-1 from vol-1'),
+    ], [image('ami-1', '2024-01-02T00:00:00.000Z', ['snap-2'])])
+
+    assert idle.sync_catalog(client, catalog, NOW) is True
+
+    assert snapshot_ids(catalog) == ['snap-1', 'snap-2']
+    assert catalog.execute("SELECT instance_id, image_id FROM snapshots WHERE snapshot_id = 'snap-2'").fetchone() == ('i-1', 'ami-1')
+    assert catalog.execute("SELECT * FROM image_snapshots").fetchall() == [('snap-2', 'ami-1')]
+    assert idle.get_sync_state(catalog, 'last_full_sync') == idle.get_sync_state(catalog, 'last_sync') == NOW
+
+
+def test_incremental_sync_fetches_only_the_days_since_the_last_run(ec2, catalog):
+    client, stubber = ec2
+    add_sync(stubber, [snapshot('snap-old', datetime(2024, 1, 1, tzinfo=timezone.utc))], [])
+    later = NOW + timedelta(days=2)
+    # From the day before the last sync up to today, snap-old was deleted in between and is not seen
+    add_sync(stubber, [snapshot('snap-new', later)], [image('ami-new', later.isoformat(), ['snap-new'])],
+             ['2024-06-09T*', '2024-06-10T*', '2024-06-11T*', '2024-06-12T*'])
+
+    idle.sync_catalog(client, catalog, NOW)
+    assert idle.sync_catalog(client, catalog, later) is False
+
+    assert snapshot_ids(catalog) == ['snap-new', 'snap-old']
+    assert idle.get_sync_state(catalog, 'last_sync') == later
+    assert idle.get_sync_state(catalog, 'last_full_sync') == NOW
+
+
+def test_weekly_full_sync_drops_deleted_snapshots_and_images(ec2, catalog):
+    client, stubber = ec2
+    add_sync(stubber, [snapshot('snap-kept', NOW), snapshot('snap-deleted', NOW)], [image('ami-deleted', NOW.isoformat(), ['snap-deleted'])])
+    week_later = NOW + timedelta(days=idle.CATALOG_FULL_SYNC_DAYS)
+    add_sync(stubber, [snapshot('snap-kept', NOW)], [])
+
+    idle.sync_catalog(client, catalog, NOW)
+    assert idle.sync_catalog(client, catalog, week_later) is True
+
+    assert snapshot_ids(catalog) == ['snap-kept']
+    assert catalog.execute("SELECT COUNT(*) FROM images").fetchone() == (0,)
+    assert catalog.execute("SELECT COUNT(*) FROM image_snapshots").fetchone() == (0,)
+    assert idle.get_sync_state(catalog, 'last_full_sync') == week_later
+
+
+def test_prune_deleted_snapshots_checks_200_ids_per_call(ec2, catalog):
+    client, stubber = ec2
+    candidates = [f'snap-{index:017x}' for index in range(250)]
+    deleted = {candidates[0], candidates[249]}
+    with catalog:
+        catalog.executemany("INSERT INTO snapshots VALUES (?, 'vol-1', NULL, NULL, '2024-01-01T00:00:00Z', 8, '')",
+                            [(snapshot_id,) for snapshot_id in candidates])
+        catalog.executemany("INSERT INTO image_snapshots VALUES (?, 'ami-1')", [(snapshot_id,) for snapshot_id in deleted])
+    for batch in (candidates[:200], candidates[200:]):
+        stubber.add_response('describe_snapshots', {
+            'Snapshots': [snapshot(snapshot_id, NOW) for snapshot_id in batch if snapshot_id not in deleted],
+        }, {'OwnerIds': ['self'], 'Filters': [{'Name': 'snapshot-id', 'Values': batch}]})
+
+    existing = idle.prune_deleted_snapshots(client, catalog, candidates)
+
+    assert existing == set(candidates) - deleted
+    assert snapshot_ids(catalog) == sorted(existing)
+    assert catalog.execute("SELECT COUNT(*) FROM image_snapshots").fetchone() == (0,)
@@ -0,0 +1,134 @@
+"""Adaptive, throttle-aware fan-out of per-item AWS calls, used by the IAM role scan in lambda.py"""
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from botocore.config import Config
+from botocore.exceptions import ClientError
+
+# Error codes AWS services use when a caller is being rate limited
+THROTTLING_ERROR_CODES = {
+    'Throttling', 'ThrottlingException', 'ThrottledException', 'RequestLimitExceeded',
+    'TooManyRequestsException', 'RequestThrottled', 'RequestThrottledException', 'SlowDown'
+}
+
+# Clients used for adaptive fan-outs leave retries to AdaptiveExecutor so that
+# throttling is visible to it instead of being absorbed by botocore's backoff
+ADAPTIVE_CLIENT_CONFIG = Config(retries={'mode': 'standard', 'max_attempts': 1})
+
+def is_throttling_error(error):
+    """Helper function to tell whether an exception is an AWS throttling error"""
+    return isinstance(error, ClientError) and error.response.get('Error', {}).get('Code') in THROTTLING_ERROR_CODES
+
+def timed_call(fn, item, clock):
+    """Helper function to run fn(item) and return its result with the call latency"""
+    started = clock()
+    result = fn(item)
+    return result, clock() - started
+
+class AdaptiveExecutor:
+    """Runs a per-item AWS call on a worker pool whose width follows AIMD:
+    it grows by one worker per window of fast successful calls, shrinks by one
+    when calls get slower than latency_target, and halves on throttling.
+    Throttled items are retried with full-jitter exponential backoff.
+    clock, sleep and uniform default to the time and random module functions
+    and can be replaced to drive the executor from a fake clock."""
+
+    def __init__(self, initial_workers=4, min_workers=1, max_workers=32, latency_target=1.0,
+                 max_attempts=5, base_backoff=0.2, max_backoff=10.0,
+                 clock=time.monotonic, sleep=time.sleep, uniform=random.uniform):
+        self.min_workers = min_workers
+        self.max_workers = max_workers
+        self.latency_target = latency_target
+        self.max_attempts = max_attempts
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self.clock = clock
+        self.sleep = sleep
+        self.uniform = uniform
+        self.limit = max(min_workers, min(initial_workers, max_workers))
+        self.failures = []
+        self.stats = {}
+
+    def _backoff(self, attempt):
+        return self.uniform(0, min(self.max_backoff, self.base_backoff * (2 ** attempt)))
+
+    def map(self, fn, items):
+        """Run fn over items and return [(item, result)] for every item that succeeded, in input order"""
+        items = list(items)
+        results = {}
+        attempts = [0] * len(items)
+        pending = list(range(len(items)))
+        delayed = []  # (ready_at, index) of throttled items waiting to be retried
+        in_flight = {}
+        generation = 0
+        window_successes = 0
+        peak = self.limit
+        self.failures = []
+        self.stats = {'items': len(items), 'succeeded': 0, 'retried': 0, 'retries': 0, 'throttled': 0, 'failed': 0}
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            while pending or delayed or in_flight:
+                now = self.clock()
+                ready = [entry for entry in delayed if entry[0] <= now]
+                if ready:
+                    delayed = [entry for entry in delayed if entry[0] > now]
+                    pending.extend(index for _, index in ready)
+
+                while pending and len(in_flight) < self.limit:
+                    index = pending.pop(0)
+                    attempts[index] += 1
+                    in_flight[executor.submit(timed_call, fn, items[index], self.clock)] = (index, generation)
+
+                if not in_flight:
+                    # Only backed-off items remain, sleep until the first one is due
+                    self.sleep(max(0, min(entry[0] for entry in delayed) - self.clock()))
+                    continue
+
+                timeout = max(0, min(entry[0] for entry in delayed) - self.clock()) if delayed else None
+                done, _ = wait(in_flight, timeout=timeout, return_when=FIRST_COMPLETED)
+                for future in done:
+                    index, submitted_generation = in_flight.pop(future)
+                    try:
+                        result, latency = future.result()
+                    except Exception as e:
+                        if not is_throttling_error(e):
+                            self.failures.append((items[index], e))
+                            self.stats['failed'] += 1
+                            continue
+
+                        self.stats['throttled'] += 1
+                        # Multiplicative decrease, once per generation of submissions
+                        if submitted_generation == generation:
+                            self.limit = max(self.min_workers, self.limit // 2)
+                            generation += 1
+                            window_successes = 0
+
+                        if attempts[index] >= self.max_attempts:
+                            self.failures.append((items[index], e))
+                            self.stats['failed'] += 1
+                        else:
+                            if attempts[index] == 1:
+                                self.stats['retried'] += 1
+                            self.stats['retries'] += 1
+                            delayed.append((self.clock() + self._backoff(attempts[index]), index))
+                        continue
+
+                    results[index] = result
+                    self.stats['succeeded'] += 1
+                    if latency > self.latency_target:
+                        # Slow responses are an early congestion signal, back off gently
+                        if submitted_generation == generation and self.limit > self.min_workers:
+                            self.limit -= 1
+                            generation += 1
+                        window_successes = 0
+                    else:
+                        # Additive increase after a full window of fast successes
+                        window_successes += 1
+                        if window_successes >= self.limit and self.limit < self.max_workers:
+                            self.limit += 1
+                            window_successes = 0
+                    peak = max(peak, self.limit)
+
+        self.stats['final_workers'] = self.limit
+        self.stats['peak_workers'] = peak
+        return [(items[index], results[index]) for index in sorted(results)]
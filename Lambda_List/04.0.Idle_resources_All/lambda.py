@@ -1,11 +1,106 @@
 import datetime
 import base64
+import json
 import os
+import time
 from io import BytesIO
 import boto3
 from openpyxl import Workbook
 from openpyxl.styles import Font, PatternFill
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import ThreadPoolExecutor
+from adaptive_executor import ADAPTIVE_CLIENT_CONFIG, AdaptiveExecutor
+
+def iter_pages(client, operation, result_key, **kwargs):
+    """Helper function to stream items from every page of a paginated API call"""
+    for page in client.get_paginator(operation).paginate(**kwargs):
+        yield from page.get(result_key, [])
+
+# Regional resource types collected from every audited region; IAM is global
+# and Lambda functions are still reported for the Lambda's own region only
+REGION_WORKERS = int(os.environ.get('REGION_WORKERS', '8'))
+
+def resolve_regions(event, ec2):
+    """Helper function to work out which regions to audit from the event or AUDIT_REGIONS"""
+    requested = None
+    if isinstance(event, dict):
+        requested = event.get('regions')
+        if requested is None and event.get('body'):
+            # API Gateway proxy requests carry the options in a JSON body
+            try:
+                requested = json.loads(event['body']).get('regions')
+            except (ValueError, AttributeError):
+                requested = None
+    if requested is None:
+        requested = os.environ.get('AUDIT_REGIONS', '')
+    if isinstance(requested, str):
+        requested = [region.strip() for region in requested.split(',') if region.strip()]
+
+    if not requested:
+        return [os.environ.get('AWS_REGION')]
+    if [region.lower() for region in requested] == ['all']:
+        # describe_regions only returns the regions enabled for this account
+        return sorted(region['RegionName'] for region in ec2.describe_regions()['Regions'])
+    return list(dict.fromkeys(requested))
+
+def collect_region_resources(region, ec2):
+    """Collect idle EBS volumes, snapshots, stopped instances and unused security groups for one region"""
+    started = time.monotonic()
+    result = {'region': region}
+
+    # Idle EBS Volumes
+    print(f"🔍 [{region}] Fetching Idle EBS Volumes...")
+    volumes = list(iter_pages(ec2, 'describe_volumes', 'Volumes', Filters=[{'Name': 'status', 'Values': ['available']}]))
+    print(f"📦 [{region}] Found {len(volumes)} Idle EBS Volumes")
+    result['volumes'] = []
+    for v in volumes:
+        tags = ", ".join(f"{t['Key']}={t['Value']}" for t in v.get('Tags', [])) or "-"
+        result['volumes'].append([region, v['VolumeId'], v['Size'], v['CreateTime'].strftime('%Y-%m-%d %H:%M'), tags])
+
+    # Orphaned Snapshots
+    print(f"🔍 [{region}] Fetching Orphaned Snapshots...")
+    snapshots = list(iter_pages(ec2, 'describe_snapshots', 'Snapshots', OwnerIds=['self']))
+    print(f"📸 [{region}] Found {len(snapshots)} Snapshots")
+    result['snapshots'] = []
+    for snap in snapshots:
+        tags = {t['Key']: t['Value'] for t in snap.get('Tags', [])}
+        expiry = tags.get('ExpiryDate')
+        is_expired = False
+        reason = "No linked volume"
+        if expiry:
+            try:
+                expiry_date = datetime.datetime.strptime(expiry, "%Y-%m-%d")
+                if (datetime.datetime.utcnow() - expiry_date).days > 90:
+                    is_expired = True
+                    reason = "Expired (>90 days)"
+            except Exception:
+                reason = "Invalid ExpiryDate"
+        elif not snap.get("Description", "").startswith("Created by CreateImage"):
+            reason = "Orphaned & no expiry tag"
+        result['snapshots'].append(([region, snap['SnapshotId'], snap['VolumeSize'], expiry or "-", reason], is_expired))
+
+    # Stopped EC2 Instances
+    print(f"🔍 [{region}] Fetching Stopped EC2 Instances...")
+    stopped_reservations = iter_pages(ec2, 'describe_instances', 'Reservations', Filters=[{'Name': 'instance-state-name', 'Values': ['stopped']}])
+    result['stopped_instances'] = []
+    for res in stopped_reservations:
+        for i in res['Instances']:
+            tags = ", ".join(f"{t['Key']}={t['Value']}" for t in i.get('Tags', [])) or "-"
+            result['stopped_instances'].append([region, i['InstanceId'], i['InstanceType'], i['LaunchTime'].strftime('%Y-%m-%d %H:%M'), tags])
+    print(f"🛑 [{region}] Found {len(result['stopped_instances'])} Stopped Instances")
+
+    # Unused Security Groups
+    print(f"🔍 [{region}] Fetching Unused Security Groups...")
+    used_sgs = {g['GroupId'] for eni in iter_pages(ec2, 'describe_network_interfaces', 'NetworkInterfaces') for g in eni['Groups']}
+    result['security_groups'] = [
+        [region, sg['GroupId'], sg['GroupName'], sg.get('Description', ''), sg.get('VpcId', '-')]
+        for sg in iter_pages(ec2, 'describe_security_groups', 'SecurityGroups')
+        if sg['GroupId'] not in used_sgs and sg['GroupName'] != 'default'
+    ]
+    print(f"🔐 [{region}] Found {len(result['security_groups'])} Unused Security Groups")
+
+    result['seconds'] = time.monotonic() - started
+    print(f"⏱️ [{region}] Collected in {result['seconds']:.1f}s")
+    return result
 
 def lambda_handler(event, context):
     print("🚀 Lambda execution started")
@@ -25,6 +120,9 @@ def lambda_handler(event, context):
     lambda_client = boto3.client('lambda')
     s3 = boto3.client('s3')
 
+    regions = resolve_regions(event, ec2)
+    print(f"🗺️ Auditing regions: {', '.join(regions)}")
+
     timestamp = datetime.datetime.utcnow().strftime('%Y-%m-%d-%H-%M')
     filename = f"idle-resource-report-{timestamp}.xlsx"
     s3_key = f"reports/{filename}"
@@ -43,117 +141,98 @@ def lambda_handler(event, context):
 
     resource_counts = {}
 
-    # Idle EBS Volumes
-    print("🔍 Fetching Idle EBS Volumes...")
-    volumes = ec2.describe_volumes(Filters=[{'Name': 'status', 'Values': ['available']}])['Volumes']
-    print(f"📦 Found {len(volumes)} Idle EBS Volumes")
-    ebs_ws = create_sheet("Idle EBS Volumes", ["Volume ID", "Size (GiB)", "Created Time", "Tags"])
-    for v in volumes:
-        tags = ", ".join(f"{t['Key']}={t['Value']}" for t in v.get('Tags', [])) or "-"
-        ebs_ws.append([v['VolumeId'], v['Size'], v['CreateTime'].strftime('%Y-%m-%d %H:%M'), tags])
-    resource_counts["Idle EBS Volumes"] = len(volumes)
-
-    # Orphaned Snapshots
-    print("🔍 Fetching Orphaned Snapshots...")
-    snapshots = ec2.describe_snapshots(OwnerIds=['self'])['Snapshots']
-    print(f"📸 Found {len(snapshots)} Snapshots")
-    snap_ws = create_sheet("Orphaned Snapshots", ["Snapshot ID", "Volume Size", "ExpiryDate", "Reason"])
-    expired_fill = PatternFill(start_color="FF9999", end_color="FF9999", fill_type="solid")
-    expired_count = 0
-    for snap in snapshots:
-        tags = {t['Key']: t['Value'] for t in snap.get('Tags', [])}
-        expiry = tags.get('ExpiryDate')
-        is_expired = False
-        reason = "No linked volume"
-        if expiry:
-            try:
-                expiry_date = datetime.datetime.strptime(expiry, "%Y-%m-%d")
-                if (datetime.datetime.utcnow() - expiry_date).days > 90:
-                    is_expired = True
-                    reason = "Expired (>90 days)"
-            except Exception:
-                reason = "Invalid ExpiryDate"
-        elif not snap.get("Description", "").startswith("Created by CreateImage"):
-            reason = "Orphaned & no expiry tag"
+    # Create the sheets up front so they keep the report order while regions are collected in parallel
+    ebs_ws = create_sheet("Idle EBS Volumes", ["Region", "Volume ID", "Size (GiB)", "Created Time", "Tags"])
+    snap_ws = create_sheet("Orphaned Snapshots", ["Region", "Snapshot ID", "Volume Size", "ExpiryDate", "Reason"])
+    stopped_ws = create_sheet("Stopped EC2 Instances", ["Region", "Instance ID", "Type", "Launch Time", "Tags"])
+    sg_ws = create_sheet("Unused Security Groups", ["Region", "Group ID", "Group Name", "Description", "VPC ID"])
 
-        snap_ws.append([snap['SnapshotId'], snap['VolumeSize'], expiry or "-", reason])
-        if is_expired:
-            for cell in snap_ws[-1]:
-                cell.fill = expired_fill
-            expired_count += 1
-    resource_counts["Orphaned Snapshots"] = len(snapshots)
+    # Regional resources are collected in parallel workers, one per region;
+    # clients are created here because client creation is not thread-safe
+    ec2_clients = {region: boto3.client('ec2', region_name=region) for region in regions}
+    with ThreadPoolExecutor(max_workers=max(1, min(REGION_WORKERS, len(regions)))) as region_executor:
+        region_futures = [region_executor.submit(collect_region_resources, region, ec2_clients[region]) for region in regions]
 
-    # Stopped EC2 Instances
-    print("🔍 Fetching Stopped EC2 Instances...")
-    stopped_instances = ec2.describe_instances(Filters=[{'Name': 'instance-state-name', 'Values': ['stopped']}])['Reservations']
-    count_stopped = 0
-    stopped_ws = create_sheet("Stopped EC2 Instances", ["Instance ID", "Type", "Launch Time", "Tags"])
-    for res in stopped_instances:
-        for i in res['Instances']:
-            tags = ", ".join(f"{t['Key']}={t['Value']}" for t in i.get('Tags', [])) or "-"
-            stopped_ws.append([i['InstanceId'], i['InstanceType'], i['LaunchTime'].strftime('%Y-%m-%d %H:%M'), tags])
-            count_stopped += 1
-    print(f"🛑 Found {count_stopped} Stopped Instances")
-    resource_counts["Stopped EC2 Instances"] = count_stopped
-
-    # Unused Security Groups
-    print("🔍 Fetching Unused Security Groups...")
-    all_sgs = ec2.describe_security_groups()['SecurityGroups']
-    used_sgs = {g['GroupId'] for eni in ec2.describe_network_interfaces()['NetworkInterfaces'] for g in eni['Groups']}
-    sg_ws = create_sheet("Unused Security Groups", ["Group ID", "Group Name", "Description", "VPC ID"])
-    unused_count = 0
-    for sg in all_sgs:
-        if sg['GroupId'] not in used_sgs and sg['GroupName'] != 'default':
-            sg_ws.append([sg['GroupId'], sg['GroupName'], sg.get('Description', ''), sg.get('VpcId', '-')])
-            unused_count += 1
-    print(f"🔐 Found {unused_count} Unused Security Groups")
-    resource_counts["Unused Security Groups"] = unused_count
+        # IAM Roles w/o Policies - global, collected once while the regions run
+        print("🔍 Fetching IAM Roles without Policies...")
+        roles = list(iter_pages(iam, 'list_roles', 'Roles'))
+        iam_ws = create_sheet("IAM Roles w-o Policies", ["Role Name", "Created"])
+        iam_scan = boto3.client('iam', config=ADAPTIVE_CLIENT_CONFIG)
 
-    # IAM Roles w/o Policies - Optimized with threading
-    print("🔍 Fetching IAM Roles without Policies...")
-    roles = iam.list_roles()['Roles']
-    iam_ws = create_sheet("IAM Roles w-o Policies", ["Role Name", "Created"])
-
-    def role_has_no_policies(role):
-        try:
+        def role_has_no_policies(role):
             role_name = role['RoleName']
-            attached = iam.list_attached_role_policies(RoleName=role_name)['AttachedPolicies']
-            inline = iam.list_role_policies(RoleName=role_name)['PolicyNames']
+            attached = iam_scan.list_attached_role_policies(RoleName=role_name)['AttachedPolicies']
+            inline = iam_scan.list_role_policies(RoleName=role_name)['PolicyNames']
             if not attached and not inline:
                 return role['RoleName'], role['CreateDate']
-        except Exception as e:
-            print(f"⚠️ Error checking role {role['RoleName']}: {e}")
             return None
 
-    no_policy_roles = 0
-    with ThreadPoolExecutor(max_workers=10) as executor:
-        futures = [executor.submit(role_has_no_policies, role) for role in roles]
-        for future in as_completed(futures):
-            result = future.result()
+        no_policy_roles = 0
+        role_executor = AdaptiveExecutor(initial_workers=4, max_workers=20)
+        for _, result in role_executor.map(role_has_no_policies, roles):
             if result:
                 role_name, create_date = result
                 iam_ws.append([role_name, create_date.strftime('%Y-%m-%d')])
                 no_policy_roles += 1
+        for role, error in role_executor.failures:
+            print(f"⚠️ Error checking role {role['RoleName']}: {error}")
+
+        role_scan_stats = role_executor.stats
+        print(f"👤 Found {no_policy_roles} IAM Roles without policies "
+              f"({role_scan_stats['retried']} retried, {role_scan_stats['failed']} failed, "
+              f"{role_scan_stats['final_workers']} workers at the end)")
+        resource_counts["IAM Roles w/o Policies"] = no_policy_roles
 
-    print(f"👤 Found {no_policy_roles} IAM Roles without policies")
-    resource_counts["IAM Roles w/o Policies"] = no_policy_roles
-
-    # Idle Lambda Functions
-    print("🔍 Fetching Idle Lambda Functions...")
-    functions = lambda_client.list_functions()['Functions']
-    idle_lambdas = 0
-    lambda_ws = create_sheet("Idle Lambda Functions", ["Function Name", "Last Modified", "Runtime"])
-    for f in functions:
-        last_modified_str = f['LastModified']
-        try:
-            last_modified = datetime.datetime.strptime(last_modified_str, "%Y-%m-%dT%H:%M:%S.%f%z")
-        except ValueError:
-            last_modified = datetime.datetime.strptime(last_modified_str, "%Y-%m-%dT%H:%M:%S%z")
-        if (datetime.datetime.now(datetime.timezone.utc) - last_modified).days > 30:
-            lambda_ws.append([f['FunctionName'], last_modified_str, f['Runtime']])
-            idle_lambdas += 1
-    print(f"🪂 Found {idle_lambdas} Idle Lambda Functions")
-    resource_counts["Idle Lambda Functions"] = idle_lambdas
+        # Idle Lambda Functions
+        print("🔍 Fetching Idle Lambda Functions...")
+        functions = lambda_client.list_functions()['Functions']
+        idle_lambdas = 0
+        lambda_ws = create_sheet("Idle Lambda Functions", ["Function Name", "Last Modified", "Runtime"])
+        for f in functions:
+            last_modified_str = f['LastModified']
+            try:
+                last_modified = datetime.datetime.strptime(last_modified_str, "%Y-%m-%dT%H:%M:%S.%f%z")
+            except ValueError:
+                last_modified = datetime.datetime.strptime(last_modified_str, "%Y-%m-%dT%H:%M:%S%z")
+            if (datetime.datetime.now(datetime.timezone.utc) - last_modified).days > 30:
+                lambda_ws.append([f['FunctionName'], last_modified_str, f['Runtime']])
+                idle_lambdas += 1
+        print(f"🪂 Found {idle_lambdas} Idle Lambda Functions")
+        resource_counts["Idle Lambda Functions"] = idle_lambdas
+
+        # Merge the regional results in the requested region order; a failed
+        # region is listed on the Summary sheet instead of aborting the workbook
+        region_results = []
+        failed_regions = []
+        for region, future in zip(regions, region_futures):
+            try:
+                region_results.append(future.result())
+            except Exception as e:
+                print(f"⚠️ [{region}] Collection failed: {e}")
+                failed_regions.append((region, str(e)))
+
+    expired_fill = PatternFill(start_color="FF9999", end_color="FF9999", fill_type="solid")
+    expired_count = 0
+    for result in region_results:
+        for row in result['volumes']:
+            ebs_ws.append(row)
+        for row, is_expired in result['snapshots']:
+            snap_ws.append(row)
+            if is_expired:
+                for cell in snap_ws[snap_ws.max_row]:
+                    cell.fill = expired_fill
+                expired_count += 1
+        for row in result['stopped_instances']:
+            stopped_ws.append(row)
+        for row in result['security_groups']:
+            sg_ws.append(row)
+
+    resource_counts["Idle EBS Volumes"] = sum(len(result['volumes']) for result in region_results)
+    resource_counts["Orphaned Snapshots"] = sum(len(result['snapshots']) for result in region_results)
+    count_stopped = sum(len(result['stopped_instances']) for result in region_results)
+    resource_counts["Stopped EC2 Instances"] = count_stopped
+    unused_count = sum(len(result['security_groups']) for result in region_results)
+    resource_counts["Unused Security Groups"] = unused_count
 
     # Summary
     print("📝 Generating Summary Sheet...")
@@ -164,8 +243,33 @@ def lambda_handler(event, context):
     summary_ws.append(["Orphaned Snapshots", resource_counts["Orphaned Snapshots"], f"{expired_count} expired ⛔"])
     summary_ws.append(["Stopped EC2 Instances", count_stopped, "Can be reviewed for deletion"])
     summary_ws.append(["Unused Security Groups", unused_count, "No ENI attached"])
-    summary_ws.append(["IAM Roles w/o Policies", no_policy_roles, "Unattached to any policy"])
-    summary_ws.append(["Idle Lambda Functions", idle_lambdas, "Not used/updated in 30+ days"])
+    summary_ws.append(["IAM Roles w/o Policies", no_policy_roles,
+                       f"Unattached to any policy ({role_scan_stats['failed']} roles could not be checked)"])
+    summary_ws.append(["Idle Lambda Functions", idle_lambdas, f"Not used/updated in 30+ days ({aws_region} only)"])
+
+    # Per-region subtotals for the regional resource types
+    summary_ws.append([])
+    summary_ws.append(["Region", "Idle EBS Volumes", "Orphaned Snapshots", "Stopped EC2 Instances", "Unused Security Groups", "Collection Time (s)"])
+    for cell in summary_ws[summary_ws.max_row]:
+        cell.font = Font(bold=True)
+    for result in region_results:
+        summary_ws.append([
+            result['region'],
+            len(result['volumes']),
+            len(result['snapshots']),
+            len(result['stopped_instances']),
+            len(result['security_groups']),
+            round(result['seconds'], 1)
+        ])
+
+    # Regions whose collection failed are missing from every total above
+    if failed_regions:
+        summary_ws.append([])
+        summary_ws.append(["Failed Region", "Error"])
+        for cell in summary_ws[summary_ws.max_row]:
+            cell.font = Font(bold=True)
+        for region, error in failed_regions:
+            summary_ws.append([region, error])
 
     # Save workbook to memory
     print("💾 Saving Excel file...")
@@ -206,6 +310,9 @@ def lambda_handler(event, context):
                 'key': s3_key
             },
             'downloadUrl': presigned_url,
-            'resourceCounts': resource_counts
+            'regions': regions,
+            'failedRegions': [region for region, _ in failed_regions],
+            'resourceCounts': resource_counts,
+            'roleScan': role_scan_stats
         }
     }
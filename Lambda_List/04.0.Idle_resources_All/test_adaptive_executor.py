@@ -0,0 +1,139 @@
+import importlib.util
+import os
+import threading
+
+from botocore.exceptions import ClientError
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def load_module():
+    """Helper function to import this folder's adaptive_executor.py under its own module name"""
+    spec = importlib.util.spec_from_file_location('adaptive_executor', os.path.join(HERE, 'adaptive_executor.py'))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+adaptive = load_module()
+
+
+class FakeClock:
+    """Monotonic clock that only moves when sleep() or advance() is called"""
+
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+        self.lock = threading.Lock()
+
+    def __call__(self):
+        with self.lock:
+            return self.now
+
+    def advance(self, seconds):
+        with self.lock:
+            self.now += seconds
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.advance(seconds)
+
+
+def throttling_error():
+    return ClientError({'Error': {'Code': 'Throttling', 'Message': 'Rate exceeded'}}, 'ListRolePolicies')
+
+
+def make_executor(clock, **kwargs):
+    return adaptive.AdaptiveExecutor(clock=clock, sleep=clock.sleep, **kwargs)
+
+
+def test_throttling_halves_the_workers_once_per_generation():
+    clock = FakeClock()
+    executor = make_executor(clock, initial_workers=8, max_workers=8, max_attempts=1)
+
+    def always_throttled(item):
+        raise throttling_error()
+
+    # All eight calls are submitted in the first generation, so only the first throttle halves the pool
+    assert executor.map(always_throttled, range(8)) == []
+    assert executor.stats['throttled'] == 8
+    assert executor.stats['final_workers'] == 4
+    assert executor.stats['peak_workers'] == 8
+
+
+def test_fast_successes_grow_the_workers_by_one_per_window():
+    clock = FakeClock()
+    executor = make_executor(clock, initial_workers=1, max_workers=4)
+
+    results = executor.map(lambda item: item * 2, range(6))
+
+    assert results == [(item, item * 2) for item in range(6)]
+    # One success grows 1 to 2, two more grow it to 3, three more grow it to 4
+    assert executor.stats['final_workers'] == executor.stats['peak_workers'] == 4
+
+
+def test_slow_calls_shrink_the_workers_by_one():
+    clock = FakeClock()
+    executor = make_executor(clock, initial_workers=4, max_workers=4, latency_target=1.0)
+
+    def slow(item):
+        clock.advance(5)
+        return item
+
+    executor.map(slow, range(4))
+
+    assert executor.stats['final_workers'] == 3
+
+
+def test_throttled_items_are_retried_after_a_jittered_backoff():
+    clock = FakeClock()
+    jitter_ranges = []
+
+    def uniform(low, high):
+        jitter_ranges.append((low, high))
+        return high / 2
+
+    executor = make_executor(clock, initial_workers=1, base_backoff=0.2, max_backoff=0.5, uniform=uniform)
+    calls = []
+
+    def throttled_twice(item):
+        calls.append(clock())
+        if len(calls) <= 2:
+            raise throttling_error()
+        return 'ok'
+
+    assert executor.map(throttled_twice, ['role']) == [('role', 'ok')]
+    # Full jitter over base * 2 ** attempt, capped at max_backoff
+    assert jitter_ranges == [(0, 0.4), (0, 0.5)]
+    assert clock.sleeps == [0.2, 0.25]
+    assert calls == [0.0, 0.2, 0.45]
+    assert executor.failures == []
+
+
+def test_retried_and_failed_counts():
+    clock = FakeClock()
+    executor = make_executor(clock, initial_workers=1, max_attempts=3, uniform=lambda low, high: 0.1)
+    attempts = {}
+
+    def call(item):
+        attempts[item] = attempts.get(item, 0) + 1
+        if item == 'denied':
+            raise ClientError({'Error': {'Code': 'AccessDenied', 'Message': 'no'}}, 'ListRolePolicies')
+        if item == 'always-throttled' or (item == 'throttled-once' and attempts[item] == 1):
+            raise throttling_error()
+        return item.upper()
+
+    results = executor.map(call, ['ok', 'throttled-once', 'denied', 'always-throttled'])
+
+    assert results == [('ok', 'OK'), ('throttled-once', 'THROTTLED-ONCE')]
+    assert [item for item, _ in executor.failures] == ['denied', 'always-throttled']
+    # A non-throttling error is not retried, a throttled item stops after max_attempts
+    assert attempts == {'ok': 1, 'throttled-once': 2, 'denied': 1, 'always-throttled': 3}
+    counts = {key: executor.stats[key] for key in ('items', 'succeeded', 'retried', 'retries', 'throttled', 'failed')}
+    assert counts == {'items': 4, 'succeeded': 2, 'retried': 2, 'retries': 3, 'throttled': 4, 'failed': 2}
+
+
+def test_is_throttling_error():
+    assert adaptive.is_throttling_error(throttling_error())
+    assert not adaptive.is_throttling_error(ClientError({'Error': {'Code': 'AccessDenied'}}, 'ListRoles'))
+    assert not adaptive.is_throttling_error(ValueError('Throttling'))
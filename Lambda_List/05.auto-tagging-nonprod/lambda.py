@@ -1,8 +1,12 @@
 import os
+import json
 import boto3
 import logging
 from datetime import datetime, timedelta
 
+import idempotency
+from idempotency import idempotent
+
 # Standard logging setup
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
@@ -14,6 +18,14 @@ formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(messag
 console_handler.setFormatter(formatter)
 logger.addHandler(console_handler)
 
+# EC2 accepts up to 200 values per filter, so describe_tags checks this many resource IDs per call
+DESCRIBE_TAGS_BATCH_SIZE = 200
+# create_tags accepts up to 1000 resource IDs per call
+CREATE_TAGS_BATCH_SIZE = 1000
+
+# The Lambda's own identity does not change, so it is looked up once per container
+_caller_user = None
+
 # Function to get AWS client
 def get_aws_client(service, region):
     return boto3.client(service, region_name=region)
@@ -36,16 +48,183 @@ def create_tags(ec2_conn, **kwargs):
 def get_tags(ec2_conn, **kwargs):
     return ec2_conn.describe_tags(**kwargs)
 
+def tag_matches(key, value, tag_name, tag_value=None):
+    ''' Check if a tag key/value pair satisfies the requested tag '''
+    return key == tag_name and (value != "" or value == tag_value)
+
+def get_request_tags(detail, resource_type):
+    ''' Get the tags supplied in the request's tagSpecificationSet for a resource type, they are applied at creation '''
+    tag_specifications = (detail.get('requestParameters') or {}).get('tagSpecificationSet', {}).get('items', [])
+    return {
+        tag['key']: tag.get('value', '')
+        for specification in tag_specifications if specification.get('resourceType') == resource_type
+        for tag in specification.get('tags', [])
+    }
+
+def is_tag_in_request(detail, resource_type, tag_name, tag_value=None):
+    ''' Check if a particular tag was supplied with the request, so no API call is needed '''
+    return any(tag_matches(key, value, tag_name, tag_value) for key, value in get_request_tags(detail, resource_type).items())
+
+def has_tag(tags, tag_name, tag_value=None):
+    ''' Check if a dict of tags contains a particular tag with a requested value '''
+    return tag_name in tags and tag_matches(tag_name, tags[tag_name], tag_name, tag_value)
+
+def get_resource_tags(ec2_conn, resource_ids, tag_names):
+    ''' Map resource IDs to their values of the given tag keys, with one describe_tags call per DESCRIBE_TAGS_BATCH_SIZE IDs '''
+    resource_tags = {}
+    for start in range(0, len(resource_ids), DESCRIBE_TAGS_BATCH_SIZE):
+        batch = resource_ids[start:start + DESCRIBE_TAGS_BATCH_SIZE]
+        # Filtering on the keys as well keeps the response to at most len(tag_names) tags per resource
+        response = get_tags(ec2_conn, Filters=[
+            {'Name': 'resource-id', 'Values': batch},
+            {'Name': 'key', 'Values': tag_names}
+        ])
+        if response is None:
+            # call_aws_api already logged the error, reading it as no tags would overwrite the existing ones
+            raise RuntimeError(f"Could not read tags for {len(batch)} resources")
+        for t in response.get('Tags', []):
+            resource_tags.setdefault(t['ResourceId'], {})[t['Key']] = t['Value']
+    return resource_tags
+
+def get_untagged_resource_ids(ec2_conn, resource_ids, tag_name, tag_value=None):
+    ''' Return the resource IDs missing a particular tag '''
+    resource_tags = get_resource_tags(ec2_conn, resource_ids, [tag_name])
+    return [resource_id for resource_id in resource_ids if not has_tag(resource_tags.get(resource_id, {}), tag_name, tag_value)]
+
 def is_tag_present(ec2_conn, resource_id, region, tag_name, tag_value=None):
     ''' Check if a particular tag is present with a requested value '''
-    tags = get_tags(ec2_conn, Filters=[{'Name': 'resource-id', 'Values': [resource_id]}])['Tags']
-    is_present = {True for t in tags if t['Key'] == tag_name and (t['Value'] != "" or t['Value'] == tag_value)}
-    return is_present
+    return not get_untagged_resource_ids(ec2_conn, [resource_id], tag_name, tag_value)
 
 def is_expiry_date_tag_present(ec2_conn, resource_id, region):
     ''' Check if the ExpiryDate tag is present '''
     return is_tag_present(ec2_conn, resource_id, region, 'ExpiryDate')
 
+def get_caller_user(sts_client):
+    ''' Get the IAM user name of the Lambda's own identity '''
+    global _caller_user
+    if _caller_user is None:
+        user_arn = sts_client.get_caller_identity()['Arn']
+        _caller_user = user_arn.split('/')[-1]  # Extract IAM user's name from ARN
+    return _caller_user
+
+def get_event_resources(detail):
+    ''' Get the resource type and resource IDs created by a CloudTrail event, (None, []) if the event is not supported '''
+    eventname = detail['eventName']
+    response = detail['responseElements']
+    if eventname == 'CreateVolume':
+        return 'volume', [response['volumeId']]
+    if eventname == 'RunInstances':
+        return 'instance', [item['instanceId'] for item in response['instancesSet']['items']]
+    if eventname == 'CreateImage':
+        return 'image', [response['imageId']]
+    if eventname == 'CreateSnapshot':
+        return 'snapshot', [response['snapshotId']]
+    if eventname == 'CreateSnapshots':
+        return 'snapshot', [response['CreateSnapshotsResponse']['snapshotSet']['item']['snapshotId']]
+    if eventname == 'CreateSecurityGroup':
+        return 'security-group', [response['groupId']]
+    return None, []
+
+def get_expiry_date(retention_period_days):
+    ''' Calculate expiry date based on retention period '''
+    expiry_date = datetime.now() + timedelta(days=retention_period_days)
+    return expiry_date.strftime('%Y-%m-%d')  # Format expiry date
+
+def handle_sqs_batch(records, context, tag_name, tag_value, retention_period_days):
+    ''' Tag the resources of a batch of CloudTrail events buffered through SQS, grouped per region and CreatedBy value '''
+    failed_message_ids = set()
+    event_ids = {}  # message ID -> claimed event id
+    sts_client = boto3.client('sts')
+    # (region, user) -> {'messages': resource ID -> message ID, 'lookup': IDs to check, 'tag': IDs to tag, 'expiry': snapshot IDs}
+    groups = {}
+
+    for record in records:
+        message_id = record['messageId']
+        try:
+            event = json.loads(record['body'])
+            # SQS delivers at least once too, a message whose event id is completed or in progress is dropped
+            if event.get('id'):
+                if not idempotency.guard.claim(event['id'], idempotency.remaining_seconds(context)):
+                    logger.info(f"Skipping duplicate event {event['id']} in message {message_id}")
+                    continue
+                event_ids[message_id] = event['id']
+            detail = event['detail']
+            if not detail.get('responseElements'):
+                logger.warning(f"No responseElements found in message {message_id}, ErrorCode: {detail.get('errorCode')}")
+                continue
+            if detail['userIdentity']['type'] == 'AssumedRole':
+                user = detail['userIdentity']['arn'].split('/')[-1]
+            else:
+                user = get_caller_user(sts_client)
+            resource_type, resource_ids = get_event_resources(detail)
+        except Exception as e:
+            logger.error(f"Could not read message {message_id}: {str(e)}")
+            failed_message_ids.add(message_id)
+            continue
+
+        if not resource_type:
+            logger.warning(f'Unsupported eventName "{detail["eventName"]}" in message {message_id}')
+            continue
+
+        group = groups.setdefault((event['region'], user), {'messages': {}, 'lookup': [], 'tag': [], 'expiry': []})
+        for resource_id in resource_ids:
+            group['messages'][resource_id] = message_id
+        if resource_type == 'snapshot':
+            # Snapshots always get CreatedBy and are checked for ExpiryDate unless it came with the request
+            group['tag'].extend(resource_ids)
+            if not is_tag_in_request(detail, 'snapshot', 'ExpiryDate'):
+                group['expiry'].extend(resource_ids)
+        elif not is_tag_in_request(detail, resource_type, tag_name, tag_value):
+            group['lookup'].extend(resource_ids)
+
+    expiry_date_str = get_expiry_date(retention_period_days)
+    for (region, user), group in groups.items():
+        # One tag read for the whole group, covering both the CreatedBy lookup and the snapshot ExpiryDate check
+        lookup_ids = group['lookup'] + group['expiry']
+        try:
+            ec2_client = get_aws_client('ec2', region)
+            resource_tags = get_resource_tags(ec2_client, lookup_ids, [tag_name, 'ExpiryDate']) if lookup_ids else {}
+        except Exception as e:
+            # Without a client or the current tags nothing in the group can be tagged safely, all its messages are retried
+            logger.error(f"Error reading tags in {region}: {str(e)}")
+            failed_message_ids.update(group['messages'].values())
+            continue
+        to_tag = group['tag'] + [
+            resource_id for resource_id in group['lookup']
+            if not has_tag(resource_tags.get(resource_id, {}), tag_name, tag_value)
+        ]
+        needs_expiry = {
+            resource_id for resource_id in group['expiry']
+            if not has_tag(resource_tags.get(resource_id, {}), 'ExpiryDate')
+        }
+
+        created_by = [{'Key': 'CreatedBy', 'Value': user}]
+        calls = [
+            ([resource_id for resource_id in to_tag if resource_id not in needs_expiry], created_by),
+            ([resource_id for resource_id in to_tag if resource_id in needs_expiry], created_by + [{'Key': 'ExpiryDate', 'Value': expiry_date_str}]),
+        ]
+        for ids, tags in calls:
+            for start in range(0, len(ids), CREATE_TAGS_BATCH_SIZE):
+                batch = ids[start:start + CREATE_TAGS_BATCH_SIZE]
+                try:
+                    ec2_client.create_tags(Resources=batch, Tags=tags)
+                    logger.info(f"Tagged {len(batch)} resources in {region} with CreatedBy={user}")
+                except Exception as e:
+                    # Only the messages behind this call are retried
+                    logger.error(f"Error applying tags in {region}: {str(e)}")
+                    failed_message_ids.update(group['messages'][resource_id] for resource_id in batch)
+
+    for message_id, event_id in event_ids.items():
+        if message_id in failed_message_ids:
+            idempotency.guard.release(event_id)
+        else:
+            idempotency.guard.complete(event_id)
+
+    logger.info(f"Processed {len(records)} messages in {len(groups)} groups, {len(failed_message_ids)} failed")
+    logger.info(f'Remaining time (ms): {context.get_remaining_time_in_millis()}')
+    return {'batchItemFailures': [{'itemIdentifier': message_id} for message_id in sorted(failed_message_ids)]}
+
+@idempotent
 def lambda_handler(event, context):
     ids = []
     tag_name = os.environ.get('tag_name')
@@ -56,6 +235,10 @@ def lambda_handler(event, context):
         logger.warning('"tag_name" environment variable is not defined')
         return False
 
+    # Events buffered through SQS arrive as a batch of records
+    if 'Records' in event:
+        return handle_sqs_batch(event['Records'], context, tag_name, tag_value, retention_period_days)
+
     region = event['region']
     detail = event['detail']
     eventname = detail['eventName']
@@ -75,9 +258,7 @@ def lambda_handler(event, context):
         logger.info(f"Captured Assumed Role User: {user}")
     else:
         try:
-            caller_identity = sts_client.get_caller_identity()
-            user_arn = caller_identity['Arn']
-            user = user_arn.split('/')[-1]  # Extract IAM user's name from ARN
+            user = get_caller_user(sts_client)
             logger.info(f"Captured IAM User: {user}")
         except Exception as e:
             logger.error(f"Error retrieving caller identity: {str(e)}")
@@ -100,81 +281,41 @@ def lambda_handler(event, context):
     ec2 = boto3.resource('ec2')
     ec2_client = get_aws_client('ec2', region)
 
-    # Depending on event type, extract the resource ID
-    if eventname == 'CreateVolume':
-        resource_id = detail['responseElements']['volumeId']
-        logger.info(f"Checking volume ID {resource_id} for tags")
-        if not is_tag_present(ec2_client, resource_id, region, tag_name, tag_value):
-            ids.append(resource_id)
-
-    elif eventname == 'RunInstances':
-        items = detail['responseElements']['instancesSet']['items']
-        for item in items:
-            resource_id = item['instanceId']
-            logger.info(f"Checking instance ID {resource_id} for tags")
-            if not is_tag_present(ec2_client, resource_id, region, tag_name, tag_value):
-                ids.append(resource_id)
-
-    elif eventname == 'CreateImage':
-        resource_id = detail['responseElements']['imageId']
-        logger.info(f"Checking image ID {resource_id} for tags")
-        if not is_tag_present(ec2_client, resource_id, region, tag_name, tag_value):
-            ids.append(resource_id)
-
-    elif eventname == 'CreateSnapshot':
-        resource_id = detail['responseElements']['snapshotId']
-        logger.info(f"Checking snapshot ID {resource_id} for tags")
+    # Depending on event type, extract the resource IDs
+    resource_type, resource_ids = get_event_resources(detail)
+    tags = [{'Key': 'CreatedBy', 'Value': user}]  # Tagging with the actual user
 
-        # Check if the ExpiryDate tag is already applied
-        if not is_expiry_date_tag_present(ec2_client, resource_id, region):
-            # Calculate expiry date based on retention period
-            expiry_date = datetime.now() + timedelta(days=retention_period_days)
-            expiry_date_str = expiry_date.strftime('%Y-%m-%d')  # Format expiry date
-
-            # Add the ExpiryDate tag
-            try:
-                create_tags(ec2, Resources=[resource_id], Tags=[{'Key': 'ExpiryDate', 'Value': expiry_date_str}])
-                logger.info(f"Successfully tagged snapshot {resource_id} with ExpiryDate: {expiry_date_str}")
-            except Exception as e:
-                logger.error(f"Error applying ExpiryDate tag to snapshot {resource_id}: {str(e)}")
-        else:
-            logger.info(f"Snapshot {resource_id} already has an ExpiryDate tag. Skipping tag application.")
-        ids.append(resource_id)
-    
-    elif eventname == 'CreateSnapshots':
-        resource_id = detail['responseElements']['CreateSnapshotsResponse']['snapshotSet']['item']['snapshotId']
+    if resource_type == 'snapshot':
+        resource_id = resource_ids[0]
         logger.info(f"Checking snapshot ID {resource_id} for tags")
 
-        # Check if the ExpiryDate tag is already applied
-        if not is_expiry_date_tag_present(ec2_client, resource_id, region):
-            # Calculate expiry date based on retention period
-            expiry_date = datetime.now() + timedelta(days=retention_period_days)
-            expiry_date_str = expiry_date.strftime('%Y-%m-%d')  # Format expiry date
-
-            # Add the ExpiryDate tag
-            try:
-                create_tags(ec2, Resources=[resource_id], Tags=[{'Key': 'ExpiryDate', 'Value': expiry_date_str}])
-                logger.info(f"Successfully tagged snapshot {resource_id} with ExpiryDate: {expiry_date_str}")
-            except Exception as e:
-                logger.error(f"Error applying ExpiryDate tag to snapshot {resource_id}: {str(e)}")
+        # Check if the ExpiryDate tag is already applied, in the request or on the snapshot
+        if not is_tag_in_request(detail, 'snapshot', 'ExpiryDate') and not is_expiry_date_tag_present(ec2_client, resource_id, region):
+            expiry_date_str = get_expiry_date(retention_period_days)
+
+            # The ExpiryDate tag goes out in the same create_tags call as CreatedBy
+            tags.append({'Key': 'ExpiryDate', 'Value': expiry_date_str})
+            logger.info(f"Snapshot {resource_id} will be tagged with ExpiryDate: {expiry_date_str}")
         else:
             logger.info(f"Snapshot {resource_id} already has an ExpiryDate tag. Skipping tag application.")
         ids.append(resource_id)
-   
-    elif eventname == 'CreateSecurityGroup':
-        resource_id = detail['responseElements']['groupId']
-        logger.info(f"Checking security group ID {resource_id} for tags")
-        if not is_tag_present(ec2_client, resource_id, region, tag_name, tag_value):
-            ids.append(resource_id)
 
-    else:
+    elif not resource_type:
         logger.warning(f'Unsupported eventName "{eventname}"')
 
-    # Apply tags with 'CreatedBy' as the key and the IAM user's name as the value
+    elif is_tag_in_request(detail, resource_type, tag_name, tag_value):
+        # Tags supplied with the request need no lookup
+        logger.info(f"{tag_name} tag supplied in the request for {resource_type} IDs {resource_ids}, skipping lookup")
+
+    else:
+        logger.info(f"Checking {resource_type} IDs {resource_ids} for tags")
+        ids.extend(get_untagged_resource_ids(ec2_client, resource_ids, tag_name, tag_value))
+
+    # Apply tags with 'CreatedBy' as the key and the IAM user's name as the value, in a single call
     if ids:
         logger.info(f"List of resources to be tagged: {ids}")
         try:
-            create_tags(ec2, Resources=ids, Tags=[{'Key': 'CreatedBy', 'Value': user}])  # Tagging with the actual user
+            create_tags(ec2, Resources=ids, Tags=tags)
             logger.info(f"Successfully tagged resources: {ids}")
         except Exception as e:
             logger.error(f"Error applying tags: {str(e)}")
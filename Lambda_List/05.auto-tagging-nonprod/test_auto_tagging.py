@@ -0,0 +1,169 @@
+import importlib.util
+import json
+import os
+import sys
+
+import boto3
+import pytest
+from botocore.stub import Stubber
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+# The idempotency module ships as a layer, which Lambda puts on the path from /opt/python
+sys.path.insert(0, os.path.join(HERE, '..', '26.idempotency_layer', 'python'))
+
+
+def load_lambda():
+    """Helper function to import this folder's lambda.py under its own module name"""
+    spec = importlib.util.spec_from_file_location('auto_tagging', os.path.join(HERE, 'lambda.py'))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+auto_tagging = load_lambda()
+
+
+def make_client(service_name='ec2'):
+    return boto3.client(
+        service_name, region_name='us-east-1',
+        aws_access_key_id='testing', aws_secret_access_key='testing'
+    )
+
+
+@pytest.fixture
+def ec2():
+    client = make_client()
+    with Stubber(client) as stubber:
+        yield client, stubber
+        stubber.assert_no_pending_responses()
+
+
+def tag_filters(resource_ids, tag_names):
+    return {'Filters': [{'Name': 'resource-id', 'Values': resource_ids}, {'Name': 'key', 'Values': tag_names}]}
+
+
+def test_get_resource_tags_reads_200_ids_per_call(ec2):
+    client, stubber = ec2
+    resource_ids = [f'vol-{index:05d}' for index in range(450)]
+    for start, end in ((0, 200), (200, 400), (400, 450)):
+        stubber.add_response('describe_tags', {'Tags': [
+            {'ResourceId': resource_ids[start], 'Key': 'CreatedBy', 'Value': 'alice'},
+        ]}, tag_filters(resource_ids[start:end], ['CreatedBy', 'ExpiryDate']))
+
+    resource_tags = auto_tagging.get_resource_tags(client, resource_ids, ['CreatedBy', 'ExpiryDate'])
+
+    assert resource_tags == {resource_ids[i]: {'CreatedBy': 'alice'} for i in (0, 200, 400)}
+
+
+def test_get_resource_tags_raises_when_the_read_fails(ec2):
+    client, stubber = ec2
+    stubber.add_client_error('describe_tags', service_error_code='RequestLimitExceeded')
+
+    # An unread batch must not look untagged, or its existing tags would be overwritten
+    with pytest.raises(RuntimeError, match='Could not read tags for 1 resources'):
+        auto_tagging.get_resource_tags(client, ['vol-1'], ['CreatedBy'])
+
+
+def request_detail(*specifications):
+    return {'requestParameters': {'tagSpecificationSet': {'items': [
+        {'resourceType': resource_type, 'tags': [{'key': key, 'value': value} for key, value in tags.items()]}
+        for resource_type, tags in specifications
+    ]}}}
+
+
+def test_is_tag_in_request():
+    detail = request_detail(('volume', {'CreatedBy': 'alice'}), ('snapshot', {'ExpiryDate': ''}))
+
+    assert auto_tagging.is_tag_in_request(detail, 'volume', 'CreatedBy')
+    # The tag has to be on the same resource type, with a value
+    assert not auto_tagging.is_tag_in_request(detail, 'instance', 'CreatedBy')
+    assert not auto_tagging.is_tag_in_request(detail, 'snapshot', 'ExpiryDate')
+    assert not auto_tagging.is_tag_in_request({'requestParameters': None}, 'volume', 'CreatedBy')
+
+
+class FakeContext:
+    def get_remaining_time_in_millis(self):
+        return 30000
+
+
+def sqs_record(message_id, region, user, event_name, response_elements, request_parameters=None):
+    event = {'id': f'evt-{message_id}', 'region': region, 'detail': {
+        'eventName': event_name,
+        'userIdentity': {'type': 'AssumedRole', 'arn': f'arn:aws:sts::111122223333:assumed-role/dev/{user}'},
+        'requestParameters': request_parameters,
+        'responseElements': response_elements,
+    }}
+    return {'messageId': message_id, 'body': json.dumps(event)}
+
+
+@pytest.fixture
+def regional_clients(monkeypatch):
+    monkeypatch.setattr(auto_tagging.idempotency, 'guard', auto_tagging.idempotency.IdempotencyGuard())
+    clients, stubbers = {}, {}
+
+    def get_aws_client(service, region):
+        if region not in clients:
+            raise ValueError(f'Could not connect to the endpoint for {region}')
+        return clients[region]
+
+    def add_region(region):
+        clients[region] = make_client()
+        stubbers[region] = Stubber(clients[region])
+        stubbers[region].activate()
+        return stubbers[region]
+
+    monkeypatch.setattr(auto_tagging, 'get_aws_client', get_aws_client)
+    yield add_region
+    for stubber in stubbers.values():
+        stubber.assert_no_pending_responses()
+        stubber.deactivate()
+
+
+def test_sqs_batch_groups_messages_per_region_and_user(regional_clients):
+    stubber = regional_clients('us-east-1')
+    records = [
+        sqs_record('m1', 'us-east-1', 'alice', 'CreateVolume', {'volumeId': 'vol-1'}),
+        sqs_record('m2', 'us-east-1', 'alice', 'CreateSnapshot', {'snapshotId': 'snap-1'}),
+        sqs_record('m3', 'us-east-1', 'alice', 'CreateVolume', {'volumeId': 'vol-2'}),
+        sqs_record('m4', 'us-east-1', 'alice', 'CreateSnapshot', {'snapshotId': 'snap-2'},
+                   request_detail(('snapshot', {'ExpiryDate': '2030-01-01'}))['requestParameters']),
+    ]
+    # One read for the group, vol-2 is already tagged and snap-1 has no ExpiryDate yet
+    stubber.add_response('describe_tags', {'Tags': [{'ResourceId': 'vol-2', 'Key': 'CreatedBy', 'Value': 'bob'}]},
+                         tag_filters(['vol-1', 'vol-2', 'snap-1'], ['CreatedBy', 'ExpiryDate']))
+    created_by = [{'Key': 'CreatedBy', 'Value': 'alice'}]
+    stubber.add_response('create_tags', {}, {'Resources': ['snap-2', 'vol-1'], 'Tags': created_by})
+    stubber.add_response('create_tags', {}, {'Resources': ['snap-1'], 'Tags': created_by + [
+        {'Key': 'ExpiryDate', 'Value': auto_tagging.get_expiry_date(30)},
+    ]})
+
+    result = auto_tagging.handle_sqs_batch(records, FakeContext(), 'CreatedBy', None, 30)
+
+    assert result == {'batchItemFailures': []}
+
+
+def test_sqs_batch_retries_only_the_failed_groups(regional_clients):
+    east = regional_clients('us-east-1')
+    west = regional_clients('us-west-2')
+    records = [
+        sqs_record('m1', 'us-east-1', 'alice', 'CreateSnapshot', {'snapshotId': 'snap-1'},
+                   request_detail(('snapshot', {'ExpiryDate': '2030-01-01'}))['requestParameters']),
+        sqs_record('m2', 'us-west-2', 'alice', 'CreateSnapshot', {'snapshotId': 'snap-2'},
+                   request_detail(('snapshot', {'ExpiryDate': '2030-01-01'}))['requestParameters']),
+        sqs_record('m3', 'us-west-2', 'bob', 'CreateSnapshot', {'snapshotId': 'snap-3'},
+                   request_detail(('snapshot', {'ExpiryDate': '2030-01-01'}))['requestParameters']),
+        # No client can be built for this region, only its message is retried
+        sqs_record('m4', 'eu-nowhere-1', 'alice', 'CreateSnapshot', {'snapshotId': 'snap-4'}),
+        {'messageId': 'm5', 'body': 'not json'},
+    ]
+    east.add_response('create_tags', {}, {'Resources': ['snap-1'], 'Tags': [{'Key': 'CreatedBy', 'Value': 'alice'}]})
+    west.add_client_error('create_tags', service_error_code='RequestLimitExceeded')
+    west.add_response('create_tags', {}, {'Resources': ['snap-3'], 'Tags': [{'Key': 'CreatedBy', 'Value': 'bob'}]})
+
+    result = auto_tagging.handle_sqs_batch(records, FakeContext(), 'CreatedBy', None, 30)
+
+    assert result == {'batchItemFailures': [{'itemIdentifier': message_id} for message_id in ('m2', 'm4', 'm5')]}
+    # The failed messages' claims are released, so their redelivery is processed
+    guard = auto_tagging.idempotency.guard
+    assert guard.claim('evt-m2') and guard.claim('evt-m4')
+    assert not guard.claim('evt-m1') and not guard.claim('evt-m3')
@@ -1,14 +1,197 @@
 import boto3
 import csv
 import datetime
+import gzip
+import io
+import json
 import os
+import queue
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from itertools import groupby
+from operator import itemgetter
+from botocore.config import Config
 from botocore.exceptions import ClientError
 
-# Clients
-s3_client = boto3.client('s3')
-ec2_client = boto3.client('ec2')
-sts_client = boto3.client('sts')
-optimizer_client = boto3.client('compute-optimizer')
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    # Without pyarrow the columnar output falls back to gzip JSON-lines
+    pa = None
+
+# Clients are created on first use from one shared session and reused across warm invocations
+_session = None
+_clients = {}
+_clients_lock = threading.Lock()
+
+# Every report row falls back to this value for the columns its resource type does not populate
+DEFAULT_VALUE = 'N/A'
+
+# Column schema of the CSV report, the position of a column is its integer slot
+REPORT_COLUMNS = [
+    'ResourceType', 'ResourceID', 'Name', 'Application', 'Environment', 'CreatedBy','ManagedBy', 'AvailabilityZone','VolumeStatus','VolumeIOPS','OptimizerFinding','VolumeSnapshotID','VolumeCreatedDate','VolumeState','VolumeSize','Encryption','VolumeType','RequesterID','AttachmentStatus','VolumeThroughput','AttachedResourceID','InterfaceType','NetworkInterfaceState',
+    'InstanceState', 'InstanceType', 'PrivateIP', 'SubnetID', 'Platform','AttachmentID','KeyName','Monitoring','LaunchTime','PublicIPv4 Address', 'SnapshotVolumeID', 'VPCID','SnapshotState', 'SnapshotStartTime', 'ExpiryDate','NetworkInterfaceStatus','PublicIPv4 DNS','AlarmStatus','StatusCheck','SystemStatusCheck','InboundRulesCount','OutboundRulesCount',
+    'Description','ENIAttachmentStatus', 'AttachedSecurityGroups', 'SnapshotInstanceID', 'SecurityGroups','FullSnapshotSize', 'Progress','AllocationID', 'Owner'
+]
+COLUMN_SLOTS = {column: slot for slot, column in enumerate(REPORT_COLUMNS)}
+
+# Typed columns, rows keep datetimes and ints for these and the CSV formats them on write
+TIMESTAMP_COLUMNS = {
+    'LaunchTime': '%Y-%m-%dT%H:%M:%SZ',
+    'VolumeCreatedDate': '%Y-%m-%d %H:%M',
+    'SnapshotStartTime': '%Y-%m-%d %H:%M',
+}
+INTEGER_COLUMNS = {'VolumeSize', 'VolumeIOPS', 'VolumeThroughput', 'FullSnapshotSize', 'InboundRulesCount', 'OutboundRulesCount'}
+
+
+class RowLayout:
+    """Columns populated by one resource type, mapped to their slots in REPORT_COLUMNS"""
+    __slots__ = ('resource_type', 'columns', 'slots', 'timestamp_formats', 'template')
+
+    def __init__(self, resource_type, columns):
+        self.resource_type = resource_type
+        self.columns = tuple(columns)
+        self.slots = tuple(COLUMN_SLOTS[column] for column in self.columns)
+        self.timestamp_formats = tuple(TIMESTAMP_COLUMNS.get(column) for column in self.columns)
+        self.template = [DEFAULT_VALUE] * len(REPORT_COLUMNS)
+        self.template[COLUMN_SLOTS['ResourceType']] = resource_type
+
+    def pack(self, values):
+        """Keep only the populated values of a row as a tuple in layout order"""
+        return tuple(values[column] for column in self.columns)
+
+    def expand(self, record):
+        """Fill in the defaults of a packed row and return it in REPORT_COLUMNS order, formatted for CSV"""
+        row = list(self.template)
+        for slot, timestamp_format, value in zip(self.slots, self.timestamp_formats, record):
+            if value is None:
+                continue
+            row[slot] = value.strftime(timestamp_format) if timestamp_format else value
+        return row
+
+    @property
+    def table_name(self):
+        return self.resource_type.lower().replace(' ', '_')
+
+
+# S3 multipart parts must be at least 5 MiB, the compressed report is buffered up to this size per part
+MULTIPART_PART_SIZE = max(int(os.environ.get('MULTIPART_PART_SIZE_MB', '8')), 5) * 1024 * 1024
+# Parts uploading in the background while collection continues, this bounds the sink memory
+MULTIPART_UPLOAD_WORKERS = 2
+# Rows per Parquet row group in the columnar output
+COLUMNAR_ROW_GROUP_SIZE = 50000
+
+
+class S3MultipartWriter(io.RawIOBase):
+    """Write-only file object that streams its bytes into an S3 multipart upload, one part per part_size"""
+
+    def __init__(self, s3, bucket, key, part_size=MULTIPART_PART_SIZE, max_pending=MULTIPART_UPLOAD_WORKERS,
+                 content_type='application/gzip'):
+        super().__init__()
+        self.s3 = s3
+        self.bucket = bucket
+        self.key = key
+        self.part_size = part_size
+        self.content_type = content_type
+        # The multipart upload starts with the first full part, a smaller object goes out as one PutObject on close
+        self.upload_id = None
+        self.buffer = bytearray()
+        self.parts = []
+        self.pending = threading.BoundedSemaphore(max_pending)
+        self.executor = ThreadPoolExecutor(max_workers=max_pending)
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.buffer += data
+        if len(self.buffer) >= self.part_size:
+            self._submit_part()
+        return len(data)
+
+    def flush(self):
+        # Parts are only cut at part_size, a flush from the gzip layer must not upload a short part
+        pass
+
+    def _submit_part(self):
+        for future in self.parts:
+            if future.done() and future.exception():
+                raise future.exception()
+        if self.upload_id is None:
+            self.upload_id = self.s3.create_multipart_upload(
+                Bucket=self.bucket, Key=self.key, ContentType=self.content_type
+            )['UploadId']
+        # Blocks collection while max_pending parts are still uploading
+        self.pending.acquire()
+        body = bytes(self.buffer)
+        self.buffer = bytearray()
+        self.parts.append(self.executor.submit(self._upload_part, len(self.parts) + 1, body))
+
+    def _upload_part(self, part_number, body):
+        try:
+            response = self.s3.upload_part(
+                Bucket=self.bucket, Key=self.key, UploadId=self.upload_id,
+                PartNumber=part_number, Body=body
+            )
+            return {'PartNumber': part_number, 'ETag': response['ETag']}
+        finally:
+            self.pending.release()
+
+    def close(self):
+        """Upload the last part and complete the multipart upload, or put the whole object if it never reached a part"""
+        if self.closed:
+            return
+        try:
+            if not self.parts:
+                self.s3.put_object(Bucket=self.bucket, Key=self.key, Body=bytes(self.buffer), ContentType=self.content_type)
+                return
+            if self.buffer:
+                self._submit_part()
+            parts = [future.result() for future in self.parts]
+            self.s3.complete_multipart_upload(
+                Bucket=self.bucket, Key=self.key, UploadId=self.upload_id,
+                MultipartUpload={'Parts': parts}
+            )
+        except Exception:
+            self.abort()
+            raise
+        finally:
+            self.executor.shutdown(wait=True)
+            super().close()
+
+    def abort(self):
+        """Drop the uploaded parts so a failed run does not leave billable parts behind"""
+        if self.closed:
+            return
+        try:
+            self.executor.shutdown(wait=True)
+            if self.upload_id is not None:
+                self.s3.abort_multipart_upload(Bucket=self.bucket, Key=self.key, UploadId=self.upload_id)
+        finally:
+            super().close()
+
+
+TAG_COLUMNS = ['Name', 'Application', 'Environment', 'CreatedBy', 'ManagedBy', 'Owner']
+
+
+def get_client(service_name):
+    """Helper function to return the cached client for a service, created lazily from one shared session"""
+    client = _clients.get(service_name)
+    if client is None:
+        global _session
+        with _clients_lock:
+            client = _clients.get(service_name)
+            if client is None:
+                if _session is None:
+                    _session = boto3.session.Session()
+                # Enough pooled connections for every collector and multipart upload running at once
+                config = Config(max_pool_connections=max(10, COLLECTOR_WORKERS + MULTIPART_UPLOAD_WORKERS))
+                client = _session.client(service_name, config=config)
+                _clients[service_name] = client
+    return client
+
 
 def get_tag_value(tags, key):
     """Helper function to get the value of a tag by its key"""
@@ -18,305 +201,948 @@ def get_tag_value(tags, key):
     return '-'
 
 
-def run_idle_audit(output_file='/tmp/AWS_resource_Reporting_audit.csv', resource_types=None):
-    # Get AWS account and region info
-    account_id = sts_client.get_caller_identity()['Account']
-    region = os.environ['AWS_REGION']
+def get_instance_status_index():
+    """Helper function to map every instance ID to its (instance status, system status) in one paginated sweep"""
+    status_index = {}
+    paginator = get_client('ec2').get_paginator('describe_instance_status')
+    for page in paginator.paginate(IncludeAllInstances=True, PaginationConfig={'PageSize': 1000}):
+        for status in page['InstanceStatuses']:
+            status_index[status['InstanceId']] = (
+                status.get('InstanceStatus', {}).get('Status', 'N/A'),
+                status.get('SystemStatus', {}).get('Status', 'N/A')
+            )
+    return status_index
+
+
+def get_volume_status_index():
+    """Helper function to map every volume ID to its volume status check in one paginated sweep"""
+    status_index = {}
+    paginator = get_client('ec2').get_paginator('describe_volume_status')
+    for page in paginator.paginate(PaginationConfig={'PageSize': 1000}):
+        for status in page['VolumeStatuses']:
+            status_index[status['VolumeId']] = status.get('VolumeStatus', {}).get('Status', 'N/A')
+    return status_index
+
+
+def get_volume_optimizer_index():
+    """Helper function to map every volume ID to its Compute Optimizer finding with account-wide paginated calls"""
+    finding_index = {}
+    request = {'maxResults': 1000}
+    while True:
+        response = get_client('compute-optimizer').get_ebs_volume_recommendations(**request)
+        for recommendation in response.get('volumeRecommendations', []):
+            volume_id = recommendation['volumeArn'].split('/')[-1]
+            finding_index[volume_id] = recommendation.get('finding', 'N/A')
+        if not response.get('nextToken'):
+            break
+        request['nextToken'] = response['nextToken']
+    return finding_index
 
-    if resource_types is None:
-        resource_types = ['EC2', 'EBS', 'Snapshot', 'Network Interface', 'Security Group']
-
-    # Define the headers for the CSV file (to be shown on the first row)
-    all_columns = [
-        'ResourceType', 'ResourceID', 'Name', 'Application', 'Environment', 'CreatedBy','ManagedBy', 'AvailabilityZone','VolumeStatus','VolumeIOPS','OptimizerFinding','VolumeSnapshotID','VolumeCreatedDate','VolumeState','VolumeSize','Encryption','VolumeType','RequesterID','AttachmentStatus','VolumeThroughput','AttachedResourceID','InterfaceType','NetworkInterfaceState',
-        'InstanceState', 'InstanceType', 'PrivateIP', 'SubnetID', 'Platform','AttachmentID','KeyName','Monitoring','LaunchTime','PublicIPv4 Address', 'SnapshotVolumeID', 'VPCID','SnapshotState', 'SnapshotStartTime', 'ExpiryDate','NetworkInterfaceStatus','PublicIPv4 DNS','AlarmStatus','StatusCheck','InboundRulesCount','OutboundRulesCount',
-        'Description','ENIAttachmentStatus', 'AttachedSecurityGroups', 'SnapshotInstanceID', 'SecurityGroups','FullSnapshotSize', 'Progress','AllocationID' 
-        
-    ]
 
-    rows = []  
+# AWS Config resource types the inventory can read from advanced queries, EBS snapshots are not recorded by Config
+CONFIG_RESOURCE_TYPES = {
+    'instances': 'AWS::EC2::Instance',
+    'volumes': 'AWS::EC2::Volume',
+    'network_interfaces': 'AWS::EC2::NetworkInterface',
+    'security_groups': 'AWS::EC2::SecurityGroup',
+}
+# select_resource_config returns at most 100 results per call
+CONFIG_QUERY_PAGE_SIZE = 100
+CONFIG_TIMESTAMP_KEYS = {'LaunchTime', 'CreateTime', 'AttachTime', 'StartTime'}
 
-    # === EC2 ===
-    if 'EC2' in resource_types:
-        paginator = ec2_client.get_paginator('describe_instances')
-        for page in paginator.paginate():
+
+def from_config_document(value, key=None):
+    """Helper function to convert a camelCase AWS Config configuration document to the shape of the EC2 describe APIs"""
+    if isinstance(value, dict):
+        converted = {}
+        for name, item in value.items():
+            # Config writes absent fields as null where the describe APIs omit the key
+            if item is None:
+                continue
+            name = name[:1].upper() + name[1:]
+            converted[name] = from_config_document(item, name)
+        return converted
+    if isinstance(value, list):
+        return [from_config_document(item) for item in value]
+    if key in CONFIG_TIMESTAMP_KEYS and isinstance(value, str):
+        return datetime.datetime.fromisoformat(value.replace('Z', '+00:00'))
+    if key in CONFIG_TIMESTAMP_KEYS and isinstance(value, (int, float)):
+        return datetime.datetime.fromtimestamp(value / 1000, tz=datetime.timezone.utc)
+    return value
+
+
+class DescribeInventory:
+    """Inventory backend that pages the EC2 describe APIs"""
+    name = 'describe'
+
+    def instances(self):
+        for page in get_client('ec2').get_paginator('describe_instances').paginate():
             for reservation in page['Reservations']:
-                for instance in reservation['Instances']:
-                    tags = instance.get('Tags', [])
-                    instance_id = instance['InstanceId']
-                    name = get_tag_value(tags, 'Name')
-                    application = get_tag_value(tags, 'Application')
-                    environment = get_tag_value(tags, 'Environment')
-                    created_by = get_tag_value(tags, 'CreatedBy')
-                    managed_by = get_tag_value(tags, 'ManagedBy')
-                    availability_zone = instance.get('Placement', {}).get('AvailabilityZone', 'N/A')
-                    instance_state = instance['State']['Name']
-                    instance_type = instance.get('InstanceType', 'N/A')
-                    private_ip = instance.get('PrivateIpAddress', 'N/A')
-                    public_ip = instance.get('PublicIpAddress', 'N/A')
-                    public_dns = instance.get('PublicDnsName', 'N/A')
-                    key_name = instance.get('KeyName', 'N/A')
-                    subnet_id = instance.get('SubnetId', 'N/A')
-                    launch_time = instance.get('LaunchTime').strftime('%Y-%m-%dT%H:%M:%SZ') if instance.get('LaunchTime') else 'N/A'
-                    monitoring = instance.get('Monitoring', {}).get('State', 'N/A')
-                    security_groups = ", ".join([sg.get('GroupName', sg.get('GroupId')) for sg in instance.get('SecurityGroups', [])]) or 'N/A'
-                    platform_details = instance.get('PlatformDetails', 'Linux/UNIX')
-                    platform = 'Windows' if 'windows' in platform_details.lower() else 'Linux/UNIX'
-
-                    try:
-                        status_resp = ec2_client.describe_instance_status(InstanceIds=[instance_id])
-                        instance_status = status_resp['InstanceStatuses'][0]['InstanceStatus']['Status'] if status_resp['InstanceStatuses'] else 'N/A'
-                    except ClientError:
-                        instance_status = 'Error'
-
-                    row = {
-                        'ResourceType': 'EC2',
-                        'ResourceID': instance_id,
-                        'Name': name,
-                        'Application': application,
-                        'Environment': environment,
-                        'CreatedBy': created_by,
-                        'ManagedBy': managed_by,
-                        'AvailabilityZone': availability_zone,
-                        'InstanceState': instance_state,
-                        'InstanceType': instance_type,
-                        'PrivateIP': private_ip,
-                        'PublicIPv4 Address': public_ip,
-                        'PublicIPv4 DNS': public_dns,
-                        'Monitoring': monitoring,
-                        'SecurityGroups': security_groups,
-                        'KeyName': key_name,
-                        'LaunchTime': launch_time,
-                        'Platform': platform,
-                        'SubnetID': subnet_id,
-                        'StatusCheck': instance_status,
-                        'VPCID': instance.get('VpcId', 'N/A'),
-                        'AlarmStatus': 'N/A',
-                        'VolumeStatus': 'N/A', 'VolumeIOPS': 'N/A', 'VolumeSnapshotID': 'N/A', 'VolumeCreatedDate': 'N/A',
-                        'SnapshotState': 'N/A', 'SnapshotStartTime': 'N/A', 'SnapshotVolumeID': 'N/A', 'SnapshotInstanceID': 'N/A',
-                        'FullSnapshotSize': 'N/A', 'Progress': 'N/A', 'VolumeSize': 'N/A', 'Encryption': 'N/A', 'VolumeType': 'N/A',
-                        'VolumeThroughput': 'N/A', 'AttachedResourceID': 'N/A', 'NetworkInterfaceState': 'N/A',
-                        'AllocationID': 'N/A',  'RequesterID': 'N/A', 'AttachmentStatus': 'N/A','Description': 'N/A',
-                        'AttachmentID': 'N/A', 'ENIAttachmentStatus': 'N/A', 'AttachedSecurityGroups': 'N/A', 'InterfaceType': 'N/A'
-                    }
-                    rows.append(row)
-    # === EBS ===
-    if 'EBS' in resource_types:
-        paginator = ec2_client.get_paginator('describe_volumes')
-        for page in paginator.paginate():
-            for volume in page['Volumes']:
-                tags = volume.get('Tags', [])
-                volume_id = volume['VolumeId']
-                attached_resource_id = volume['Attachments'][0].get('InstanceId', 'N/A') if volume['Attachments'] else '-'
-                volume_state = volume.get('State', 'N/A')
-                volume_type = volume.get('VolumeType', 'N/A')
-                volume_iops = volume.get('Iops', 'N/A')
-                volume_throughput = volume.get('Throughput', 'N/A')
-                availability_zone = volume.get('AvailabilityZone', 'N/A')
-                optimizer_finding = 'NotAvailable'
-                volume_status_check = 'N/A'
-
-                try:
-                    status_response = ec2_client.describe_volume_status(VolumeIds=[volume_id])
-                    if status_response['VolumeStatuses']:
-                        volume_status_check = status_response['VolumeStatuses'][0].get('VolumeStatus', {}).get('Status', 'N/A')
-                except ClientError:
-                    pass
-
-                try:
-                    volume_arn = f"arn:aws:ec2:{region}:{account_id}:volume/{volume_id}"
-                    opt_response = optimizer_client.get_ebs_volume_recommendations(VolumeArns=[volume_arn])
-                    if opt_response['VolumeRecommendations']:
-                        optimizer_finding = opt_response['VolumeRecommendations'][0].get('Finding', 'N/A')
-                except Exception:
-                    pass
-
-                row = {
-                    'ResourceType': 'EBS',
-                    'ResourceID': volume_id,
-                    'Name': get_tag_value(tags, 'Name'),
-                    'Application': get_tag_value(tags, 'Application'),
-                    'Environment': get_tag_value(tags, 'Environment'),
-                    'CreatedBy': get_tag_value(tags, 'CreatedBy'),
-                    'ManagedBy': get_tag_value(tags, 'ManagedBy'),
-                    'AvailabilityZone': availability_zone,
-                    'VolumeStatus': 'Attached' if volume['Attachments'] else 'Not Attached',
-                    'VolumeIOPS': volume_iops,
-                    'VolumeSnapshotID': volume.get('SnapshotId', 'N/A'),
-                    'VolumeCreatedDate': volume['CreateTime'].strftime('%Y-%m-%d %H:%M'),
-                    'VolumeState': volume_state,
-                    'OptimizerFinding': optimizer_finding,
-                    'VolumeType': volume_type,
-                    'StatusCheck': volume_status_check,
-                    'VolumeThroughput': volume_throughput,'VolumeSize': volume.get('Size', 'N/A'),
-                    'AttachedResourceID': attached_resource_id,'Encryption': 'Yes' if volume.get('Encrypted', False) else 'No',
-                    'InstanceState': 'N/A', 'InstanceType': 'N/A', 'PrivateIP': 'N/A', 'PublicIPv4 Address': 'N/A', 'PublicIPv4 DNS': 'N/A', 
-                    'Monitoring': 'N/A', 'SecurityGroups': 'N/A', 'KeyName': 'N/A', 'LaunchTime': 'N/A', 'Platform': 'N/A', 'SubnetID': 'N/A',
-                    'AlarmStatus': 'N/A', 'SnapshotState': 'N/A', 'SnapshotStartTime': 'N/A', 'SnapshotVolumeID': 'N/A',
-                    'SnapshotInstanceID': 'N/A', 'FullSnapshotSize': 'N/A', 'Progress': 'N/A','NetworkInterfaceState': 'N/A', 'AllocationID': 'N/A',
-                    'VPCID': 'N/A', 'RequesterID': 'N/A', 'AttachmentStatus': 'N/A', 'AttachmentID': 'N/A', 'ENIAttachmentStatus': 'N/A',
-                    'AttachedSecurityGroups': 'N/A', 'InterfaceType': 'N/A', 'Description': 'N/A'
-                }
-                rows.append(row)
-
-    # === Snapshots ===
-    if 'Snapshot' in resource_types:
-        paginator = ec2_client.get_paginator('describe_snapshots')
-        for page in paginator.paginate(OwnerIds=['self']):
-            for snapshot in page['Snapshots']:
-                tags = snapshot.get('Tags', [])
-                row = {
-                    'ResourceType': 'Snapshot',
-                    'ResourceID': snapshot['SnapshotId'],
-                    'Name': get_tag_value(tags, 'Name'),
-                    'Application': get_tag_value(tags, 'Application'),
-                    'Environment': get_tag_value(tags, 'Environment'),
-                    'CreatedBy': get_tag_value(tags, 'CreatedBy'),
-                    'ManagedBy': get_tag_value(tags, 'ManagedBy'),
-                    'AvailabilityZone': 'N/A',
-                    'SnapshotState': snapshot['State'],
-                    'ExpiryDate': get_tag_value(tags, 'ExpiryDate'),
-                    'VolumeCreatedDate': snapshot['StartTime'].strftime('%Y-%m-%d %H:%M'),
-                    'SnapshotStartTime': snapshot['StartTime'].strftime('%Y-%m-%d %H:%M'),
-                    'SnapshotVolumeID': snapshot.get('VolumeId', 'N/A'),
-                    'SnapshotInstanceID': get_tag_value(tags, 'InstanceId'),
-                    'FullSnapshotSize': snapshot.get('VolumeSize', 'N/A'),
-                    'Progress': snapshot.get('Progress', 'N/A'),
-                    'VolumeSize': snapshot.get('VolumeSize', 'N/A'),
-                    'Encryption': 'Yes' if snapshot.get('Encrypted', False) else 'No',
-                    'InstanceState': 'N/A', 'InstanceType': 'N/A', 'PrivateIP': 'N/A', 'PublicIPv4 Address': 'N/A', 'PublicIPv4 DNS': 'N/A', 
-                    'Monitoring': 'N/A', 'SecurityGroups': 'N/A', 'KeyName': 'N/A', 'LaunchTime': 'N/A', 'Platform': 'N/A', 'SubnetID': 'N/A',
-                    'AlarmStatus': 'N/A', 'VolumeStatus': 'N/A', 'VolumeIOPS': 'N/A', 'VolumeSnapshotID': 'N/A',
-                    'VolumeState': 'N/A', 'VolumeType': 'N/A', 'StatusCheck': 'N/A', 'VolumeThroughput': 'N/A', 'AttachedResourceID': 'N/A',
-                    'NetworkInterfaceState': 'N/A', 'AllocationID': 'N/A', 'VPCID': 'N/A', 'RequesterID': 'N/A', 'AttachmentStatus': 'N/A',
-                    'AttachmentID': 'N/A', 'ENIAttachmentStatus': 'N/A', 'AttachedSecurityGroups': 'N/A', 'InterfaceType': 'N/A', 'Description': 'N/A'
-                }
-                rows.append(row)
-
-
-    # === ENIs ===
-    if 'Network Interface' in resource_types:
-        paginator = ec2_client.get_paginator('describe_network_interfaces')
-        for page in paginator.paginate():
-            for eni in page['NetworkInterfaces']:
-                tags = eni.get('Tags', [])
-                attachment = eni.get('Attachment', {})
-                association = eni.get('Association', {})
-                row = {
-                   'ResourceType': 'Network Interface',
-                   'ResourceID': eni['NetworkInterfaceId'],
-                   'Name': get_tag_value(tags, 'Name'),
-                   'Application': get_tag_value(tags, 'Application'),
-                   'Environment': get_tag_value(tags, 'Environment'),
-                   'CreatedBy': get_tag_value(tags, 'CreatedBy'),
-                   'ManagedBy': get_tag_value(tags, 'ManagedBy'),
-                   'AvailabilityZone': eni.get('AvailabilityZone', 'N/A'),
-                   'PrivateIP': eni.get('PrivateIpAddress', 'N/A'),
-                   'PublicIPv4 Address': association.get('PublicIp', 'N/A'),
-                   'AllocationID': association.get('AllocationId', '-'),'SubnetID': eni.get('SubnetId', 'N/A'),
-                   'VPCID': eni.get('VpcId', '-'), 'RequesterID': eni.get('RequesterId', '-'),
-                   'AttachedSecurityGroups': ', '.join([sg.get('GroupName', 'N/A') for sg in eni.get('Groups', [])]),
-                   'NetworkInterfaceState': eni.get('Status', 'N/A'),'AttachmentStatus': attachment.get('Status', 'N/A'),'AttachmentID': attachment.get('AttachmentId', 'N/A'),
-                   'ENIAttachmentStatus': attachment.get('Status', 'N/A'),
-                   'InterfaceType': eni.get('InterfaceType', 'N/A'),'Description': eni.get('Description', 'N/A'),
-                   'PublicIPv4 DNS': 'N/A',
-                   'Monitoring': 'N/A', 'SecurityGroups': 'N/A', 'KeyName': 'N/A', 'LaunchTime': 'N/A', 'Platform': 'N/A', 
-                   'AlarmStatus': 'N/A', 'InstanceState': 'N/A', 'InstanceType': 'N/A', 'VolumeStatus': 'N/A', 'VolumeIOPS': 'N/A',
-                   'VolumeSnapshotID': 'N/A', 'VolumeCreatedDate': 'N/A', 'VolumeState': 'N/A', 'SnapshotState': 'N/A', 'SnapshotStartTime': 'N/A',
-                   'SnapshotVolumeID': 'N/A', 'SnapshotInstanceID': 'N/A', 'FullSnapshotSize': 'N/A', 'Progress': 'N/A', 'VolumeSize': 'N/A',
-                   'Encryption': 'N/A', 'VolumeType': 'N/A', 'StatusCheck': 'N/A', 'VolumeThroughput': 'N/A', 'AttachedResourceID': 'N/A',
-                   
-                }
-                rows.append(row)
-                
-    # === Security Groups ===
-    if 'Security Group' in resource_types:
-        paginator = ec2_client.get_paginator('describe_security_groups')
-        for page in paginator.paginate():
-            for sg in page['SecurityGroups']:
-                tags = sg.get('Tags', [])
-                sg_id = sg['GroupId']
-                name = get_tag_value(tags, 'Name') or sg.get('GroupName', 'N/A')
-                vpc_id = sg.get('VpcId', 'N/A')
-                description = sg.get('Description', 'N/A')
-
-                inbound_count = len(sg.get('IpPermissions', []))
-                outbound_count = len(sg.get('IpPermissionsEgress', []))
-                
-                row = {
-                    'ResourceType': 'Security Group',
-                    'ResourceID': sg_id,
-                    'Name': name,
-                    'Description': description,
-                    'VPCID': vpc_id,'CreatedBy': get_tag_value(tags, 'CreatedBy'), 
-                    'ManagedBy': get_tag_value(tags, 'ManagedBy'), 'Application': get_tag_value(tags, 'Application'), 
-                    'Environment': get_tag_value(tags, 'Environment'), 'VolumeType': 'N/A', 
-                    'InboundRulesCount': inbound_count,'OutboundRulesCount': outbound_count,
-                    'AttachedSecurityGroups': 'N/A',
-                    'SecurityGroups': 'N/A', 
-                    'InstanceState': 'N/A', 'InstanceType': 'N/A', 'PrivateIP': 'N/A', 'PublicIPv4 Address': 'N/A', 
-                    'PublicIPv4 DNS': 'N/A', 'Monitoring': 'N/A', 'KeyName': 'N/A', 'LaunchTime': 'N/A', 'Platform': 'N/A', 
-                    'SubnetID': 'N/A', 'AlarmStatus': 'N/A', 'VolumeStatus': 'N/A', 'VolumeIOPS': 'N/A', 
-                    'VolumeSnapshotID': 'N/A', 'VolumeCreatedDate': 'N/A', 'VolumeState': 'N/A', 'SnapshotState': 'N/A', 
-                    'SnapshotStartTime': 'N/A', 'SnapshotVolumeID': 'N/A', 'SnapshotInstanceID': 'N/A', 
-                    'FullSnapshotSize': 'N/A', 'Progress': 'N/A', 'VolumeSize': 'N/A', 'Encryption': 'N/A', 'VolumeType': 'N/A', 
-                    'StatusCheck': 'N/A', 'VolumeThroughput': 'N/A', 'AttachedResourceID': 'N/A', 
-                    'NetworkInterfaceState': 'N/A', 'AllocationID': 'N/A', 'RequesterID': 'N/A', 'AttachmentStatus': 'N/A', 
-                    'AttachmentID': 'N/A', 'ENIAttachmentStatus': 'N/A', 'InterfaceType': 'N/A', 
-                    'AvailabilityZone': 'N/A'
-                }
+                yield from reservation['Instances']
+
+    def volumes(self):
+        for page in get_client('ec2').get_paginator('describe_volumes').paginate():
+            yield from page['Volumes']
+
+    def snapshots(self):
+        for page in get_client('ec2').get_paginator('describe_snapshots').paginate(OwnerIds=['self']):
+            yield from page['Snapshots']
+
+    def network_interfaces(self):
+        for page in get_client('ec2').get_paginator('describe_network_interfaces').paginate():
+            yield from page['NetworkInterfaces']
 
-                for col in all_columns:
-                    row.setdefault(col, 'N/A')
+    def security_groups(self):
+        for page in get_client('ec2').get_paginator('describe_security_groups').paginate():
+            yield from page['SecurityGroups']
+
+
+class ConfigInventory(DescribeInventory):
+    """Inventory backend that reads AWS Config advanced queries (or an aggregator), falling back to describe calls"""
+    name = 'config'
+
+    def __init__(self, recorded_types, aggregator=None, account_id=None):
+        self.recorded_types = recorded_types
+        self.aggregator = aggregator
+        self.account_id = account_id
+
+    def select(self, expression, next_token=None):
+        request = {'Expression': expression, 'Limit': CONFIG_QUERY_PAGE_SIZE}
+        if next_token:
+            request['NextToken'] = next_token
+        if self.aggregator:
+            return get_client('config').select_aggregate_resource_config(ConfigurationAggregatorName=self.aggregator, **request)
+        return get_client('config').select_resource_config(**request)
+
+    def query(self, kind):
+        """Return describe-shaped records of one kind from Config, or None when the describe APIs must be used"""
+        resource_type = CONFIG_RESOURCE_TYPES[kind]
+        if resource_type not in self.recorded_types:
+            return None
+        condition = ''
+        if self.aggregator:
+            # The report and its Region column cover this account and region only
+            condition = f" AND accountId = '{self.account_id}' AND awsRegion = '{get_client('config').meta.region_name}'"
+        expression = f"SELECT resourceId, configuration, tags WHERE resourceType = '{resource_type}'{condition}"
+        # The first page decides the backend, so a fallback never repeats records already handed out
+        try:
+            page = self.select(expression)
+        except ClientError as e:
+            print(f"Config query for {resource_type} failed, using describe calls: {e}")
+            return None
+        return self.iter_results(expression, page)
+
+    def iter_results(self, expression, page):
+        while True:
+            for result in page.get('Results', []):
+                item = json.loads(result)
+                record = from_config_document(item.get('configuration') or {})
+                record['Tags'] = from_config_document(item.get('tags') or [])
+                yield record
+            if not page.get('NextToken'):
+                return
+            page = self.select(expression, page['NextToken'])
+
+    def instances(self):
+        return self.query('instances') or super().instances()
+
+    def volumes(self):
+        return self.query('volumes') or super().volumes()
+
+    def network_interfaces(self):
+        return self.query('network_interfaces') or super().network_interfaces()
+
+    def security_groups(self):
+        return self.query('security_groups') or super().security_groups()
+
+
+def get_recorded_resource_types():
+    """Helper function to list the CONFIG_RESOURCE_TYPES this account's Config recorder is recording"""
+    config = get_client('config')
+    statuses = config.describe_configuration_recorder_status()['ConfigurationRecordersStatus']
+    if not any(status.get('recording') for status in statuses):
+        return set()
+
+    supported = set(CONFIG_RESOURCE_TYPES.values())
+    recorded = set()
+    for recorder in config.describe_configuration_recorders()['ConfigurationRecorders']:
+        group = recorder.get('recordingGroup', {})
+        strategy = group.get('recordingStrategy', {}).get('useOnly')
+        if group.get('allSupported') or strategy == 'ALL_SUPPORTED_RESOURCE_TYPES':
+            recorded |= supported
+        elif strategy == 'EXCLUSION_BY_RESOURCE_TYPES':
+            recorded |= supported - set(group.get('exclusionByResourceTypes', {}).get('resourceTypes', []))
+        else:
+            recorded |= supported & set(group.get('resourceTypes', []))
+    return recorded
+
+
+def get_inventory():
+    """Helper function to pick the inventory backend from INVENTORY_BACKEND (auto, config or describe)"""
+    backend = os.environ.get('INVENTORY_BACKEND', 'auto')
+    aggregator = os.environ.get('CONFIG_AGGREGATOR_NAME') or None
+    if backend == 'describe':
+        return DescribeInventory()
+    if aggregator:
+        # An aggregator is trusted for every type, failed queries still fall back
+        account_id = get_client('sts').get_caller_identity()['Account']
+        return ConfigInventory(set(CONFIG_RESOURCE_TYPES.values()), aggregator, account_id)
+    if backend == 'config':
+        return ConfigInventory(set(CONFIG_RESOURCE_TYPES.values()))
+    try:
+        recorded = get_recorded_resource_types()
+    except ClientError as e:
+        print(f"AWS Config recorder status unavailable, using describe calls: {e}")
+        recorded = set()
+    return ConfigInventory(recorded) if recorded else DescribeInventory()
+
+
+class ResourceCollector:
+    """Base class for one resource type of the audit, register subclasses with @register_collector"""
+    resource_type = None
+    # Report columns this resource type populates, everything else is filled with DEFAULT_VALUE
+    columns = []
+    # IAM actions the collector needs, reported when the collector is denied
+    api_calls = ()
+    layout = None
+
+    def __init__(self, inventory):
+        self.inventory = inventory
+
+    def collect(self):
+        """Yield packed rows for this resource type"""
+        raise NotImplementedError
+
+
+# Registered collectors by resource type, in report order
+COLLECTORS = {}
+# Collectors running at the same time, each one pages its own describe API
+COLLECTOR_WORKERS = int(os.environ.get('COLLECTOR_WORKERS', '5'))
+# Rows each collector may have waiting for the writer, this bounds the rows held in memory
+COLLECTOR_QUEUE_SIZE = int(os.environ.get('COLLECTOR_QUEUE_SIZE', '5000'))
+# How often a collector blocked on a full queue checks whether the writer has stopped
+COLLECTOR_QUEUE_POLL_SECONDS = 1
+# Marks the end of one collector's rows in its queue
+END_OF_ROWS = object()
+
+
+def register_collector(cls):
+    """Helper decorator to add a collector class to the registry and build its row layout"""
+    cls.layout = RowLayout(cls.resource_type, cls.columns)
+    COLLECTORS[cls.resource_type] = cls
+    return cls
+
+
+@register_collector
+class EC2Collector(ResourceCollector):
+    """Running and stopped instances joined to their instance and system status checks"""
+    resource_type = 'EC2'
+    columns = ['ResourceID'] + TAG_COLUMNS + [
+        'AvailabilityZone', 'InstanceState', 'InstanceType', 'PrivateIP', 'PublicIPv4 Address', 'PublicIPv4 DNS',
+        'Monitoring', 'SecurityGroups', 'KeyName', 'LaunchTime', 'Platform', 'SubnetID', 'StatusCheck',
+        'SystemStatusCheck', 'VPCID'
+    ]
+    api_calls = ('ec2:DescribeInstances', 'ec2:DescribeInstanceStatus')
+
+    def collect(self):
+        # One status sweep for all instances, joined to the instance inventory in memory
+        missing_status = ('N/A', 'N/A')
+        try:
+            status_index = get_instance_status_index()
+        except ClientError:
+            status_index = {}
+            missing_status = ('Error', 'Error')
+
+        for instance in self.inventory.instances():
+            tags = instance.get('Tags', [])
+            instance_id = instance['InstanceId']
+            name = get_tag_value(tags, 'Name')
+            application = get_tag_value(tags, 'Application')
+            environment = get_tag_value(tags, 'Environment')
+            created_by = get_tag_value(tags, 'CreatedBy')
+            managed_by = get_tag_value(tags, 'ManagedBy')
+            owner = get_tag_value(tags, 'Owner')
+            availability_zone = instance.get('Placement', {}).get('AvailabilityZone', 'N/A')
+            instance_state = instance['State']['Name']
+            instance_type = instance.get('InstanceType', 'N/A')
+            private_ip = instance.get('PrivateIpAddress', 'N/A')
+            public_ip = instance.get('PublicIpAddress', 'N/A')
+            public_dns = instance.get('PublicDnsName', 'N/A')
+            key_name = instance.get('KeyName', 'N/A')
+            subnet_id = instance.get('SubnetId', 'N/A')
+            launch_time = instance.get('LaunchTime')
+            monitoring = instance.get('Monitoring', {}).get('State', 'N/A')
+            security_groups = ", ".join([sg.get('GroupName', sg.get('GroupId')) for sg in instance.get('SecurityGroups', [])]) or 'N/A'
+            platform_details = instance.get('PlatformDetails', 'Linux/UNIX')
+            platform = 'Windows' if 'windows' in platform_details.lower() else 'Linux/UNIX'
+
+            instance_status, system_status = status_index.get(instance_id, missing_status)
+
+            yield self.layout.pack({
+                'ResourceID': instance_id,
+                'Name': name,
+                'Application': application,
+                'Environment': environment,
+                'CreatedBy': created_by,
+                'ManagedBy': managed_by,
+                'Owner': owner,
+                'AvailabilityZone': availability_zone,
+                'InstanceState': instance_state,
+                'InstanceType': instance_type,
+                'PrivateIP': private_ip,
+                'PublicIPv4 Address': public_ip,
+                'PublicIPv4 DNS': public_dns,
+                'Monitoring': monitoring,
+                'SecurityGroups': security_groups,
+                'KeyName': key_name,
+                'LaunchTime': launch_time,
+                'Platform': platform,
+                'SubnetID': subnet_id,
+                'StatusCheck': instance_status,
+                'SystemStatusCheck': system_status,
+                'VPCID': instance.get('VpcId', 'N/A'),
+            })
+
+
+@register_collector
+class EBSCollector(ResourceCollector):
+    """Volumes joined to their volume status checks and Compute Optimizer findings"""
+    resource_type = 'EBS'
+    columns = ['ResourceID'] + TAG_COLUMNS + [
+        'AvailabilityZone', 'VolumeStatus', 'VolumeIOPS', 'VolumeSnapshotID', 'VolumeCreatedDate', 'VolumeState',
+        'OptimizerFinding', 'VolumeType', 'StatusCheck', 'VolumeThroughput', 'VolumeSize', 'AttachedResourceID',
+        'Encryption'
+    ]
+    api_calls = ('ec2:DescribeVolumes', 'ec2:DescribeVolumeStatus', 'compute-optimizer:GetEBSVolumeRecommendations')
+
+    def collect(self):
+        # Volume status and Compute Optimizer findings are fetched in bulk and joined in memory
+        try:
+            volume_status_index = get_volume_status_index()
+        except ClientError:
+            volume_status_index = {}
+        try:
+            optimizer_index = get_volume_optimizer_index()
+        except Exception:
+            # Compute Optimizer is opt-in, accounts without it get 'NotAvailable'
+            optimizer_index = {}
+
+        for volume in self.inventory.volumes():
+            tags = volume.get('Tags', [])
+            volume_id = volume['VolumeId']
+            attached_resource_id = volume['Attachments'][0].get('InstanceId', 'N/A') if volume['Attachments'] else '-'
+            volume_state = volume.get('State', 'N/A')
+            volume_type = volume.get('VolumeType', 'N/A')
+            volume_iops = volume.get('Iops')
+            volume_throughput = volume.get('Throughput')
+            availability_zone = volume.get('AvailabilityZone', 'N/A')
+            optimizer_finding = optimizer_index.get(volume_id, 'NotAvailable')
+            volume_status_check = volume_status_index.get(volume_id, 'N/A')
+
+            yield self.layout.pack({
+                'ResourceID': volume_id,
+                'Name': get_tag_value(tags, 'Name'),
+                'Application': get_tag_value(tags, 'Application'),
+                'Environment': get_tag_value(tags, 'Environment'),
+                'CreatedBy': get_tag_value(tags, 'CreatedBy'),
+                'ManagedBy': get_tag_value(tags, 'ManagedBy'),
+                'Owner': get_tag_value(tags, 'Owner'),
+                'AvailabilityZone': availability_zone,
+                'VolumeStatus': 'Attached' if volume['Attachments'] else 'Not Attached',
+                'VolumeIOPS': volume_iops,
+                'VolumeSnapshotID': volume.get('SnapshotId', 'N/A'),
+                'VolumeCreatedDate': volume['CreateTime'],
+                'VolumeState': volume_state,
+                'OptimizerFinding': optimizer_finding,
+                'VolumeType': volume_type,
+                'StatusCheck': volume_status_check,
+                'VolumeThroughput': volume_throughput,'VolumeSize': volume.get('Size'),
+                'AttachedResourceID': attached_resource_id,'Encryption': 'Yes' if volume.get('Encrypted', False) else 'No',
+            })
+
+
+@register_collector
+class SnapshotCollector(ResourceCollector):
+    """Snapshots owned by the account with their ExpiryDate tag"""
+    resource_type = 'Snapshot'
+    columns = ['ResourceID'] + TAG_COLUMNS + [
+        'SnapshotState', 'ExpiryDate', 'VolumeCreatedDate', 'SnapshotStartTime', 'SnapshotVolumeID',
+        'SnapshotInstanceID', 'FullSnapshotSize', 'Progress', 'VolumeSize', 'Encryption'
+    ]
+    api_calls = ('ec2:DescribeSnapshots',)
+
+    def collect(self):
+        for snapshot in self.inventory.snapshots():
+            tags = snapshot.get('Tags', [])
+            yield self.layout.pack({
+                'ResourceID': snapshot['SnapshotId'],
+                'Name': get_tag_value(tags, 'Name'),
+                'Application': get_tag_value(tags, 'Application'),
+                'Environment': get_tag_value(tags, 'Environment'),
+                'CreatedBy': get_tag_value(tags, 'CreatedBy'),
+                'ManagedBy': get_tag_value(tags, 'ManagedBy'),
+                'Owner': get_tag_value(tags, 'Owner'),
+                'SnapshotState': snapshot['State'],
+                'ExpiryDate': get_tag_value(tags, 'ExpiryDate'),
+                'VolumeCreatedDate': snapshot['StartTime'],
+                'SnapshotStartTime': snapshot['StartTime'],
+                'SnapshotVolumeID': snapshot.get('VolumeId', 'N/A'),
+                'SnapshotInstanceID': get_tag_value(tags, 'InstanceId'),
+                'FullSnapshotSize': snapshot.get('VolumeSize'),
+                'Progress': snapshot.get('Progress', 'N/A'),
+                'VolumeSize': snapshot.get('VolumeSize'),
+                'Encryption': 'Yes' if snapshot.get('Encrypted', False) else 'No',
+            })
+
+
+@register_collector
+class NetworkInterfaceCollector(ResourceCollector):
+    """Network interfaces with their attachment and association"""
+    resource_type = 'Network Interface'
+    columns = ['ResourceID'] + TAG_COLUMNS + [
+        'AvailabilityZone', 'PrivateIP', 'PublicIPv4 Address', 'AllocationID', 'SubnetID', 'VPCID', 'RequesterID',
+        'AttachedSecurityGroups', 'NetworkInterfaceState', 'AttachmentStatus', 'AttachmentID', 'ENIAttachmentStatus',
+        'InterfaceType', 'Description'
+    ]
+    api_calls = ('ec2:DescribeNetworkInterfaces',)
 
-                rows.append(row)
-           
+    def collect(self):
+        for eni in self.inventory.network_interfaces():
+            tags = eni.get('Tags', [])
+            attachment = eni.get('Attachment') or {}
+            association = eni.get('Association') or {}
+            yield self.layout.pack({
+               'ResourceID': eni['NetworkInterfaceId'],
+               'Name': get_tag_value(tags, 'Name'),
+               'Application': get_tag_value(tags, 'Application'),
+               'Environment': get_tag_value(tags, 'Environment'),
+               'CreatedBy': get_tag_value(tags, 'CreatedBy'),
+               'ManagedBy': get_tag_value(tags, 'ManagedBy'),
+               'Owner': get_tag_value(tags, 'Owner'),
+               'AvailabilityZone': eni.get('AvailabilityZone', 'N/A'),
+               'PrivateIP': eni.get('PrivateIpAddress', 'N/A'),
+               'PublicIPv4 Address': association.get('PublicIp', 'N/A'),
+               'AllocationID': association.get('AllocationId', '-'),'SubnetID': eni.get('SubnetId', 'N/A'),
+               'VPCID': eni.get('VpcId', '-'), 'RequesterID': eni.get('RequesterId', '-'),
+               'AttachedSecurityGroups': ', '.join([sg.get('GroupName', 'N/A') for sg in eni.get('Groups', [])]),
+               'NetworkInterfaceState': eni.get('Status', 'N/A'),'AttachmentStatus': attachment.get('Status', 'N/A'),'AttachmentID': attachment.get('AttachmentId', 'N/A'),
+               'ENIAttachmentStatus': attachment.get('Status', 'N/A'),
+               'InterfaceType': eni.get('InterfaceType', 'N/A'),'Description': eni.get('Description', 'N/A'),
+            })
 
-    # Write to CSV in memory
-    output = ''
+
+@register_collector
+class SecurityGroupCollector(ResourceCollector):
+    """Security groups with their inbound and outbound rule counts"""
+    resource_type = 'Security Group'
+    columns = ['ResourceID'] + TAG_COLUMNS + [
+        'Description', 'VPCID', 'InboundRulesCount', 'OutboundRulesCount'
+    ]
+    api_calls = ('ec2:DescribeSecurityGroups',)
+
+    def collect(self):
+        for sg in self.inventory.security_groups():
+            tags = sg.get('Tags', [])
+            sg_id = sg['GroupId']
+            name = get_tag_value(tags, 'Name') or sg.get('GroupName', 'N/A')
+            vpc_id = sg.get('VpcId', 'N/A')
+            description = sg.get('Description', 'N/A')
+
+            inbound_count = len(sg.get('IpPermissions', []))
+            outbound_count = len(sg.get('IpPermissionsEgress', []))
+
+            yield self.layout.pack({
+                'ResourceID': sg_id,
+                'Name': name,
+                'Description': description,
+                'VPCID': vpc_id,'CreatedBy': get_tag_value(tags, 'CreatedBy'), 
+                'ManagedBy': get_tag_value(tags, 'ManagedBy'), 'Application': get_tag_value(tags, 'Application'), 
+                'Owner': get_tag_value(tags, 'Owner'),
+                'Environment': get_tag_value(tags, 'Environment'),
+                'InboundRulesCount': inbound_count,'OutboundRulesCount': outbound_count
+            })
+
+
+def put_row(rows, item, cancelled):
+    """Helper function to hand one item to the writer, giving up once the writer has stopped reading"""
+    while not cancelled.is_set():
+        try:
+            rows.put(item, timeout=COLLECTOR_QUEUE_POLL_SECONDS)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+def run_collector(collector, rows, cancelled):
+    """Helper function to run one collector on the shared executor, streaming its rows through a bounded queue"""
+    try:
+        for record in collector.collect():
+            if not put_row(rows, record, cancelled):
+                return
+    except ClientError as e:
+        if e.response['Error']['Code'] in ('AccessDenied', 'AccessDeniedException', 'UnauthorizedOperation'):
+            print(f"{collector.resource_type} collector needs {', '.join(collector.api_calls)}")
+        raise
+    finally:
+        # Also sent on failure, the writer then raises the collector's error from its future
+        put_row(rows, END_OF_ROWS, cancelled)
+
+
+def iter_audit_records(resource_types=None, inventory=None):
+    """Helper function to yield (layout, packed row) pairs, grouped by resource type in registry order"""
+    if resource_types is None:
+        resource_types = list(COLLECTORS)
+    unknown = [t for t in resource_types if t not in COLLECTORS]
+    if unknown:
+        raise ValueError(f"Unknown resource types {unknown}, expected some of {list(COLLECTORS)}")
+
+    if inventory is None:
+        inventory = get_inventory()
+    print(f"Collecting {', '.join(resource_types)} through the {inventory.name} inventory backend")
+
+    collectors = [COLLECTORS[t](inventory) for t in COLLECTORS if t in resource_types]
+    cancelled = threading.Event()
+    # All selected collectors run at once and rows reach the writer while collection continues. The writer
+    # drains one collector at a time in registry order, the others block once COLLECTOR_QUEUE_SIZE rows are waiting
+    with ThreadPoolExecutor(max_workers=COLLECTOR_WORKERS) as executor:
+        streams = []
+        for collector in collectors:
+            rows = queue.Queue(maxsize=COLLECTOR_QUEUE_SIZE)
+            streams.append((collector.layout, rows, executor.submit(run_collector, collector, rows, cancelled)))
+        try:
+            for layout, rows, future in streams:
+                while True:
+                    record = rows.get()
+                    if record is END_OF_ROWS:
+                        break
+                    yield layout, record
+                future.result()
+        finally:
+            # Releases collectors blocked on a full queue when the writer fails or stops early
+            cancelled.set()
+
+
+def write_report(f, records):
+    """Helper function to write (layout, packed row) pairs as the audit CSV to a text file object"""
+    writer = csv.writer(f)
+    writer.writerow(REPORT_COLUMNS)
+    row_count = 0
+    for layout, record in records:
+        writer.writerow(layout.expand(record))
+        row_count += 1
+    return row_count
+
+
+def run_idle_audit(output_file='/tmp/AWS_resource_Reporting_audit.csv', resource_types=None, records=None):
+    if records is None:
+        records = iter_audit_records(resource_types)
     with open(output_file, 'w', newline='') as f:
-        writer = csv.DictWriter(f, fieldnames=all_columns)
-        writer.writeheader()  # Write the headers to the first row
-        for row in rows:
-            writer.writerow(row)
+        write_report(f, records)
 
     print(f"AWS resource audit complete. Report saved to {output_file}")
 
+
+def stream_idle_audit(s3, bucket, key, records):
+    """Helper function to stream the audit as gzip CSV into S3 without staging it in /tmp"""
+    sink = S3MultipartWriter(s3, bucket, key)
+    try:
+        with gzip.GzipFile(fileobj=sink, mode='wb') as gz:
+            with io.TextIOWrapper(gz, encoding='utf-8', newline='') as text:
+                row_count = write_report(text, records)
+    except Exception:
+        sink.abort()
+        raise
+    sink.close()
+
+    print(f"AWS resource audit complete. Streamed {row_count} rows to s3://{bucket}/{key}")
+
+
+def columnar_value(column, value):
+    """Helper function to convert a packed value to its typed column value, placeholders become nulls"""
+    if value is None:
+        return None
+    if column in TIMESTAMP_COLUMNS or column in INTEGER_COLUMNS:
+        return value
+    return str(value)
+
+
+def field_name(column):
+    """Helper function to get the typed-table field name of a report column, Athena does not allow spaces"""
+    return column.replace(' ', '_')
+
+
+def column_type(column):
+    """Helper function to get the Glue/Athena type of a report column"""
+    if column in TIMESTAMP_COLUMNS:
+        return 'timestamp'
+    if column in INTEGER_COLUMNS:
+        return 'bigint'
+    return 'string'
+
+
+def jsonl_timestamp(value):
+    """Helper function to format a timestamp to match the JSON serde's timestamp.formats, whole seconds in UTC"""
+    return value.astimezone(datetime.timezone.utc).isoformat(timespec='seconds')
+
+
+class ParquetTableWriter:
+    """Typed Parquet table for one resource type, one row group per COLUMNAR_ROW_GROUP_SIZE rows"""
+    extension = 'parquet'
+    content_type = 'application/vnd.apache.parquet'
+    serde = {
+        'InputFormat': 'org.apache.hadoop.hive.ql.io.parquet.MapredParquetInputFormat',
+        'OutputFormat': 'org.apache.hadoop.hive.ql.io.parquet.MapredParquetOutputFormat',
+        'SerdeInfo': {'SerializationLibrary': 'org.apache.hadoop.hive.ql.io.parquet.serde.ParquetHiveSerDe'},
+    }
+
+    def __init__(self, f, layout):
+        self.layout = layout
+        self.schema = pa.schema([
+            (field_name(column), pa.timestamp('s', tz='UTC') if column in TIMESTAMP_COLUMNS
+             else pa.int64() if column in INTEGER_COLUMNS else pa.string())
+            for column in layout.columns
+        ])
+        self.writer = pq.ParquetWriter(f, self.schema, compression='zstd')
+        self.columns = [[] for _ in layout.columns]
+        self.row_count = 0
+
+    def write(self, record):
+        for values, column, value in zip(self.columns, self.layout.columns, record):
+            values.append(columnar_value(column, value))
+        self.row_count += 1
+        if len(self.columns[0]) >= COLUMNAR_ROW_GROUP_SIZE:
+            self._write_row_group()
+
+    def _write_row_group(self):
+        self.writer.write_table(pa.Table.from_arrays(self.columns, schema=self.schema))
+        self.columns = [[] for _ in self.layout.columns]
+
+    def close(self):
+        if self.columns[0]:
+            self._write_row_group()
+        self.writer.close()
+
+
+class JsonlTableWriter:
+    """Gzip JSON-lines table for one resource type with ISO 8601 timestamps"""
+    extension = 'jsonl.gz'
+    content_type = 'application/gzip'
+    serde = {
+        'InputFormat': 'org.apache.hadoop.mapred.TextInputFormat',
+        'OutputFormat': 'org.apache.hadoop.hive.ql.io.HiveIgnoreKeyTextOutputFormat',
+        'SerdeInfo': {
+            'SerializationLibrary': 'org.openx.data.jsonserde.JsonSerDe',
+            'Parameters': {'timestamp.formats': "yyyy-MM-dd'T'HH:mm:ssZZ"},
+        },
+    }
+
+    def __init__(self, f, layout):
+        self.layout = layout
+        self.text = io.TextIOWrapper(gzip.GzipFile(fileobj=f, mode='wb'), encoding='utf-8')
+        self.row_count = 0
+
+    def write(self, record):
+        row = {}
+        for column, value in zip(self.layout.columns, record):
+            value = columnar_value(column, value)
+            row[field_name(column)] = jsonl_timestamp(value) if column in TIMESTAMP_COLUMNS and value is not None else value
+        self.text.write(json.dumps(row) + '\n')
+        self.row_count += 1
+
+    def close(self):
+        # Closes the gzip stream too, which writes its trailer to the sink
+        self.text.close()
+
+
+class TableSetWriter:
+    """Streams (layout, packed row) pairs into one S3 object per resource type, Parquet with pyarrow and gzip JSON-lines without"""
+
+    def __init__(self, s3, bucket, table_key):
+        self.s3 = s3
+        self.bucket = bucket
+        # table_key(layout, extension) returns the S3 key of a resource type's table
+        self.table_key = table_key
+        self.table_class = ParquetTableWriter if pa is not None else JsonlTableWriter
+        self.table = None
+        self.sink = None
+        self.tables = {}
+
+    def write(self, layout, record):
+        # The collectors yield one resource type after another, so each table is written and closed in turn
+        if self.table is None or self.table.layout is not layout:
+            self._close_table()
+            key = self.table_key(layout, self.table_class.extension)
+            self.sink = S3MultipartWriter(self.s3, self.bucket, key, content_type=self.table_class.content_type)
+            self.table = self.table_class(self.sink, layout)
+            self.tables[layout.resource_type] = key
+        self.table.write(record)
+
+    def _close_table(self):
+        if self.table is None:
+            return
+        self.table.close()
+        self.sink.close()
+        print(f"Streamed {self.table.row_count} {self.table.layout.resource_type} rows to s3://{self.bucket}/{self.sink.key}")
+        self.table = None
+
+    def close(self):
+        self._close_table()
+        return self.tables
+
+    def abort(self):
+        if self.sink is not None:
+            self.sink.abort()
+
+
+def stream_columnar_audit(s3, bucket, prefix, records):
+    """Helper function to stream one typed table per resource type to S3 under prefix"""
+    tables = TableSetWriter(s3, bucket, lambda layout, extension: f"{prefix}/{layout.table_name}.{extension}")
+    try:
+        for layout, record in records:
+            tables.write(layout, record)
+    except Exception:
+        tables.abort()
+        raise
+    return tables.close()
+
+
+def tee_records(records, tables):
+    """Helper generator to pass (layout, packed row) pairs through while copying each one into a TableSetWriter"""
+    for layout, record in records:
+        tables.write(layout, record)
+        yield layout, record
+
+
+def partition_prefix(prefix, dt, account_id, region, layout):
+    """Helper function to build the Hive-style partition prefix of one resource type's audit table"""
+    return f"{prefix}/dt={dt}/account={account_id}/region={region}/resource_type={layout.table_name}"
+
+
+def write_partition_schemas(s3, bucket, prefix, table_class, resource_types):
+    """Helper function to write a Glue TableInput per resource type with partition projection over the audit history"""
+    location = f"s3://{bucket}/{prefix}/"
+    for resource_type in resource_types:
+        layout = COLLECTORS[resource_type].layout
+        table_input = {
+            'Name': f"audit_{layout.table_name}",
+            'TableType': 'EXTERNAL_TABLE',
+            'PartitionKeys': [
+                {'Name': 'dt', 'Type': 'string'},
+                {'Name': 'account', 'Type': 'string'},
+                {'Name': 'region', 'Type': 'string'},
+            ],
+            'StorageDescriptor': {
+                'Columns': [
+                    {'Name': field_name(column).lower(), 'Type': column_type(column)}
+                    for column in layout.columns
+                ],
+                'Location': location,
+                **table_class.serde,
+            },
+            'Parameters': {
+                'classification': table_class.extension.split('.')[0],
+                'projection.enabled': 'true',
+                'projection.dt.type': 'date',
+                'projection.dt.format': 'yyyy-MM-dd',
+                'projection.dt.range': '2020-01-01,NOW',
+                'projection.account.type': 'injected',
+                'projection.region.type': 'injected',
+                'storage.location.template': location + 'dt=${dt}/account=${account}/region=${region}/resource_type=' + layout.table_name + '/',
+            },
+        }
+        s3.put_object(
+            Bucket=bucket,
+            Key=f"{prefix}/_schema/{layout.table_name}.json",
+            Body=json.dumps(table_input, indent=2).encode('utf-8'),
+            ContentType='application/json'
+        )
+
+
+# Tag columns that decide which owner report a row goes to, the first one that is set wins
+OWNER_COLUMNS = ('Application', 'Owner')
+UNASSIGNED_OWNER = 'unassigned'
+
+
+def owner_file_name(owner):
+    """Helper function to turn an owner tag value into a safe S3 key segment"""
+    return re.sub(r'[^A-Za-z0-9._-]+', '_', owner).strip('_.') or UNASSIGNED_OWNER
+
+
+class OwnerReport:
+    """Gzip CSV audit report of one owner, streamed into its own S3 object"""
+
+    def __init__(self, s3, bucket, key):
+        self.key = key
+        self.sink = S3MultipartWriter(s3, bucket, key)
+        self.text = io.TextIOWrapper(gzip.GzipFile(fileobj=self.sink, mode='wb'), encoding='utf-8', newline='')
+        self.writer = csv.writer(self.text)
+        self.writer.writerow(REPORT_COLUMNS)
+        self.tag_values = set()
+        self.row_counts = {}
+
+    def write(self, layout, record, owner):
+        self.writer.writerow(layout.expand(record))
+        self.row_counts[layout.resource_type] = self.row_counts.get(layout.resource_type, 0) + 1
+        if owner is not None:
+            self.tag_values.add(owner)
+
+    def close(self):
+        # Closes the gzip stream too, which writes its trailer to the sink
+        self.text.close()
+        self.sink.close()
+
+
+class OwnerReportWriter:
+    """Routes (layout, packed row) pairs to one gzip CSV report per owner during the single collection pass"""
+
+    def __init__(self, s3, bucket, prefix):
+        self.s3 = s3
+        self.bucket = bucket
+        self.prefix = prefix
+        self.reports = {}
+        # Positions of OWNER_COLUMNS in each layout's packed rows
+        self.owner_slots = {}
+
+    def owner(self, layout, record):
+        slots = self.owner_slots.get(layout)
+        if slots is None:
+            slots = self.owner_slots[layout] = [layout.columns.index(column) for column in OWNER_COLUMNS if column in layout.columns]
+        for slot in slots:
+            if record[slot] not in (None, '', '-', DEFAULT_VALUE):
+                return record[slot]
+        return None
+
+    def write(self, layout, record):
+        owner = self.owner(layout, record)
+        name = owner_file_name(owner) if owner is not None else UNASSIGNED_OWNER
+        report = self.reports.get(name)
+        if report is None:
+            report = self.reports[name] = OwnerReport(self.s3, self.bucket, f"{self.prefix}/{name}.csv.gz")
+        report.write(layout, record, owner)
+
+    def close(self):
+        """Finish every owner report at once and write the manifest, returns the manifest key"""
+        with ThreadPoolExecutor(max_workers=COLLECTOR_WORKERS + MULTIPART_UPLOAD_WORKERS) as executor:
+            list(executor.map(OwnerReport.close, self.reports.values()))
+
+        manifest = {
+            'generated_at': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            'owner_columns': list(OWNER_COLUMNS),
+            'reports': [
+                {
+                    'owner': name,
+                    'tag_values': sorted(report.tag_values),
+                    'key': report.key,
+                    'rows': sum(report.row_counts.values()),
+                    'rows_by_resource_type': report.row_counts,
+                }
+                for name, report in sorted(self.reports.items())
+            ],
+        }
+        key = f"{self.prefix}/manifest.json"
+        self.s3.put_object(
+            Bucket=self.bucket,
+            Key=key,
+            Body=json.dumps(manifest, indent=2).encode('utf-8'),
+            ContentType='application/json'
+        )
+        print(f"Wrote {len(self.reports)} owner reports and their manifest to s3://{self.bucket}/{key}")
+        return key
+
+    def abort(self):
+        for report in self.reports.values():
+            report.sink.abort()
+
+
 def lambda_handler(event, context):
     output_file = '/tmp/AWS_resource_Reporting_audit.csv'
 
-    # Run the audit
-    run_idle_audit(output_file=output_file)
-
-    # Upload to S3
-    s3 = boto3.client('s3')
-    s3.upload_file(
-        Filename=output_file,
-        Bucket=os.environ['BUCKET_NAME'],
-        Key=os.environ['S3_REPORT_KEY']
-    )
-    print(f"Uploaded report to s3://{os.environ['BUCKET_NAME']}/{os.environ['S3_REPORT_KEY']}")
-
-    # Generate a presigned URL (valid for 24 hours)
-    presigned_url = s3.generate_presigned_url(
-        'get_object',
-        Params={
-            'Bucket': os.environ['BUCKET_NAME'],
-            'Key': os.environ['S3_REPORT_KEY']
-        },
-        ExpiresIn=86400  # 24 hours
-    )
-    print(f"Presigned download URL: {presigned_url}")
+    s3 = get_client('s3')
+    bucket = os.environ['BUCKET_NAME']
+    report_key = os.environ['S3_REPORT_KEY']
+    report_output = os.environ.get('REPORT_OUTPUT', 'csv')
+    resource_types = [t.strip() for t in os.environ['RESOURCE_TYPES'].split(',')] if os.environ.get('RESOURCE_TYPES') else list(COLLECTORS)
+    records = iter_audit_records(resource_types)
+    dt = datetime.datetime.now(datetime.timezone.utc).strftime('%Y-%m-%d')
+
+    # Optional Athena history: every run also lands under dt=/account=/region=/resource_type= partitions
+    partition_root = os.environ.get('PARTITION_PREFIX', '').strip('/')
+    partitions = None
+    if partition_root:
+        account_id = get_client('sts').get_caller_identity()['Account']
+        region = os.environ['AWS_REGION']
+        partitions = TableSetWriter(
+            s3, bucket,
+            lambda layout, extension: f"{partition_prefix(partition_root, dt, account_id, region, layout)}/report.{extension}"
+        )
+        records = tee_records(records, partitions)
+
+    # Optional per-owner reports, routed from the same rows so each extra team costs no extra API calls
+    owner_root = os.environ.get('OWNER_REPORT_PREFIX', '').strip('/')
+    owners = None
+    if owner_root:
+        owners = OwnerReportWriter(s3, bucket, f"{owner_root}/dt={dt}")
+        records = tee_records(records, owners)
+
+    try:
+        if report_output == 'columnar':
+            # One typed table per resource type under the report key without its extension
+            tables = stream_columnar_audit(s3, bucket, report_key.rsplit('.', 1)[0], records)
+        elif report_output == 'csv':
+            # Plain CSV staged in /tmp, fine for small accounts
+            run_idle_audit(output_file=output_file, records=records)
+            s3.upload_file(
+                Filename=output_file,
+                Bucket=bucket,
+                Key=report_key
+            )
+            tables = {'Report': report_key}
+        else:
+            # Stream gzip CSV to S3 while the collectors are still running
+            if not report_key.endswith('.gz'):
+                report_key += '.gz'
+            stream_idle_audit(s3, bucket, report_key, records)
+            tables = {'Report': report_key}
+    except Exception:
+        if partitions is not None:
+            partitions.abort()
+        if owners is not None:
+            owners.abort()
+        raise
+
+    if partitions is not None:
+        partitions.close()
+        write_partition_schemas(s3, bucket, partition_root, partitions.table_class, resource_types)
+        print(f"Partitioned audit tables written under s3://{bucket}/{partition_root}/dt={dt}/")
+
+    if owners is not None:
+        tables['Owner reports manifest'] = owners.close()
+
+    # Generate presigned URLs (valid for 24 hours)
+    links = []
+    for name, key in tables.items():
+        print(f"Uploaded report to s3://{bucket}/{key}")
+        presigned_url = s3.generate_presigned_url(
+            'get_object',
+            Params={
+                'Bucket': bucket,
+                'Key': key
+            },
+            ExpiresIn=86400
+        )
+        links.append(f"{name}: {presigned_url}" if len(tables) > 1 else presigned_url)
+    download_links = "\n".join(links)
+    print(f"Presigned download URLs: {download_links}")
 
-    # Send SNS notification with the download link
-    sns = boto3.client('sns')
+    sns = get_client('sns')
     sns.publish(
         TopicArn=os.environ['SNS_TOPIC_ARN'],
         Subject='AWS Resource Reporting Audit is  Ready',
         Message=(
             f"The AWS Resource Reporting audit has completed successfully.\n\n"
             f"You can download the report using the secure link below (valid for 24 hours):\n\n"
-            f"{presigned_url}\n\n"
+            f"{download_links}\n\n"
             f"--\nAWS Resource Reporting Audit Automation"
         )
     )
\ No newline at end of file
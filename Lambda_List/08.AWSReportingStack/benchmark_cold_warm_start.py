@@ -0,0 +1,105 @@
+"""Time cold and warm starts of the reporting audit's AWS client setup.
+
+Each run is a fresh interpreter, like a new Lambda execution environment. It
+times the module init, the clients a first (cold) invocation creates and the
+clients a second (warm) invocation creates in the same process. The lazy
+get_client() of lambda_function.py is compared with the previous setup, which
+built s3, ec2, sts and compute-optimizer clients at import time and fresh s3
+and sns clients on every invocation. Credentials and region are faked, so no
+AWS call or network access is made.
+
+    python benchmark_cold_warm_start.py --runs 5 --variant SingleEmail
+"""
+import argparse
+import importlib.util
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+# Imported before any timing, so both setups measure only their own work
+import boto3
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+VARIANTS = ['SingleEmail', 'MultipleEmail']
+# Clients one full run uses, with the Config inventory backend
+RUN_SERVICES = ['ec2', 'config', 'compute-optimizer', 's3', 'sns']
+PHASES = ['module init', 'first invocation', 'warm invocation']
+
+
+def elapsed_ms(started):
+    return (time.perf_counter() - started) * 1000
+
+
+def load_variant(variant):
+    """Helper function to import one variant's lambda_function.py under its own module name"""
+    spec = importlib.util.spec_from_file_location(
+        f'reporting_{variant}', os.path.join(HERE, variant, 'lambda_function.py')
+    )
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def time_lazy(variant):
+    """Child process: the current module with get_client()"""
+    started = time.perf_counter()
+    module = load_variant(variant)
+    timings = [elapsed_ms(started)]
+    for _ in range(2):
+        started = time.perf_counter()
+        for service_name in RUN_SERVICES:
+            module.get_client(service_name)
+        timings.append(elapsed_ms(started))
+    return timings
+
+
+def time_eager(variant):
+    """Child process: the previous import-time clients plus per-invocation s3, sns and config clients"""
+    started = time.perf_counter()
+    load_variant(variant)
+    clients = [boto3.client(service_name) for service_name in ('s3', 'ec2', 'sts', 'compute-optimizer')]
+    timings = [elapsed_ms(started)]
+    for _ in range(2):
+        started = time.perf_counter()
+        clients += [boto3.client(service_name) for service_name in ('s3', 'sns', 'config')]
+        timings.append(elapsed_ms(started))
+    return timings
+
+
+def run_child(mode, variant):
+    env = dict(
+        os.environ,
+        AWS_DEFAULT_REGION='us-east-1', AWS_ACCESS_KEY_ID='testing', AWS_SECRET_ACCESS_KEY='testing',
+        AWS_EC2_METADATA_DISABLED='true',
+    )
+    output = subprocess.run(
+        [sys.executable, __file__, '--child', mode, '--variant', variant],
+        env=env, check=True, capture_output=True, text=True
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--variant', choices=VARIANTS, default='SingleEmail')
+    parser.add_argument('--child', choices=['lazy', 'eager'], help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(time_lazy(args.variant) if args.child == 'lazy' else time_eager(args.variant)))
+        return
+
+    print(f"{args.variant}, median of {args.runs} fresh interpreters (ms)")
+    print(f"{'':<14}" + ''.join(f"{phase:>18}" for phase in PHASES))
+    for mode, label in (('eager', 'import-time'), ('lazy', 'get_client')):
+        runs = [run_child(mode, args.variant) for _ in range(args.runs)]
+        medians = [statistics.median(run[index] for run in runs) for index in range(len(PHASES))]
+        print(f"{label:<14}" + ''.join(f"{value:>18.1f}" for value in medians))
+
+
+if __name__ == '__main__':
+    main()
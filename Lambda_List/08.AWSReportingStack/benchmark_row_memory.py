@@ -0,0 +1,109 @@
+"""Benchmark the memory held by audit rows: packed RowLayout tuples vs the previous dicts.
+
+Before the row model, every report row was a dict over all REPORT_COLUMNS with
+'N/A' placeholders for the columns its resource type never sets. Rows are now
+tuples holding only the columns of their RowLayout. This builds the same
+synthetic EBS rows both ways and reports what tracemalloc sees retained.
+
+    python benchmark_row_memory.py --rows 100000 --variant SingleEmail
+"""
+import argparse
+import datetime
+import importlib.util
+import os
+import tracemalloc
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+VARIANTS = ['SingleEmail', 'MultipleEmail']
+
+
+def load_variant(variant):
+    """Helper function to import one variant's lambda_function.py under its own module name"""
+    spec = importlib.util.spec_from_file_location(
+        f'reporting_{variant}', os.path.join(HERE, variant, 'lambda_function.py')
+    )
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def ebs_values(index, created):
+    """Helper function to build the populated columns of one synthetic EBS row"""
+    return {
+        'ResourceID': f"vol-{index:017x}",
+        'Name': f"data-{index}",
+        'Application': 'billing',
+        'Environment': 'prod',
+        'CreatedBy': f"user-{index % 50}",
+        'ManagedBy': 'terraform',
+        'Owner': 'platform',
+        'AvailabilityZone': 'us-east-1a',
+        'VolumeStatus': 'ok',
+        'VolumeIOPS': 3000,
+        'VolumeSnapshotID': f"snap-{index:017x}",
+        'VolumeCreatedDate': created + datetime.timedelta(seconds=index),
+        'VolumeState': 'in-use',
+        'OptimizerFinding': 'Optimized',
+        'VolumeType': 'gp3',
+        'StatusCheck': 'ok',
+        'VolumeThroughput': 125,
+        'VolumeSize': 100,
+        'AttachedResourceID': f"i-{index:017x}",
+        'Encryption': 'True',
+    }
+
+
+def measure(build, rows):
+    """Helper function to return the bytes retained by the list build() returns, and the list"""
+    tracemalloc.start()
+    baseline = tracemalloc.get_traced_memory()[0]
+    result = build(rows)
+    retained = tracemalloc.get_traced_memory()[0] - baseline
+    tracemalloc.stop()
+    return retained, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=100000)
+    parser.add_argument('--variant', choices=VARIANTS, default='SingleEmail')
+    args = parser.parse_args()
+
+    module = load_variant(args.variant)
+    layout = module.COLLECTORS['EBS'].layout
+    created = datetime.datetime(2024, 1, 1, tzinfo=datetime.timezone.utc)
+
+    def as_dicts(rows):
+        # The previous shape, every column present with the placeholder default
+        dict_rows = []
+        for index in range(rows):
+            row = dict.fromkeys(module.REPORT_COLUMNS, module.DEFAULT_VALUE)
+            row['ResourceType'] = layout.resource_type
+            row.update({column: value for column, value in ebs_values(index, created).items() if column in layout.columns})
+            dict_rows.append(row)
+        return dict_rows
+
+    def as_records(rows):
+        return [
+            layout.pack({column: value for column, value in ebs_values(index, created).items() if column in layout.columns})
+            for index in range(rows)
+        ]
+
+    dict_bytes, dict_rows = measure(as_dicts, args.rows)
+    record_bytes, records = measure(as_records, args.rows)
+
+    # Both shapes must describe the same report rows
+    for row, record in zip(dict_rows[:1000], records):
+        assert tuple(row[column] for column in layout.columns) == record
+        assert all(row[column] == module.DEFAULT_VALUE for column in module.REPORT_COLUMNS
+                   if column not in layout.columns and column != 'ResourceType')
+
+    mib = 1024 * 1024
+    print(f"{args.rows} EBS rows, {len(module.REPORT_COLUMNS)} report columns, {len(layout.columns)} in the layout")
+    print(f"dict rows      {dict_bytes / mib:8.1f} MiB  {dict_bytes / args.rows:6.0f} B/row")
+    print(f"packed tuples  {record_bytes / mib:8.1f} MiB  {record_bytes / args.rows:6.0f} B/row")
+    print(f"reduction      {dict_bytes / record_bytes:8.1f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,10 @@
+#!/bin/bash
+# Build pyarrow Lambda layer for the Parquet columnar output, matching the python3.11 x86_64 runtime
+rm -rf python pyarrow_layer.zip
+mkdir -p python
+pip install pyarrow -t python --platform manylinux2014_x86_64 --implementation cp --python-version 3.11 --only-binary=:all:
+# Keep the unzipped layer under Lambda's 250 MB limit
+rm -rf python/pyarrow/tests python/pyarrow/include python/*.dist-info/RECORD
+find python -name '__pycache__' -type d -prune -exec rm -rf {} +
+zip -r pyarrow_layer.zip python
+echo "Created pyarrow_layer.zip"
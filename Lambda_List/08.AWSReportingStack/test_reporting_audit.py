@@ -0,0 +1,272 @@
+import datetime
+import gzip
+import importlib.util
+import io
+import json
+import os
+import threading
+import time
+
+import boto3
+import pytest
+from botocore.stub import ANY, Stubber
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+VARIANTS = ['SingleEmail', 'MultipleEmail']
+
+
+def load_variant(variant):
+    """Helper function to import one variant's lambda_function.py under its own module name"""
+    spec = importlib.util.spec_from_file_location(
+        f'reporting_{variant}', os.path.join(HERE, variant, 'lambda_function.py')
+    )
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def make_client(service_name):
+    return boto3.client(
+        service_name, region_name='us-east-1',
+        aws_access_key_id='testing', aws_secret_access_key='testing'
+    )
+
+
+@pytest.fixture(params=VARIANTS)
+def audit(request, monkeypatch):
+    monkeypatch.setenv('INVENTORY_BACKEND', 'config')
+    monkeypatch.delenv('CONFIG_AGGREGATOR_NAME', raising=False)
+    module = load_variant(request.param)
+    stubbers = {}
+    for service_name in ('config', 'ec2'):
+        client = make_client(service_name)
+        module._clients[service_name] = client
+        stubbers[service_name] = Stubber(client)
+        stubbers[service_name].activate()
+    yield module, stubbers
+    for stubber in stubbers.values():
+        stubber.deactivate()
+
+
+def config_result(configuration, tags=()):
+    return json.dumps({
+        'resourceId': configuration.get('networkInterfaceId') or configuration.get('groupId'),
+        'configuration': configuration,
+        'tags': [{'key': key, 'value': value} for key, value in tags],
+    })
+
+
+def eni_document(eni_id, **fields):
+    document = {
+        'networkInterfaceId': eni_id,
+        'availabilityZone': 'us-east-1a',
+        'privateIpAddress': '10.0.0.10',
+        'subnetId': 'subnet-1',
+        'vpcId': 'vpc-1',
+        'requesterId': None,
+        'groups': [{'groupName': 'default', 'groupId': 'sg-1'}],
+        'status': 'available',
+        'interfaceType': 'interface',
+        'description': 'test',
+        # Config records an unattached ENI without a public IP with explicit nulls
+        'association': None,
+        'attachment': None,
+    }
+    document.update(fields)
+    return document
+
+
+def test_config_eni_with_null_association_and_attachment(audit):
+    module, stubbers = audit
+    stubbers['config'].add_response(
+        'select_resource_config',
+        {'Results': [
+            config_result(eni_document('eni-detached'), [('Name', 'idle')]),
+            config_result(eni_document(
+                'eni-attached',
+                status='in-use',
+                association={'publicIp': '203.0.113.7', 'allocationId': 'eipalloc-1'},
+                attachment={'attachmentId': 'eni-attach-1', 'status': 'attached'},
+            )),
+        ]},
+        {'Expression': ANY, 'Limit': module.CONFIG_QUERY_PAGE_SIZE},
+    )
+
+    records = list(module.iter_audit_records(['Network Interface']))
+
+    stubbers['config'].assert_no_pending_responses()
+    rows = {row[1]: dict(zip(module.REPORT_COLUMNS, row)) for row in (layout.expand(record) for layout, record in records)}
+    assert set(rows) == {'eni-detached', 'eni-attached'}
+    assert rows['eni-detached']['Name'] == 'idle'
+    assert rows['eni-detached']['PublicIPv4 Address'] == 'N/A'
+    assert rows['eni-detached']['AttachmentStatus'] == 'N/A'
+    assert rows['eni-detached']['RequesterID'] == '-'
+    assert rows['eni-attached']['PublicIPv4 Address'] == '203.0.113.7'
+    assert rows['eni-attached']['AllocationID'] == 'eipalloc-1'
+    assert rows['eni-attached']['AttachmentID'] == 'eni-attach-1'
+
+
+def test_config_query_error_falls_back_to_describe(audit):
+    module, stubbers = audit
+    stubbers['config'].add_client_error('select_resource_config', service_error_code='InvalidExpressionException')
+    stubbers['ec2'].add_response('describe_security_groups', {'SecurityGroups': [{
+        'GroupId': 'sg-1', 'GroupName': 'default', 'Description': 'default group', 'VpcId': 'vpc-1',
+        'IpPermissions': [], 'IpPermissionsEgress': [{'IpProtocol': '-1'}],
+    }]})
+
+    records = list(module.iter_audit_records(['Security Group']))
+
+    stubbers['config'].assert_no_pending_responses()
+    stubbers['ec2'].assert_no_pending_responses()
+    assert len(records) == 1
+    row = dict(zip(module.REPORT_COLUMNS, records[0][0].expand(records[0][1])))
+    assert row['ResourceID'] == 'sg-1'
+    assert row['OutboundRulesCount'] == 1
+
+
+def test_aggregator_queries_are_scoped_to_this_account_and_region(audit, monkeypatch):
+    module, stubbers = audit
+    monkeypatch.setenv('CONFIG_AGGREGATOR_NAME', 'org')
+    sts = make_client('sts')
+    module._clients['sts'] = sts
+    with Stubber(sts) as sts_stubber:
+        sts_stubber.add_response('get_caller_identity', {'Account': '111122223333'})
+        stubbers['config'].add_response('select_aggregate_resource_config', {'Results': [
+            config_result({'groupId': 'sg-1', 'groupName': 'default', 'description': 'default group', 'vpcId': 'vpc-1',
+                           'ipPermissions': [], 'ipPermissionsEgress': []}),
+        ]}, {
+            'ConfigurationAggregatorName': 'org',
+            'Expression': (
+                "SELECT resourceId, configuration, tags WHERE resourceType = 'AWS::EC2::SecurityGroup'"
+                " AND accountId = '111122223333' AND awsRegion = 'us-east-1'"
+            ),
+            'Limit': module.CONFIG_QUERY_PAGE_SIZE,
+        })
+
+        records = list(module.iter_audit_records(['Security Group']))
+
+    stubbers['config'].assert_no_pending_responses()
+    assert [layout.expand(record)[1] for layout, record in records] == ['sg-1']
+
+
+def test_from_config_document_drops_nulls_and_parses_timestamps(audit):
+    module, _ = audit
+    converted = module.from_config_document({
+        'volumeId': 'vol-1',
+        'createTime': '2024-03-01T10:20:30.931Z',
+        'kmsKeyId': None,
+        'attachments': [{'instanceId': 'i-1', 'attachTime': 1709288430000, 'device': None}],
+    })
+    assert 'KmsKeyId' not in converted
+    assert converted['CreateTime'].year == 2024
+    assert converted['Attachments'] == [{'InstanceId': 'i-1', 'AttachTime': converted['Attachments'][0]['AttachTime']}]
+    assert converted['Attachments'][0]['AttachTime'].tzinfo is not None
+
+
+class FakeInventory:
+    name = 'fake'
+
+
+def fake_collector(module, resource_type, rows, before_each=None):
+    """Helper function to build a collector class yielding the given ResourceID values"""
+    class Collector(module.ResourceCollector):
+        columns = ['ResourceID']
+
+        def collect(self):
+            for resource_id in rows:
+                if before_each is not None:
+                    before_each(resource_id)
+                yield self.layout.pack({'ResourceID': resource_id})
+
+    Collector.resource_type = resource_type
+    Collector.layout = module.RowLayout(resource_type, Collector.columns)
+    return Collector
+
+
+@pytest.fixture
+def collectors(audit, monkeypatch):
+    module, _ = audit
+    registry = {}
+    monkeypatch.setattr(module, 'COLLECTORS', registry)
+    monkeypatch.setattr(module, 'COLLECTOR_QUEUE_SIZE', 10)
+    return module, registry
+
+
+def test_rows_reach_the_writer_while_collection_runs(collectors):
+    module, registry = collectors
+    first_row_read = threading.Event()
+
+    def wait_for_writer(resource_id):
+        # Only possible if rows are handed out before the collector finishes
+        if resource_id == 'slow-1':
+            assert first_row_read.wait(timeout=5)
+
+    registry['Slow'] = fake_collector(module, 'Slow', ['slow-0', 'slow-1'], wait_for_writer)
+    registry['Fast'] = fake_collector(module, 'Fast', [f'fast-{i}' for i in range(100)])
+
+    records = module.iter_audit_records(['Slow', 'Fast'], FakeInventory())
+    layout, record = next(records)
+    assert record == ('slow-0',)
+    first_row_read.set()
+    rest = list(records)
+
+    # Grouped by resource type in registry order, with nothing lost behind the full queue
+    assert [r[0] for _, r in rest] == ['slow-1'] + [f'fast-{i}' for i in range(100)]
+    assert [l.resource_type for l, _ in rest] == ['Slow'] + ['Fast'] * 100
+
+
+def test_collector_memory_is_bounded_by_the_queue(collectors):
+    module, registry = collectors
+    produced = []
+    registry['Big'] = fake_collector(module, 'Big', range(1000), produced.append)
+
+    records = module.iter_audit_records(['Big'], FakeInventory())
+    next(records)
+    time.sleep(0.2)
+    # One row read, COLLECTOR_QUEUE_SIZE waiting and one blocked in put
+    assert len(produced) <= module.COLLECTOR_QUEUE_SIZE + 2
+    assert sum(1 for _ in records) == 999
+
+
+def test_collector_error_is_raised_after_its_rows(collectors):
+    module, registry = collectors
+
+    def fail(resource_id):
+        if resource_id == 'bad':
+            raise RuntimeError('describe failed')
+
+    registry['Broken'] = fake_collector(module, 'Broken', ['ok', 'bad'], fail)
+    records = module.iter_audit_records(['Broken'], FakeInventory())
+    assert next(records)[1] == ('ok',)
+    with pytest.raises(RuntimeError, match='describe failed'):
+        next(records)
+
+
+def test_closing_the_stream_early_releases_blocked_collectors(collectors, monkeypatch):
+    module, registry = collectors
+    monkeypatch.setattr(module, 'COLLECTOR_QUEUE_POLL_SECONDS', 0.05)
+    registry['Big'] = fake_collector(module, 'Big', range(1000))
+    registry['Other'] = fake_collector(module, 'Other', range(1000))
+
+    records = module.iter_audit_records(['Big', 'Other'], FakeInventory())
+    next(records)
+    started = time.monotonic()
+    # Waits for the workers, which would hang if they stayed blocked on their full queues
+    records.close()
+    assert time.monotonic() - started < 5
+
+
+def test_jsonl_timestamps_match_the_serde_format(audit):
+    module, _ = audit
+    layout = module.RowLayout('Instance', ['ResourceID', 'LaunchTime'])
+    sink = io.BytesIO()
+    table = module.JsonlTableWriter(sink, layout)
+    launched = datetime.datetime(2024, 3, 1, 12, 20, 30, 931000, tzinfo=datetime.timezone(datetime.timedelta(hours=2)))
+
+    table.write(layout.pack({'ResourceID': 'i-1', 'LaunchTime': launched}))
+    table.close()
+
+    row = json.loads(gzip.decompress(sink.getvalue()))
+    # yyyy-MM-dd'T'HH:mm:ssZZ, no fraction of a second
+    assert row['LaunchTime'] == '2024-03-01T10:20:30+00:00'
+    assert module.JsonlTableWriter.serde['SerdeInfo']['Parameters']['timestamp.formats'] == "yyyy-MM-dd'T'HH:mm:ssZZ"
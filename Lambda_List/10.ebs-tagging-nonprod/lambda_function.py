@@ -1,9 +1,14 @@
 import boto3
 import re
 
+from idempotency import idempotent
+
 # Initialize AWS services
 ec2 = boto3.resource('ec2')
 
+# Maximum number of resources per create_tags call
+CREATE_TAGS_BATCH_SIZE = 1000
+
 # Function to get the EC2 instance ID to which the volume is attached
 def get_ec2_instance_id(volume):
     attachments = volume.attachments
@@ -25,20 +30,16 @@ def tag_volume(volume, tags):
     formatted_tags = [{'Key': key, 'Value': value} for key, value in tags.items() if not key.startswith('aws:')]
     volume.create_tags(Tags=formatted_tags)
 
-def process_volume(volume):
-    volume_id = volume.id
-    print(f"\nProcessing volume: {volume_id}")
-
-    # Get the current tags for the volume
-    current_tags = {tag['Key']: tag['Value'] for tag in volume.tags or []}
+# Function to get the desired "EnterpriseAppID" and "AttachedTo" tags for a volume
+# get_app_id returns the EnterpriseAppID of the instance the volume is attached to
+def get_desired_tags(volume, current_tags, get_app_id):
     tags = {}
 
     # Check if the volume is attached to an EC2 instance
     instance_id = get_ec2_instance_id(volume)
     if instance_id:
         # Volume is attached to an instance
-        instance_tags = get_ec2_tags(instance_id)
-        enterprise_app_id = instance_tags.get('EnterpriseAppID', '').strip()[:5]  # Trim whitespace and limit to first 5 characters
+        enterprise_app_id = get_app_id(instance_id).strip()[:5]  # Trim whitespace and limit to first 5 characters
         if not enterprise_app_id or not re.match(r'^A\d{4}$', enterprise_app_id, re.IGNORECASE):
             enterprise_app_id = 'EC2-EnterpriseAppID-missing'
 
@@ -60,6 +61,16 @@ def process_volume(volume):
         
         tags['AttachedTo'] = 'N/A'
 
+    return tags
+
+def process_volume(volume):
+    volume_id = volume.id
+    print(f"\nProcessing volume: {volume_id}")
+
+    # Get the current tags for the volume
+    current_tags = {tag['Key']: tag['Value'] for tag in volume.tags or []}
+    tags = get_desired_tags(volume, current_tags, lambda instance_id: get_ec2_tags(instance_id).get('EnterpriseAppID', ''))
+
     # Prepare tags for comparison
     new_tags = {key: value for key, value in tags.items() if key in ['EnterpriseAppID', 'AttachedTo']}
     current_tags_filtered = {key: value for key, value in current_tags.items() if key in ['EnterpriseAppID', 'AttachedTo']}
@@ -81,16 +92,54 @@ def process_volume(volume):
     else:
         print(f"No action required for volume {volume_id}. Current tags match desired tags.")
 
-def main(event=None, context=None):
+# Function to index the EnterpriseAppID of every instance carrying the tag
+# One paginated describe_instances call replaces a lazy-loaded ec2.Instance() lookup per volume
+def get_enterprise_app_id_index():
+    index = {}
+    paginator = ec2.meta.client.get_paginator('describe_instances')
+    for page in paginator.paginate(Filters=[{'Name': 'tag-key', 'Values': ['EnterpriseAppID']}]):
+        for reservation in page['Reservations']:
+            for instance in reservation['Instances']:
+                for tag in instance.get('Tags', []):
+                    if tag['Key'] == 'EnterpriseAppID':
+                        index[instance['InstanceId']] = tag['Value']
+    return index
+
+# Function to tag all EBS volumes for scheduled events
+# The desired tags are computed in memory first, then only the volumes whose tags differ are updated,
+# with one create_tags call per identical tag set (up to CREATE_TAGS_BATCH_SIZE volumes each)
+def process_all_volumes():
+    app_ids = get_enterprise_app_id_index()
+    print(f"Indexed EnterpriseAppID for {len(app_ids)} instances")
+
+    pending = {}  # sorted tag items -> volume IDs needing exactly those tags
+    volume_count = 0
+    for volume in ec2.volumes.all():
+        volume_count += 1
+        current_tags = {tag['Key']: tag['Value'] for tag in volume.tags or []}
+        tags = get_desired_tags(volume, current_tags, lambda instance_id: app_ids.get(instance_id, ''))
+        if any(current_tags.get(key) != value for key, value in tags.items()):
+            pending.setdefault(tuple(sorted(tags.items())), []).append(volume.id)
+
+    update_count = sum(len(volume_ids) for volume_ids in pending.values())
+    print(f"{update_count} of {volume_count} volumes need tag updates")
+
+    for tag_items, volume_ids in pending.items():
+        formatted_tags = [{'Key': key, 'Value': value} for key, value in tag_items]
+        for i in range(0, len(volume_ids), CREATE_TAGS_BATCH_SIZE):
+            batch = volume_ids[i:i + CREATE_TAGS_BATCH_SIZE]
+            ec2.meta.client.create_tags(Resources=batch, Tags=formatted_tags)
+            print(f"Tagged {len(batch)} volumes with {dict(tag_items)}: {batch}")
+
+# Function to tag the volumes an event refers to
+def process_event(event=None, context=None):
     try:
         print("Lambda function started")
 
         if event and 'source' in event and event['source'] == 'aws.events':
             # Process all EBS volumes for scheduled events
             print("Processing scheduled event...")
-            volumes = ec2.volumes.all()
-            for volume in volumes:
-                process_volume(volume)
+            process_all_volumes()
         
         elif event and 'detail' in event:
             event_name = event['detail'].get('eventName', '')
@@ -106,7 +155,10 @@ def main(event=None, context=None):
         
     except Exception as e:
         print(f"Error handling event: {e}")
+        # Fail the invocation, so the idempotency claim is released and the event is retried
+        raise
 
-# Lambda function handler
-def lambda_handler(event, context):
-    return main(event, context)
+# Lambda function handler, kept as main so existing stacks' Handler setting still applies
+@idempotent
+def main(event, context):
+    return process_event(event, context)
@@ -0,0 +1,71 @@
+import importlib.util
+import os
+import sys
+
+import boto3
+import pytest
+from botocore.stub import Stubber
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+# The idempotency module ships as a layer, which Lambda puts on the path from /opt/python
+sys.path.insert(0, os.path.join(HERE, '..', '26.idempotency_layer', 'python'))
+# lambda_function.py creates its EC2 resource at import
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+
+
+def load_lambda():
+    """Helper function to import this folder's lambda_function.py under its own module name"""
+    spec = importlib.util.spec_from_file_location('ebs_tagging', os.path.join(HERE, 'lambda_function.py'))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+ebs_tagging = load_lambda()
+
+
+@pytest.fixture
+def ec2(monkeypatch):
+    resource = boto3.resource(
+        'ec2', region_name='us-east-1',
+        aws_access_key_id='testing', aws_secret_access_key='testing'
+    )
+    monkeypatch.setattr(ebs_tagging, 'ec2', resource)
+    with Stubber(resource.meta.client) as stubber:
+        yield stubber
+        stubber.assert_no_pending_responses()
+
+
+def volume(volume_id, instance_id=None, **tags):
+    return {
+        'VolumeId': volume_id, 'State': 'in-use' if instance_id else 'available',
+        'Attachments': [{'InstanceId': instance_id, 'VolumeId': volume_id}] if instance_id else [],
+        'Tags': [{'Key': key, 'Value': value} for key, value in tags.items()],
+    }
+
+
+def test_scheduled_run_groups_volumes_by_tag_set(ec2):
+    ec2.add_response('describe_instances', {'Reservations': [{'Instances': [
+        {'InstanceId': 'i-app', 'Tags': [{'Key': 'EnterpriseAppID', 'Value': 'A1234'}]},
+    ]}]}, {'Filters': [{'Name': 'tag-key', 'Values': ['EnterpriseAppID']}]})
+    attached = [f'vol-{index:017x}' for index in range(2001)]
+    ec2.add_response('describe_volumes', {'Volumes': (
+        [volume(volume_id, 'i-app') for volume_id in attached]
+        + [volume('vol-detached-1', EnterpriseAppID='A9999'), volume('vol-detached-2', EnterpriseAppID='A9999')]
+        # Already tagged as it should be, so it is not written
+        + [volume('vol-current', 'i-app', EnterpriseAppID='A1234', AttachedTo='i-app')]
+        # Attached to an instance without the tag
+        + [volume('vol-untagged-instance', 'i-other')]
+    )}, {})
+    attached_tags = [{'Key': 'AttachedTo', 'Value': 'i-app'}, {'Key': 'EnterpriseAppID', 'Value': 'A1234'}]
+    # One tag set, split into create_tags calls of at most 1000 volumes
+    for batch in (attached[:1000], attached[1000:2000], attached[2000:]):
+        ec2.add_response('create_tags', {}, {'Resources': batch, 'Tags': attached_tags})
+    ec2.add_response('create_tags', {}, {'Resources': ['vol-detached-1', 'vol-detached-2'], 'Tags': [
+        {'Key': 'AttachedTo', 'Value': 'N/A'}, {'Key': 'EnterpriseAppID', 'Value': 'Previously-A9999'},
+    ]})
+    ec2.add_response('create_tags', {}, {'Resources': ['vol-untagged-instance'], 'Tags': [
+        {'Key': 'AttachedTo', 'Value': 'i-other'}, {'Key': 'EnterpriseAppID', 'Value': 'EC2-EnterpriseAppID-missing'},
+    ]})
+
+    ebs_tagging.process_all_volumes()
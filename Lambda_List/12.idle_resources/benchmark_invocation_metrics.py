@@ -0,0 +1,112 @@
+"""Benchmark the idle Lambda invocation lookup against a stubbed CloudWatch client.
+
+Compares one GetMetricStatistics call per function (the previous section [6])
+with the batched GetMetricData lookup in get_invocation_sums. No AWS account is
+needed, every response comes from botocore's Stubber. --latency-ms adds a
+simulated round trip to each request so the wall time reflects API calls.
+
+    python benchmark_invocation_metrics.py --functions 5000 --latency-ms 5
+"""
+import argparse
+import datetime
+import importlib.util
+import os
+import time
+
+import boto3
+from botocore.stub import Stubber
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def load_lambda():
+    """Helper function to import this folder's lambda_function.py under its own module name"""
+    spec = importlib.util.spec_from_file_location('idle_resources', os.path.join(HERE, 'lambda_function.py'))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def make_cloudwatch(latency_ms):
+    client = boto3.client(
+        'cloudwatch', region_name='us-east-1',
+        aws_access_key_id='testing', aws_secret_access_key='testing'
+    )
+    calls = []
+
+    def on_request(model, **kwargs):
+        calls.append(model.name)
+        if latency_ms:
+            time.sleep(latency_ms / 1000)
+    client.meta.events.register('before-parameter-build', on_request)
+    return client, Stubber(client), calls
+
+
+def per_function_statistics(cloudwatch, function_names, start_time, end_time):
+    """The previous lookup, one GetMetricStatistics call per function"""
+    sums = {}
+    for function_name in function_names:
+        metrics = cloudwatch.get_metric_statistics(
+            Namespace='AWS/Lambda',
+            MetricName='Invocations',
+            Dimensions=[{'Name': 'FunctionName', 'Value': function_name}],
+            StartTime=start_time,
+            EndTime=end_time,
+            Period=2592000,
+            Statistics=['Sum']
+        )
+        sums[function_name] = sum(datapoint.get('Sum', 0) for datapoint in metrics.get('Datapoints', []))
+    return sums
+
+
+def run(name, lookup, stub_responses, function_names, latency_ms):
+    cloudwatch, stubber, calls = make_cloudwatch(latency_ms)
+    stub_responses(stubber, function_names)
+    now = datetime.datetime.now(datetime.timezone.utc)
+    with stubber:
+        started = time.perf_counter()
+        sums = lookup(cloudwatch, function_names, now - datetime.timedelta(days=30), now)
+        elapsed = time.perf_counter() - started
+    stubber.assert_no_pending_responses()
+    idle = sum(1 for value in sums.values() if value == 0)
+    print(f"{name:<22} {len(calls):>8} requests {elapsed:>9.2f}s  {idle} idle of {len(function_names)}")
+    return sums
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--functions', type=int, default=5000)
+    parser.add_argument('--latency-ms', type=float, default=0, help='simulated round trip per request')
+    args = parser.parse_args()
+
+    idle_resources = load_lambda()
+    function_names = [f"function-{index}" for index in range(args.functions)]
+    # Every third function has invocations, the rest are idle
+    invocations = {name: 0.0 if index % 3 else 7.0 for index, name in enumerate(function_names)}
+
+    def stub_statistics(stubber, names):
+        for name in names:
+            datapoints = [{'Sum': invocations[name]}] if invocations[name] else []
+            stubber.add_response('get_metric_statistics', {'Datapoints': datapoints})
+
+    def stub_metric_data(stubber, names):
+        batch_size = idle_resources.METRIC_DATA_BATCH_SIZE
+        for offset in range(0, len(names), batch_size):
+            batch = names[offset:offset + batch_size]
+            stubber.add_response('get_metric_data', {'MetricDataResults': [
+                {'Id': f"m{index}", 'Values': [invocations[name]] if invocations[name] else []}
+                for index, name in enumerate(batch)
+            ]})
+
+    def batched_metric_data(cloudwatch, names, start_time, end_time):
+        sums, errors = idle_resources.get_invocation_sums(cloudwatch, names, start_time, end_time)
+        assert not errors, errors
+        return sums
+
+    before = run('GetMetricStatistics', per_function_statistics, stub_statistics, function_names, args.latency_ms)
+    after = run('GetMetricData', batched_metric_data, stub_metric_data, function_names, args.latency_ms)
+    assert before == after, 'both lookups must find the same invocation sums'
+
+
+if __name__ == '__main__':
+    main()
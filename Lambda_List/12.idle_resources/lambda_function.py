@@ -1,364 +1,893 @@
 import boto3
 import datetime
 import io
+import itertools
 import os
 import json
+import re
+import threading
+import time
 from contextlib import redirect_stdout
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field, fields
+from typing import Dict, List, Optional, Set, Tuple
 from openpyxl import Workbook
 
-def lambda_handler(event, context):
-    buffer = io.StringIO()
-    with redirect_stdout(buffer):
-        ec2 = boto3.client('ec2')
-        iam = boto3.client('iam')
-        lambda_client = boto3.client('lambda')
-        cloudwatch = boto3.client('cloudwatch')
-        cloudtrail = boto3.client('cloudtrail')
-        sns = boto3.client('sns')
-
-        now = datetime.datetime.now(datetime.timezone.utc)
-
-        # Helper function to get creator information from CloudTrail
-        def get_resource_creator(resource_type, resource_id):
-            try:
-                # Define event names based on resource type
-                event_names = {
-                    'ebs': ['CreateVolume'],
-                    'snapshot': ['CreateSnapshot', 'CopySnapshot'],
-                    'instance': ['RunInstances'],
-                    'security-group': ['CreateSecurityGroup'],
-                    'role': ['CreateRole'],
-                    'lambda': ['CreateFunction']
-                }
-                
-                # Look up events for this resource type
-                events = event_names.get(resource_type, [])
-                if not events:
-                    return "Unknown"
-                
-                # Get the timeframe for lookup - default to 90 days (CloudTrail limitation)
-                lookup_days = 90
-                start_time = now - datetime.timedelta(days=lookup_days)
-                
-                # Lookup in CloudTrail
-                response = cloudtrail.lookup_events(
-                    LookupAttributes=[
-                        {
-                            'AttributeKey': 'ResourceName',
-                            'AttributeValue': resource_id
-                        }
-                    ],
-                    StartTime=start_time,
-                    EndTime=now,
-                    MaxResults=10
-                )
-                
-                # Process results
-                for event in response.get('Events', []):
-                    cloud_trail_event = json.loads(event.get('CloudTrailEvent', '{}'))
-                    event_name = cloud_trail_event.get('eventName', '')
-                    
-                    if event_name in events:
-                        username = cloud_trail_event.get('userIdentity', {}).get('userName', '')
-                        user_type = cloud_trail_event.get('userIdentity', {}).get('type', '')
-                        if not username and user_type:
-                            # If userName is not available, use type or principalId
-                            username = user_type
-                            principalId = cloud_trail_event.get('userIdentity', {}).get('principalId', '')
-                            if principalId:
-                                username += f" ({principalId})"
-                        
-                        # Return username or a default if none found
-                        return username if username else "System or Service"
-                
-                return "Unknown"
-            except Exception as e:
-                print(f"Error retrieving creator for {resource_type} {resource_id}: {str(e)}")
-                return "Lookup Error"
-
-        # 1. Idle EBS Volumes
-        print("\n[1] Idle EBS Volumes:")
-        volumes = ec2.describe_volumes(Filters=[{'Name': 'status', 'Values': ['available']}])['Volumes']
-        # Add creator info for volumes
-        for volume in volumes:
-            volume['CreatedBy'] = get_resource_creator('ebs', volume['VolumeId'])
-            
-        if volumes:
-            for volume in volumes:
-                print(f"  - Volume ID: {volume['VolumeId']}, Size: {volume['Size']} GiB, Created By: {volume['CreatedBy']}")
-        else:
-            print("  - No idle EBS volumes found.")
-
-        # 2. Snapshot Audit
-        print("\n[2] Snapshot Expiry Tag Audit:")
-        snapshots = ec2.describe_snapshots(OwnerIds=['self'])['Snapshots']
-        # Add creator info for snapshots
-        for snapshot in snapshots:
-            snapshot['CreatedBy'] = get_resource_creator('snapshot', snapshot['SnapshotId'])
-            
-        flagged_long_expiry = []
-        missing_tag = []
-        invalid_tag = []
-
-        for snapshot in snapshots:
-            tags = snapshot.get('Tags', [])
-            expiry_tag = next((tag['Value'] for tag in tags if tag['Key'] == 'ExpiryDate'), None)
-
-            if not expiry_tag:
-                missing_tag.append(snapshot)
-                continue
-
-            try:
-                expiry_date = datetime.datetime.strptime(expiry_tag, "%Y-%m-%d").date()
-            except ValueError:
-                invalid_tag.append((snapshot, expiry_tag))
+# CloudTrail creation events swept by the creator index, mapped to the
+# resource type that identifies the created resource in each event
+CREATOR_EVENTS = {
+    'CreateVolume': 'AWS::EC2::Volume',
+    'CreateSnapshot': 'AWS::EC2::Snapshot',
+    'CopySnapshot': 'AWS::EC2::Snapshot',
+    'RunInstances': 'AWS::EC2::Instance',
+    'CreateSecurityGroup': 'AWS::EC2::SecurityGroup',
+    'CreateRole': 'AWS::IAM::Role',
+    'CreateFunction': 'AWS::Lambda::Function',
+    'CreateFunction20150331': 'AWS::Lambda::Function'
+}
+CLOUDTRAIL_LOOKBACK_DAYS = 90
+CREATOR_INDEX_KEY = os.environ.get('CREATOR_INDEX_KEY', 'state/creator_index.json')
+# Entries whose creation event is older than this are dropped, so the index does not grow forever
+CREATOR_INDEX_RETENTION_DAYS = int(os.environ.get('CREATOR_INDEX_RETENTION_DAYS', str(CLOUDTRAIL_LOOKBACK_DAYS)))
+
+def get_event_creator(cloud_trail_event):
+    """Helper function to get the creator name from a CloudTrail event"""
+    user_identity = cloud_trail_event.get('userIdentity', {})
+    username = user_identity.get('userName', '')
+    user_type = user_identity.get('type', '')
+    if not username and user_type:
+        # If userName is not available, use type or principalId
+        username = user_type
+        principal_id = user_identity.get('principalId', '')
+        if principal_id:
+            username += f" ({principal_id})"
+    return username if username else "System or Service"
+
+def sweep_creator_events(cloudtrail, start_time, end_time):
+    """Helper function to map resource IDs to [creator, event time] with one CloudTrail sweep per event name"""
+    creators = {}
+    complete = True
+    paginator = cloudtrail.get_paginator('lookup_events')
+    for event_name, resource_type in CREATOR_EVENTS.items():
+        try:
+            pages = paginator.paginate(
+                LookupAttributes=[{'AttributeKey': 'EventName', 'AttributeValue': event_name}],
+                StartTime=start_time,
+                EndTime=end_time
+            )
+            for page in pages:
+                for event in page.get('Events', []):
+                    entry = None
+                    for resource in event.get('Resources', []):
+                        resource_name = resource.get('ResourceName')
+                        if resource.get('ResourceType') != resource_type or not resource_name:
+                            continue
+                        if entry is None:
+                            entry = [get_event_creator(json.loads(event.get('CloudTrailEvent', '{}'))), event['EventTime'].isoformat()]
+                        # Events come back newest first, so keep the first creator seen
+                        creators.setdefault(resource_name, entry)
+                        if resource_name.startswith('arn:'):
+                            creators.setdefault(resource_name.split(':')[-1].split('/')[-1], entry)
+        except Exception as e:
+            print(f"Error sweeping CloudTrail {event_name} events: {str(e)}")
+            complete = False
+    return creators, complete
+
+def load_creator_index(s3, bucket, key):
+    """Helper function to load the persisted creator index and its watermark from S3"""
+    try:
+        index = json.loads(s3.get_object(Bucket=bucket, Key=key)['Body'].read())
+        return index.get('creators', {}), index.get('watermark')
+    except Exception as e:
+        print(f"No creator index loaded from s3://{bucket}/{key}, starting a full sweep: {str(e)}")
+        return {}, None
+
+def save_creator_index(s3, bucket, key, creators, watermark):
+    """Helper function to persist the creator index and its watermark to S3"""
+    try:
+        s3.put_object(
+            Bucket=bucket,
+            Key=key,
+            Body=json.dumps({'watermark': watermark, 'creators': creators}),
+            ContentType='application/json'
+        )
+    except Exception as e:
+        print(f"Error saving creator index to s3://{bucket}/{key}: {str(e)}")
+
+def build_creator_index(cloudtrail, s3, bucket, now, key=CREATOR_INDEX_KEY):
+    """Helper function to refresh the creator index with the CloudTrail events since the last watermark"""
+    creators, watermark = load_creator_index(s3, bucket, key)
+    start_time = now - datetime.timedelta(days=CLOUDTRAIL_LOOKBACK_DAYS)
+    if watermark:
+        # Overlap the previous window to pick up events CloudTrail delivered late
+        start_time = max(start_time, datetime.datetime.fromisoformat(watermark) - datetime.timedelta(hours=1))
+
+    new_creators, complete = sweep_creator_events(cloudtrail, start_time, now)
+    creators.update(new_creators)
+    # Drop entries past the retention, and entries saved without an event time by earlier versions
+    cutoff = now - datetime.timedelta(days=CREATOR_INDEX_RETENTION_DAYS)
+    creators = {
+        resource_id: entry for resource_id, entry in creators.items()
+        if isinstance(entry, list) and datetime.datetime.fromisoformat(entry[1]) >= cutoff
+    }
+    # Only move the watermark forward when every event name was swept successfully
+    if complete:
+        watermark = now.isoformat()
+    save_creator_index(s3, bucket, key, creators, watermark)
+    print(f"Creator index holds {len(creators)} resources ({len(new_creators)} from events since {start_time.isoformat()})")
+    return {resource_id: creator for resource_id, (creator, _) in creators.items()}
+
+# Typed findings model built once by the collection phase and shared by the
+# stdout log, the workbook and the SNS summary
+@dataclass
+class VolumeFinding:
+    volume_id: str
+    size: int
+    state: str
+    create_time: Optional[datetime.datetime]
+    created_by: str
+
+@dataclass
+class SnapshotFinding:
+    snapshot_id: str
+    volume_id: Optional[str]
+    size: int
+    start_time: Optional[datetime.datetime]
+    expiry_tag: Optional[str]
+    created_by: str
+    linkage: str = ''
+
+@dataclass
+class InstanceFinding:
+    instance_id: str
+    instance_type: str
+    state: str
+    launch_time: Optional[datetime.datetime]
+    created_by: str
+
+@dataclass
+class SecurityGroupFinding:
+    group_id: str
+    group_name: str
+    created_by: str
+
+@dataclass
+class RoleFinding:
+    role_name: str
+    description: str
+    create_date: Optional[datetime.datetime]
+    created_by: str
+
+@dataclass
+class FunctionFinding:
+    function_name: str
+    last_modified: str
+    created_by: str
+    invocations: float
+
+@dataclass
+class AuditFindings:
+    idle_volumes: List[VolumeFinding] = field(default_factory=list)
+    # Only snapshots with an expiry finding are kept, the rest are just counted
+    snapshots: List[SnapshotFinding] = field(default_factory=list)
+    snapshots_scanned: int = 0
+    long_expiry_snapshots: List[Tuple[SnapshotFinding, datetime.date, int]] = field(default_factory=list)
+    invalid_expiry_snapshots: List[Tuple[SnapshotFinding, str]] = field(default_factory=list)
+    missing_expiry_snapshots: List[SnapshotFinding] = field(default_factory=list)
+    orphaned_snapshots: List[SnapshotFinding] = field(default_factory=list)
+    stopped_instances: List[InstanceFinding] = field(default_factory=list)
+    unused_security_groups: List[SecurityGroupFinding] = field(default_factory=list)
+    roles_without_policies: List[RoleFinding] = field(default_factory=list)
+    role_errors: List[Tuple[str, str]] = field(default_factory=list)
+    idle_functions: List[FunctionFinding] = field(default_factory=list)
+    function_errors: List[Tuple[str, str]] = field(default_factory=list)
+    section_timings: Dict[str, float] = field(default_factory=dict)
+
+@dataclass
+class LinkageIndex:
+    volume_ids: Set[str] = field(default_factory=set)
+    instance_ids: Set[str] = field(default_factory=set)
+    image_ids: Set[str] = field(default_factory=set)
+    image_snapshots: Dict[str, str] = field(default_factory=dict)
+
+# GetMetricData accepts at most 500 queries per request
+METRIC_DATA_BATCH_SIZE = 500
+
+def get_invocation_sums(cloudwatch, function_names, start_time, end_time):
+    """Helper function to sum AWS/Lambda Invocations per function with batched GetMetricData calls"""
+    sums = {}
+    errors = {}
+    for offset in range(0, len(function_names), METRIC_DATA_BATCH_SIZE):
+        batch = function_names[offset:offset + METRIC_DATA_BATCH_SIZE]
+        # Query IDs must start with a lowercase letter, so map them back by position
+        queries = [
+            {
+                'Id': f"m{index}",
+                'MetricStat': {
+                    'Metric': {
+                        'Namespace': 'AWS/Lambda',
+                        'MetricName': 'Invocations',
+                        'Dimensions': [{'Name': 'FunctionName', 'Value': function_name}]
+                    },
+                    'Period': 2592000,
+                    'Stat': 'Sum'
+                },
+                'ReturnData': True
+            }
+            for index, function_name in enumerate(batch)
+        ]
+        try:
+            batch_sums = dict.fromkeys(batch, 0)
+            request = {'MetricDataQueries': queries, 'StartTime': start_time, 'EndTime': end_time}
+            while True:
+                response = cloudwatch.get_metric_data(**request)
+                for result in response.get('MetricDataResults', []):
+                    function_name = batch[int(result['Id'][1:])]
+                    batch_sums[function_name] += sum(result.get('Values', []))
+                if not response.get('NextToken'):
+                    break
+                request['NextToken'] = response['NextToken']
+            sums.update(batch_sums)
+        except Exception as e:
+            for function_name in batch:
+                errors[function_name] = str(e)
+    return sums, errors
+
+# Streaming collectors: each one walks every page of its API with server-side
+# filters where available and yields slim records instead of boto responses.
+# CreatedBy is filled in from the creator index once every section is done.
+def iter_pages(client, operation, result_key, **kwargs):
+    """Helper function to stream items from every page of a paginated API call"""
+    for page in client.get_paginator(operation).paginate(**kwargs):
+        yield from page.get(result_key, [])
+
+# Inventory backends: instances, volumes, ENIs and security groups come either
+# from AWS Config advanced queries or from the EC2 describe APIs. Config returns
+# camelCase configuration documents, which are converted to the describe shape
+# so the collectors below do not care which backend produced a record.
+CONFIG_RESOURCE_TYPES = {
+    'instances': 'AWS::EC2::Instance',
+    'volumes': 'AWS::EC2::Volume',
+    'network_interfaces': 'AWS::EC2::NetworkInterface',
+    'security_groups': 'AWS::EC2::SecurityGroup'
+}
+# select_resource_config returns at most 100 results per call
+CONFIG_QUERY_PAGE_SIZE = 100
+CONFIG_TIMESTAMP_KEYS = {'LaunchTime', 'CreateTime', 'AttachTime', 'StartTime'}
+
+def from_config_document(value, key=None):
+    """Helper function to convert a camelCase AWS Config configuration document to the shape of the EC2 describe APIs"""
+    if isinstance(value, dict):
+        converted = {}
+        for name, item in value.items():
+            # Config writes absent fields as null where the describe APIs omit the key
+            if item is None:
                 continue
-
-            days_ahead = (expiry_date - datetime.date.today()).days
-            if days_ahead > 90:
-                flagged_long_expiry.append((snapshot, expiry_date, days_ahead))
-
-        if flagged_long_expiry:
-            print("  - Snapshots with ExpiryDate more than 90 days in the future:")
-            for snapshot, expiry_date, days in flagged_long_expiry:
-                print(f"    • Snapshot ID: {snapshot['SnapshotId']}, Expiry Date: {expiry_date}, {days} days ahead, Size: {snapshot['VolumeSize']} GiB")
-        else:
-            print("  - No snapshots found with ExpiryDate > 90 days.")
-
-        if invalid_tag:
-            print("  - Snapshots with invalid ExpiryDate tag format:")
-            for snapshot, tag_value in invalid_tag:
-                print(f"    • Snapshot ID: {snapshot['SnapshotId']}, Tag Value: '{tag_value}' (Expected YYYY-MM-DD)")
-
-        if missing_tag:
-            print("  - Snapshots missing the 'ExpiryDate' tag:")
-            for snapshot in missing_tag:
-                print(f"    • Snapshot ID: {snapshot['SnapshotId']}, Size: {snapshot['VolumeSize']} GiB")
+            name = name[:1].upper() + name[1:]
+            converted[name] = from_config_document(item, name)
+        return converted
+    if isinstance(value, list):
+        return [from_config_document(item) for item in value]
+    if key in CONFIG_TIMESTAMP_KEYS and isinstance(value, str):
+        return datetime.datetime.fromisoformat(value.replace('Z', '+00:00'))
+    if key in CONFIG_TIMESTAMP_KEYS and isinstance(value, (int, float)):
+        return datetime.datetime.fromtimestamp(value / 1000, tz=datetime.timezone.utc)
+    return value
+
+def sql_string_list(values):
+    """Helper function to render values as a Config SQL IN list"""
+    return ', '.join(f"'{value}'" for value in values)
+
+class DescribeInventory:
+    """Inventory backend that pages the EC2 describe APIs with server-side filters"""
+    name = 'describe'
+
+    def __init__(self, ec2):
+        self.ec2 = ec2
+
+    def volumes(self, states=None):
+        filters = [{'Name': 'status', 'Values': states}] if states else []
+        return iter_pages(self.ec2, 'describe_volumes', 'Volumes', Filters=filters)
+
+    def instances(self, states=None):
+        filters = [{'Name': 'instance-state-name', 'Values': states}] if states else []
+        for reservation in iter_pages(self.ec2, 'describe_instances', 'Reservations', Filters=filters):
+            yield from reservation['Instances']
+
+    def network_interfaces(self):
+        return iter_pages(self.ec2, 'describe_network_interfaces', 'NetworkInterfaces')
+
+    def security_groups(self):
+        return iter_pages(self.ec2, 'describe_security_groups', 'SecurityGroups')
+
+class ConfigInventory(DescribeInventory):
+    """Inventory backend that reads AWS Config advanced queries (or an aggregator), falling back to describe calls"""
+    name = 'config'
+
+    def __init__(self, ec2, config, recorded_types, aggregator=None, account_id=None):
+        super().__init__(ec2)
+        self.config = config
+        self.recorded_types = recorded_types
+        self.aggregator = aggregator
+        self.account_id = account_id
+
+    def select(self, expression, next_token=None):
+        request = {'Expression': expression, 'Limit': CONFIG_QUERY_PAGE_SIZE}
+        if next_token:
+            request['NextToken'] = next_token
+        if self.aggregator:
+            return self.config.select_aggregate_resource_config(ConfigurationAggregatorName=self.aggregator, **request)
+        return self.config.select_resource_config(**request)
+
+    def query(self, kind, condition=''):
+        """Return describe-shaped records of one kind from Config, or None when the describe APIs must be used"""
+        resource_type = CONFIG_RESOURCE_TYPES[kind]
+        if resource_type not in self.recorded_types:
+            return None
+        if self.aggregator:
+            # The report, its Region column and the linkage maps cover this account and region only
+            condition = f" AND accountId = '{self.account_id}' AND awsRegion = '{self.ec2.meta.region_name}'{condition}"
+        expression = f"SELECT resourceId, configuration, tags WHERE resourceType = '{resource_type}'{condition}"
+        # The first page decides the backend, so a fallback never repeats records already handed out
+        try:
+            page = self.select(expression)
+        except Exception as e:
+            print(f"Config query for {resource_type} failed, using describe calls: {e}")
+            return None
+        return self.iter_results(expression, page)
+
+    def iter_results(self, expression, page):
+        while True:
+            for result in page.get('Results', []):
+                item = json.loads(result)
+                record = from_config_document(item.get('configuration') or {})
+                record['Tags'] = from_config_document(item.get('tags') or [])
+                yield record
+            if not page.get('NextToken'):
+                return
+            page = self.select(expression, page['NextToken'])
+
+    def volumes(self, states=None):
+        condition = f" AND configuration.state IN ({sql_string_list(states)})" if states else ''
+        return self.query('volumes', condition) or super().volumes(states)
+
+    def instances(self, states=None):
+        condition = f" AND configuration.state.name IN ({sql_string_list(states)})" if states else ''
+        return self.query('instances', condition) or super().instances(states)
+
+    def network_interfaces(self):
+        return self.query('network_interfaces') or super().network_interfaces()
+
+    def security_groups(self):
+        return self.query('security_groups') or super().security_groups()
+
+def get_recorded_resource_types(config):
+    """Helper function to list the CONFIG_RESOURCE_TYPES this account's Config recorder is recording"""
+    statuses = config.describe_configuration_recorder_status()['ConfigurationRecordersStatus']
+    if not any(status.get('recording') for status in statuses):
+        return set()
+
+    supported = set(CONFIG_RESOURCE_TYPES.values())
+    recorded = set()
+    for recorder in config.describe_configuration_recorders()['ConfigurationRecorders']:
+        group = recorder.get('recordingGroup', {})
+        strategy = group.get('recordingStrategy', {}).get('useOnly')
+        if group.get('allSupported') or strategy == 'ALL_SUPPORTED_RESOURCE_TYPES':
+            recorded |= supported
+        elif strategy == 'EXCLUSION_BY_RESOURCE_TYPES':
+            recorded |= supported - set(group.get('exclusionByResourceTypes', {}).get('resourceTypes', []))
         else:
-            print("  - All snapshots have the 'ExpiryDate' tag.")
-
-        # 2b. Untagged and Possibly Orphaned Snapshots
-        print("\n[2b] Untagged Snapshots Not Linked to Any Volume or EC2 Instance:")
-        all_volume_ids = set(vol['VolumeId'] for vol in ec2.describe_volumes()['Volumes'])
-
-        reservations = ec2.describe_instances(Filters=[{'Name': 'instance-state-name', 'Values': ['pending', 'running', 'stopping', 'stopped']}])['Reservations']
-        all_instance_ids = set()
-        for reservation in reservations:
-            for instance in reservation['Instances']:
-                all_instance_ids.add(instance['InstanceId'])
-
-        untagged_orphaned_snapshots = []
-        for snapshot in snapshots:
-            tags = snapshot.get('Tags', [])
-            expiry_tag = next((tag['Value'] for tag in tags if tag['Key'] == 'ExpiryDate'), None)
-
-            if expiry_tag:
-                continue  # Tagged → skip
-
-            volume_id = snapshot.get('VolumeId')
-            if volume_id in all_volume_ids:
-                continue  # Volume exists → skip
+            recorded |= supported & set(group.get('resourceTypes', []))
+    return recorded
+
+def get_inventory(ec2, config):
+    """Helper function to pick the inventory backend from INVENTORY_BACKEND (auto, config or describe)"""
+    backend = os.environ.get('INVENTORY_BACKEND', 'auto')
+    aggregator = os.environ.get('CONFIG_AGGREGATOR_NAME') or None
+    if backend == 'describe':
+        return DescribeInventory(ec2)
+    if aggregator:
+        # An aggregator is trusted for every type, failed queries still fall back
+        account_id = boto3.client('sts').get_caller_identity()['Account']
+        return ConfigInventory(ec2, config, set(CONFIG_RESOURCE_TYPES.values()), aggregator, account_id)
+    if backend == 'config':
+        return ConfigInventory(ec2, config, set(CONFIG_RESOURCE_TYPES.values()))
+    try:
+        recorded = get_recorded_resource_types(config)
+    except Exception as e:
+        print(f"AWS Config recorder status unavailable, using describe calls: {e}")
+        recorded = set()
+    return ConfigInventory(ec2, config, recorded) if recorded else DescribeInventory(ec2)
+
+def iter_idle_volumes(inventory):
+    """Stream unattached (available) EBS volumes"""
+    for volume in inventory.volumes(['available']):
+        yield VolumeFinding(
+            volume_id=volume['VolumeId'],
+            size=volume['Size'],
+            state=volume.get('State', 'available'),
+            create_time=volume.get('CreateTime'),
+            created_by='Unknown'
+        )
 
-            # Try to detect EC2 link from description
-            description = snapshot.get('Description', '').lower()
-            linked_instance = any(instance_id.lower() in description for instance_id in all_instance_ids)
+def iter_volume_ids(inventory):
+    """Stream the IDs of every EBS volume"""
+    for volume in inventory.volumes():
+        yield volume['VolumeId']
+
+def iter_instances(inventory, states):
+    """Stream EC2 instances in the given states"""
+    for instance in inventory.instances(states):
+        yield InstanceFinding(
+            instance_id=instance['InstanceId'],
+            instance_type=instance['InstanceType'],
+            state=instance['State']['Name'],
+            launch_time=instance.get('LaunchTime'),
+            created_by='Unknown'
+        )
 
-            if not linked_instance:
-                untagged_orphaned_snapshots.append(snapshot)
+def iter_snapshots(ec2):
+    """Stream snapshots owned by this account together with their lower-cased description"""
+    for snapshot in iter_pages(ec2, 'describe_snapshots', 'Snapshots', OwnerIds=['self']):
+        yield SnapshotFinding(
+            snapshot_id=snapshot['SnapshotId'],
+            volume_id=snapshot.get('VolumeId'),
+            size=snapshot['VolumeSize'],
+            start_time=snapshot.get('StartTime'),
+            expiry_tag=next((tag['Value'] for tag in snapshot.get('Tags', []) if tag['Key'] == 'ExpiryDate'), None),
+            created_by='Unknown'
+        ), snapshot.get('Description', '').lower()
+
+def iter_used_security_group_ids(inventory):
+    """Stream the security group IDs referenced by any network interface"""
+    for eni in inventory.network_interfaces():
+        for group in eni['Groups']:
+            yield group['GroupId']
+
+def iter_security_groups(inventory):
+    """Stream every non-default security group"""
+    for sg in inventory.security_groups():
+        if sg['GroupName'] != 'default':
+            yield SecurityGroupFinding(
+                group_id=sg['GroupId'],
+                group_name=sg['GroupName'],
+                created_by='Unknown'
+            )
+
+def iter_roles(iam):
+    """Stream every IAM role"""
+    for role in iter_pages(iam, 'list_roles', 'Roles'):
+        yield RoleFinding(
+            role_name=role['RoleName'],
+            description=role.get('Description', ''),
+            create_date=role.get('CreateDate'),
+            created_by='Unknown'
+        )
 
-        if untagged_orphaned_snapshots:
-            for snap in untagged_orphaned_snapshots:
-                print(f"  - Snapshot ID: {snap['SnapshotId']}, Volume ID: {snap.get('VolumeId', 'N/A')}, Created: {snap['StartTime'].date()}, Size: {snap['VolumeSize']} GiB")
-        else:
-            print("  - No untagged, orphaned snapshots without EC2 link found.")
-
-        # 3. Stopped EC2 Instances
-        print("\n[3] Stopped EC2 Instances:")
-        instances = ec2.describe_instances(Filters=[{'Name': 'instance-state-name', 'Values': ['stopped']}])['Reservations']
-        for reservation in instances:
-            for instance in reservation['Instances']:
-                instance['CreatedBy'] = get_resource_creator('instance', instance['InstanceId'])
-                
-        if instances and any(r['Instances'] for r in instances):
-            for reservation in instances:
-                for instance in reservation['Instances']:
-                    print(f"  - Instance ID: {instance['InstanceId']}, Type: {instance['InstanceType']}, Created By: {instance['CreatedBy']}")
-        else:
-            print("  - No stopped EC2 instances found.")
-
-        # 4. Unused Security Groups
-        print("\n[4] Unused Security Groups:")
-        all_sgs = ec2.describe_security_groups()['SecurityGroups']
-        # Add creator info for security groups
-        for sg in all_sgs:
-            sg['CreatedBy'] = get_resource_creator('security-group', sg['GroupId'])
-            
-        used_sgs = set()
-        enis = ec2.describe_network_interfaces()['NetworkInterfaces']
-        for eni in enis:
-            for group in eni['Groups']:
-                used_sgs.add(group['GroupId'])
-
-        unused_sgs = [sg for sg in all_sgs if sg['GroupId'] not in used_sgs and sg['GroupName'] != 'default']
-        if unused_sgs:
-            for sg in unused_sgs:
-                print(f"  - Security Group ID: {sg['GroupId']}, Name: {sg['GroupName']}, Created By: {sg['CreatedBy']}")
-        else:
-            print("  - No unused security groups found.")
-
-        # 5. IAM Roles with No Attached Policies
-        print("\n[5] IAM Roles with No Attached Policies:")
-        roles = iam.list_roles()['Roles']
-        for role in roles:
-            role['CreatedBy'] = get_resource_creator('role', role['RoleName'])
-            
-        found = False
-        for role in roles:
-            try:
-                attached_policies = iam.list_attached_role_policies(RoleName=role['RoleName'])['AttachedPolicies']
-                inline_policies = iam.list_role_policies(RoleName=role['RoleName'])['PolicyNames']
-            except Exception as e:
-                print(f"  - Skipping role {role['RoleName']} due to error: {e}")
-                continue
+def iter_functions(lambda_client):
+    """Stream every Lambda function"""
+    for function in iter_pages(lambda_client, 'list_functions', 'Functions'):
+        yield FunctionFinding(
+            function_name=function['FunctionName'],
+            last_modified=function.get('LastModified', ''),
+            created_by='Unknown',
+            invocations=0
+        )
 
-            if not attached_policies and not inline_policies:
-                print(f"  - Role Name: {role['RoleName']}, Created By: {role['CreatedBy']}")
-                found = True
-        if not found:
-            print("  - All roles have attached or inline policies.")
-
-        # 6. Idle Lambda Functions (No Invocations in 30+ Days)
-        print("\n[6] Idle Lambda Functions (No Invocations in 30+ Days):")
-        functions = lambda_client.list_functions()['Functions']
-        for function in functions:
-            function['CreatedBy'] = get_resource_creator('lambda', function['FunctionName'])
-            
-        found = False
-        for function in functions:
-            function_name = function['FunctionName']
-
-            try:
-                metrics = cloudwatch.get_metric_statistics(
-                    Namespace='AWS/Lambda',
-                    MetricName='Invocations',
-                    Dimensions=[{'Name': 'FunctionName', 'Value': function_name}],
-                    StartTime=now - datetime.timedelta(days=30),
-                    EndTime=now,
-                    Period=2592000,
-                    Statistics=['Sum']
-                )
-            except Exception as e:
-                print(f"  - Could not fetch metrics for {function_name}: {str(e)}")
+def iter_images(ec2):
+    """Stream AMIs owned by this account with the snapshot IDs in their block device mappings"""
+    for image in iter_pages(ec2, 'describe_images', 'Images', Owners=['self']):
+        snapshot_ids = [
+            mapping['Ebs']['SnapshotId']
+            for mapping in image.get('BlockDeviceMappings', [])
+            if mapping.get('Ebs', {}).get('SnapshotId')
+        ]
+        yield image['ImageId'], snapshot_ids
+
+# Resource IDs a snapshot description can point at, e.g.
+# "Created by CreateImage(i-0abc...) for ami-0def... from vol-0123..."
+LINKED_ID_PATTERN = re.compile(r'\b(?:i|vol|ami)-[0-9a-f]{8,17}\b')
+ORPHANED_LINKAGE = 'Not linked to a live volume, instance or AMI'
+
+def build_linkage_index(inventory, ec2):
+    """Helper function to build the hash sets snapshots are linked against"""
+    index = LinkageIndex()
+    index.volume_ids.update(iter_volume_ids(inventory))
+    index.instance_ids.update(
+        instance.instance_id
+        for instance in iter_instances(inventory, ['pending', 'running', 'stopping', 'stopped'])
+    )
+    for image_id, snapshot_ids in iter_images(ec2):
+        index.image_ids.add(image_id)
+        for snapshot_id in snapshot_ids:
+            index.image_snapshots[snapshot_id] = image_id
+    return index
+
+def classify_snapshot_linkage(index, finding, description):
+    """Helper function to explain what keeps a snapshot alive, or ORPHANED_LINKAGE if nothing does"""
+    if finding.volume_id in index.volume_ids:
+        return f"Source volume {finding.volume_id} exists"
+    if finding.snapshot_id in index.image_snapshots:
+        return f"Backs AMI {index.image_snapshots[finding.snapshot_id]}"
+    for resource_id in LINKED_ID_PATTERN.findall(description):
+        if resource_id in index.instance_ids:
+            return f"Instance {resource_id} in description exists"
+        if resource_id in index.volume_ids:
+            return f"Volume {resource_id} in description exists"
+        if resource_id in index.image_ids:
+            return f"AMI {resource_id} in description exists"
+    return ORPHANED_LINKAGE
+
+def collect_idle_volume_section(clients, now):
+    """Section [1]: idle EBS volumes"""
+    findings = AuditFindings()
+    findings.idle_volumes.extend(iter_idle_volumes(clients['inventory']))
+    return findings
+
+def collect_snapshot_section(clients, now):
+    """Sections [2] and [2b]: snapshot expiry tags and orphaned snapshots"""
+    findings = AuditFindings()
+
+    # Live volumes, instances and AMIs a snapshot may still be linked to
+    linkage_index = build_linkage_index(clients['inventory'], clients['ec2'])
+
+    for finding, description in iter_snapshots(clients['ec2']):
+        expiry_tag = finding.expiry_tag
+        finding.linkage = classify_snapshot_linkage(linkage_index, finding, description)
+        findings.snapshots_scanned += 1
+
+        if not expiry_tag:
+            findings.snapshots.append(finding)
+            findings.missing_expiry_snapshots.append(finding)
+
+            # 2b. Untagged and Possibly Orphaned Snapshots
+            if finding.linkage == ORPHANED_LINKAGE:
+                findings.orphaned_snapshots.append(finding)
+            continue
+
+        try:
+            expiry_date = datetime.datetime.strptime(expiry_tag, "%Y-%m-%d").date()
+        except ValueError:
+            findings.snapshots.append(finding)
+            findings.invalid_expiry_snapshots.append((finding, expiry_tag))
+            continue
+
+        days_ahead = (expiry_date - datetime.date.today()).days
+        if days_ahead > 90:
+            findings.snapshots.append(finding)
+            findings.long_expiry_snapshots.append((finding, expiry_date, days_ahead))
+    return findings
+
+def collect_stopped_instance_section(clients, now):
+    """Section [3]: stopped EC2 instances"""
+    findings = AuditFindings()
+    findings.stopped_instances.extend(iter_instances(clients['inventory'], ['stopped']))
+    return findings
+
+def collect_security_group_section(clients, now):
+    """Section [4]: security groups not attached to any network interface"""
+    findings = AuditFindings()
+    used_sgs = set(iter_used_security_group_ids(clients['inventory']))
+    findings.unused_security_groups.extend(
+        sg for sg in iter_security_groups(clients['inventory']) if sg.group_id not in used_sgs
+    )
+    return findings
+
+def collect_role_section(clients, now):
+    """Section [5]: IAM roles with no attached or inline policies"""
+    findings = AuditFindings()
+    iam = clients['iam']
+    for role in iter_roles(iam):
+        try:
+            attached_policies = iam.list_attached_role_policies(RoleName=role.role_name)['AttachedPolicies']
+            inline_policies = iam.list_role_policies(RoleName=role.role_name)['PolicyNames']
+        except Exception as e:
+            findings.role_errors.append((role.role_name, str(e)))
+            continue
+
+        if not attached_policies and not inline_policies:
+            findings.roles_without_policies.append(role)
+    return findings
+
+def collect_function_section(clients, now):
+    """Section [6]: Lambda functions with no invocations in 30+ days"""
+    findings = AuditFindings()
+    functions = iter_functions(clients['lambda'])
+    while True:
+        # Pull one GetMetricData batch worth of functions at a time
+        batch = list(itertools.islice(functions, METRIC_DATA_BATCH_SIZE))
+        if not batch:
+            break
+
+        invocation_sums, metric_errors = get_invocation_sums(
+            clients['cloudwatch'],
+            [function.function_name for function in batch],
+            now - datetime.timedelta(days=30),
+            now
+        )
+        for function in batch:
+            if function.function_name in metric_errors:
+                findings.function_errors.append((function.function_name, metric_errors[function.function_name]))
                 continue
 
-            datapoints = metrics.get('Datapoints', [])
-            if isinstance(datapoints, list) and datapoints and isinstance(datapoints[0], dict):
-                invocation_count = datapoints[0].get('Sum', 0)
-            else:
-                invocation_count = 0
-
-            if invocation_count == 0:
-                print(f"  - Function Name: {function_name}, Created By: {function['CreatedBy']}")
-                found = True
-
-        if not found:
-            print("  - All functions have been invoked within the last 30 days.")
+            function.invocations = invocation_sums.get(function.function_name, 0)
+            if function.invocations == 0:
+                findings.idle_functions.append(function)
+    return findings
+
+# Audit sections in report order with the AWS services each one calls
+AUDIT_SECTIONS = [
+    ('IdleEBS', ('ec2',), collect_idle_volume_section),
+    ('Snapshots', ('ec2',), collect_snapshot_section),
+    ('StoppedInstances', ('ec2',), collect_stopped_instance_section),
+    ('UnusedSecurityGroups', ('ec2',), collect_security_group_section),
+    ('IAMRoles', ('iam',), collect_role_section),
+    ('IdleLambdas', ('lambda', 'cloudwatch'), collect_function_section)
+]
+
+# How many sections may call each service at the same time, so one service's
+# throttling limits are never shared by more sections than it can take
+SERVICE_CONCURRENCY = {
+    'ec2': int(os.environ.get('EC2_CONCURRENCY', '2')),
+    'iam': 1,
+    'cloudtrail': 1,
+    'cloudwatch': 1,
+    'lambda': 1
+}
+# One worker per section plus the creator sweep, so a section waiting on its
+# service budget never holds up a section for a different service
+SECTION_WORKERS = int(os.environ.get('SECTION_WORKERS', str(len(AUDIT_SECTIONS) + 1)))
+
+# Findings lists whose records carry a CreatedBy value, with their resource ID field
+CREATOR_FIELDS = {
+    'idle_volumes': 'volume_id',
+    'snapshots': 'snapshot_id',
+    'stopped_instances': 'instance_id',
+    'unused_security_groups': 'group_id',
+    'roles_without_policies': 'role_name',
+    'idle_functions': 'function_name'
+}
+
+def run_section(services, section, clients, now, budgets):
+    """Helper function to run one section inside its services' budgets and time it"""
+    # Acquire in a fixed order so two multi-service sections can never deadlock
+    acquired = []
+    try:
+        for service in sorted(services):
+            budgets[service].acquire()
+            acquired.append(budgets[service])
+        started = time.monotonic()
+        result = section(clients, now)
+        return result, time.monotonic() - started
+    finally:
+        for budget in reversed(acquired):
+            budget.release()
+
+def collect_findings(clients, now, creator_section):
+    """Collection phase: run every audit section concurrently and merge the results in report order"""
+    budgets = {service: threading.BoundedSemaphore(limit) for service, limit in SERVICE_CONCURRENCY.items()}
+    findings = AuditFindings()
+
+    with ThreadPoolExecutor(max_workers=SECTION_WORKERS) as executor:
+        # The CloudTrail creator sweep is usually the longest, so start it first
+        creator_future = executor.submit(run_section, ('cloudtrail',), creator_section, clients, now, budgets)
+        futures = [
+            (name, executor.submit(run_section, services, section, clients, now, budgets))
+            for name, services, section in AUDIT_SECTIONS
+        ]
+
+        for name, future in futures:
+            section_findings, elapsed = future.result()
+            findings.section_timings[name] = elapsed
+            for findings_field in fields(AuditFindings):
+                value = getattr(section_findings, findings_field.name)
+                if isinstance(value, list):
+                    getattr(findings, findings_field.name).extend(value)
+                elif isinstance(value, int):
+                    setattr(findings, findings_field.name, getattr(findings, findings_field.name) + value)
+
+        creator_index, elapsed = creator_future.result()
+        findings.section_timings['CreatorIndex'] = elapsed
+
+    for field_name, id_field in CREATOR_FIELDS.items():
+        for record in getattr(findings, field_name):
+            record.created_by = creator_index.get(getattr(record, id_field), 'Unknown')
+
+    return findings
+
+def print_findings(findings):
+    """Rendering phase: write the console log from the findings model"""
+    print("\n[1] Idle EBS Volumes:")
+    if findings.idle_volumes:
+        for volume in findings.idle_volumes:
+            print(f"  - Volume ID: {volume.volume_id}, Size: {volume.size} GiB, Created By: {volume.created_by}")
+    else:
+        print("  - No idle EBS volumes found.")
+
+    print("\n[2] Snapshot Expiry Tag Audit:")
+    print(f"  - Snapshots scanned: {findings.snapshots_scanned}")
+    if findings.long_expiry_snapshots:
+        print("  - Snapshots with ExpiryDate more than 90 days in the future:")
+        for snapshot, expiry_date, days in findings.long_expiry_snapshots:
+            print(f"    • Snapshot ID: {snapshot.snapshot_id}, Expiry Date: {expiry_date}, {days} days ahead, Size: {snapshot.size} GiB")
+    else:
+        print("  - No snapshots found with ExpiryDate > 90 days.")
+
+    if findings.invalid_expiry_snapshots:
+        print("  - Snapshots with invalid ExpiryDate tag format:")
+        for snapshot, tag_value in findings.invalid_expiry_snapshots:
+            print(f"    • Snapshot ID: {snapshot.snapshot_id}, Tag Value: '{tag_value}' (Expected YYYY-MM-DD)")
+
+    if findings.missing_expiry_snapshots:
+        print("  - Snapshots missing the 'ExpiryDate' tag:")
+        for snapshot in findings.missing_expiry_snapshots:
+            print(f"    • Snapshot ID: {snapshot.snapshot_id}, Size: {snapshot.size} GiB")
+    else:
+        print("  - All snapshots have the 'ExpiryDate' tag.")
+
+    print("\n[2b] Untagged Snapshots Not Linked to Any Volume, EC2 Instance or AMI:")
+    if findings.orphaned_snapshots:
+        for snap in findings.orphaned_snapshots:
+            created = snap.start_time.date() if snap.start_time else 'N/A'
+            print(f"  - Snapshot ID: {snap.snapshot_id}, Volume ID: {snap.volume_id or 'N/A'}, Created: {created}, Size: {snap.size} GiB")
+    else:
+        print("  - No untagged, orphaned snapshots without EC2 link found.")
+
+    print("\n[3] Stopped EC2 Instances:")
+    if findings.stopped_instances:
+        for instance in findings.stopped_instances:
+            print(f"  - Instance ID: {instance.instance_id}, Type: {instance.instance_type}, Created By: {instance.created_by}")
+    else:
+        print("  - No stopped EC2 instances found.")
+
+    print("\n[4] Unused Security Groups:")
+    if findings.unused_security_groups:
+        for sg in findings.unused_security_groups:
+            print(f"  - Security Group ID: {sg.group_id}, Name: {sg.group_name}, Created By: {sg.created_by}")
+    else:
+        print("  - No unused security groups found.")
+
+    print("\n[5] IAM Roles with No Attached Policies:")
+    for role_name, error in findings.role_errors:
+        print(f"  - Skipping role {role_name} due to error: {error}")
+    if findings.roles_without_policies:
+        for role in findings.roles_without_policies:
+            print(f"  - Role Name: {role.role_name}, Created By: {role.created_by}")
+    else:
+        print("  - All roles have attached or inline policies.")
+
+    print("\n[6] Idle Lambda Functions (No Invocations in 30+ Days):")
+    for function_name, error in findings.function_errors:
+        print(f"  - Could not fetch metrics for {function_name}: {error}")
+    if findings.idle_functions:
+        for function in findings.idle_functions:
+            print(f"  - Function Name: {function.function_name}, Created By: {function.created_by}")
+    else:
+        print("  - All functions have been invoked within the last 30 days.")
+
+def build_workbook(findings, region):
+    """Rendering phase: build the Excel workbook with separate sheets for each resource"""
+    # write-only mode streams rows out instead of keeping a cell object per value
+    wb = Workbook(write_only=True)
 
-    # build Excel workbook with separate sheets for each resource
-    wb = Workbook()
-    # remove default sheet
-    wb.remove(wb.active)
-    
     # Idle EBS Volumes sheet
     ws = wb.create_sheet('IdleEBS')
     ws.append(['VolumeId','Status','SizeGiB','Region','CreationDate','CreatedBy'])
-    for vol in volumes:
+    for vol in findings.idle_volumes:
         ws.append([
-            vol['VolumeId'],
-            vol.get('State','available'),
-            vol.get('Size'),
-            os.environ.get('REGION',''),
-            vol.get('CreateTime').isoformat() if vol.get('CreateTime') else '',
-            vol.get('CreatedBy', 'Unknown')
+            vol.volume_id,
+            vol.state,
+            vol.size,
+            region,
+            vol.create_time.isoformat() if vol.create_time else '',
+            vol.created_by
         ])
-        
-    # Snapshot Expiry sheet
+
+    # Snapshot Expiry sheet, the snapshots with a missing, invalid or far-off ExpiryDate
     ws = wb.create_sheet('SnapshotExpiry')
-    ws.append(['SnapshotId','ExpiryTag','CreationDate','CreatedBy'])
-    for snap in snapshots:
-        expiry = next((t['Value'] for t in snap.get('Tags',[]) if t['Key']=='ExpiryDate'), '')
+    ws.append(['SnapshotId','ExpiryTag','CreationDate','CreatedBy','Linkage'])
+    for snap in findings.snapshots:
         ws.append([
-            snap['SnapshotId'], 
-            expiry,
-            snap.get('StartTime').isoformat() if snap.get('StartTime') else '',
-            snap.get('CreatedBy', 'Unknown')
+            snap.snapshot_id,
+            snap.expiry_tag or '',
+            snap.start_time.isoformat() if snap.start_time else '',
+            snap.created_by,
+            snap.linkage
         ])
-        
+
     # Stopped Instances sheet
     ws = wb.create_sheet('StoppedInstances')
     ws.append(['InstanceId','State','CreationDate','CreatedBy'])
-    for r in instances:
-        for inst in r['Instances']:
-            ws.append([
-                inst['InstanceId'], 
-                inst['State']['Name'],
-                inst.get('LaunchTime').isoformat() if inst.get('LaunchTime') else '',
-                inst.get('CreatedBy', 'Unknown')
-            ])
-            
+    for inst in findings.stopped_instances:
+        ws.append([
+            inst.instance_id,
+            inst.state,
+            inst.launch_time.isoformat() if inst.launch_time else '',
+            inst.created_by
+        ])
+
     # Security Groups sheet
     ws = wb.create_sheet('UnusedSecurityGroups')
     ws.append(['GroupId','GroupName','CreationDate','CreatedBy'])
-    for sg in unused_sgs:
+    for sg in findings.unused_security_groups:
         ws.append([
-            sg['GroupId'], 
-            sg['GroupName'], 
+            sg.group_id,
+            sg.group_name,
             '',
-            sg.get('CreatedBy', 'Unknown')
+            sg.created_by
         ])
-        
+
     # IAM Roles sheet
     ws = wb.create_sheet('IAMRolesNoPolicies')
     ws.append(['RoleName','Description','CreationDate','CreatedBy'])
-    for role in roles:
-        attached = iam.list_attached_role_policies(RoleName=role['RoleName'])['AttachedPolicies']
-        inline = iam.list_role_policies(RoleName=role['RoleName'])['PolicyNames']
-        if not attached and not inline:
-            ws.append([
-                role['RoleName'], 
-                role.get('Description',''),
-                role.get('CreateDate').isoformat() if role.get('CreateDate') else '',
-                role.get('CreatedBy', 'Unknown')
-            ])
-            
+    for role in findings.roles_without_policies:
+        ws.append([
+            role.role_name,
+            role.description,
+            role.create_date.isoformat() if role.create_date else '',
+            role.created_by
+        ])
+
     # Idle Lambdas sheet
     ws = wb.create_sheet('IdleLambdas')
     ws.append(['FunctionName','CreationDate','CreatedBy'])
-    for function in functions:
-        # Recheck invocation metrics
-        metrics = cloudwatch.get_metric_statistics(
-            Namespace='AWS/Lambda',
-            MetricName='Invocations',
-            Dimensions=[{'Name': 'FunctionName', 'Value': function['FunctionName']}],
-            StartTime=now - datetime.timedelta(days=30),
-            EndTime=now,
-            Period=2592000,
-            Statistics=['Sum']
-        )
-        invocation_count = sum(datapoint.get('Sum', 0) for datapoint in metrics.get('Datapoints', []))
-        
-        if invocation_count == 0:
-            ws.append([
-                function['FunctionName'],
-                function.get('LastModified',''),
-                function.get('CreatedBy', 'Unknown')
-            ])
-            
+    for function in findings.idle_functions:
+        ws.append([
+            function.function_name,
+            function.last_modified,
+            function.created_by
+        ])
+
+    return wb
+
+def build_sns_summary(findings, timestamp, report_url):
+    """Rendering phase: build the SNS summary message from the findings model"""
+    return f"""
+    AWS Resource Audit Report - {timestamp}
+    
+    Weekly report of potential cost-saving opportunities has been generated.
+    
+    Report Location: {report_url}
+    
+    Summary:
+    - Idle EBS Volumes: {len(findings.idle_volumes)}
+    - Snapshots Scanned: {findings.snapshots_scanned}
+    - Snapshots Missing Expiry Tag: {len(findings.missing_expiry_snapshots)}
+    - Stopped EC2 Instances: {len(findings.stopped_instances)}
+    - Unused Security Groups: {len(findings.unused_security_groups)}
+    - IAM Roles without Policies: {len(findings.roles_without_policies)}
+    - Idle Lambda Functions: {len(findings.idle_functions)}
+    """
+
+def lambda_handler(event, context):
+    buffer = io.StringIO()
+    with redirect_stdout(buffer):
+        clients = {service: boto3.client(service) for service in ('ec2', 'iam', 'lambda', 'cloudwatch', 'cloudtrail')}
+        # Instances, volumes, ENIs and security groups come from AWS Config when it records them
+        clients['inventory'] = get_inventory(clients['ec2'], boto3.client('config'))
+        print(f"Using the {clients['inventory'].name} inventory backend")
+        sns = boto3.client('sns')
+        s3 = boto3.client('s3')
+
+        now = datetime.datetime.now(datetime.timezone.utc)
+
+        # Resolve creators from the persisted CloudTrail index instead of one lookup per resource
+        def creator_section(clients, now):
+            return build_creator_index(clients['cloudtrail'], s3, os.environ['OUTPUT_BUCKET'], now)
+
+        # Collect once, then render the log, workbook and SNS summary from the same findings
+        findings = collect_findings(clients, now, creator_section)
+        print_findings(findings)
+
+    for name, elapsed in findings.section_timings.items():
+        print(f"Section {name} took {elapsed:.2f}s")
+
+    wb = build_workbook(findings, os.environ.get('REGION', ''))
+
     # save and upload
     output = io.BytesIO()
     wb.save(output)
     output.seek(0)
-    s3 = boto3.client('s3')
     timestamp = datetime.datetime.now().strftime('%Y%m%d%H%M%S')
     key = f"report/{timestamp}.xlsx"
     s3.put_object(
@@ -370,21 +899,7 @@ def lambda_handler(event, context):
     
     # Send SNS notification
     report_url = f"https://s3.console.aws.amazon.com/s3/object/{os.environ['OUTPUT_BUCKET']}/{key}"
-    sns_message = f"""
-    AWS Resource Audit Report - {timestamp}
-    
-    Weekly report of potential cost-saving opportunities has been generated.
-    
-    Report Location: {report_url}
-    
-    Summary:
-    - Idle EBS Volumes: {len(volumes)}
-    - Snapshots Missing Expiry Tag: {len([s for s in snapshots if not next((t['Value'] for t in s.get('Tags', []) if t['Key'] == 'ExpiryDate'), None)])}
-    - Stopped EC2 Instances: {sum(len(r['Instances']) for r in instances)}
-    - Unused Security Groups: {len(unused_sgs)}
-    - IAM Roles without Policies: {len([r for r in roles if not iam.list_attached_role_policies(RoleName=r['RoleName'])['AttachedPolicies'] and not iam.list_role_policies(RoleName=r['RoleName'])['PolicyNames']])}
-    - Idle Lambda Functions: {len([f for f in functions if not any(d.get('Sum', 0) > 0 for d in cloudwatch.get_metric_statistics(Namespace='AWS/Lambda', MetricName='Invocations', Dimensions=[{'Name': 'FunctionName', 'Value': f['FunctionName']}], StartTime=now - datetime.timedelta(days=30), EndTime=now, Period=2592000, Statistics=['Sum']).get('Datapoints', []))])}
-    """
+    sns_message = build_sns_summary(findings, timestamp, report_url)
     
     sns.publish(
         TopicArn=os.environ['SNS_TOPIC_ARN'],
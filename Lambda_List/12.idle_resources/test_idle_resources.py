@@ -0,0 +1,269 @@
+import datetime
+import importlib.util
+import io
+import json
+import os
+from collections import Counter
+
+import boto3
+import pytest
+from botocore.stub import ANY, Stubber
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def load_lambda():
+    """Helper function to import this folder's lambda_function.py under its own module name"""
+    spec = importlib.util.spec_from_file_location('idle_resources', os.path.join(HERE, 'lambda_function.py'))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+idle = load_lambda()
+
+
+def make_client(service_name):
+    return boto3.client(
+        service_name, region_name='us-east-1',
+        aws_access_key_id='testing', aws_secret_access_key='testing'
+    )
+
+
+@pytest.fixture
+def stubbed():
+    clients = {name: make_client(name) for name in ('config', 'ec2')}
+    stubbers = {name: Stubber(client) for name, client in clients.items()}
+    for stubber in stubbers.values():
+        stubber.activate()
+    yield clients, stubbers
+    for stubber in stubbers.values():
+        stubber.assert_no_pending_responses()
+        stubber.deactivate()
+
+
+def config_page(documents, next_token=None):
+    page = {'Results': [json.dumps({'configuration': document, 'tags': []}) for document in documents]}
+    if next_token:
+        page['NextToken'] = next_token
+    return page
+
+
+def test_config_inventory_filters_volume_state_and_follows_next_token(stubbed):
+    clients, stubbers = stubbed
+    expression = (
+        "SELECT resourceId, configuration, tags WHERE resourceType = 'AWS::EC2::Volume'"
+        " AND configuration.state IN ('available')"
+    )
+    stubbers['config'].add_response(
+        'select_resource_config',
+        config_page([{'volumeId': 'vol-1', 'size': 8, 'state': 'available', 'createTime': '2024-01-01T00:00:00.123Z'}], 'token-1'),
+        {'Expression': expression, 'Limit': idle.CONFIG_QUERY_PAGE_SIZE},
+    )
+    stubbers['config'].add_response(
+        'select_resource_config',
+        config_page([{'volumeId': 'vol-2', 'size': 20, 'state': 'available', 'kmsKeyId': None}]),
+        {'Expression': expression, 'Limit': idle.CONFIG_QUERY_PAGE_SIZE, 'NextToken': 'token-1'},
+    )
+    inventory = idle.ConfigInventory(clients['ec2'], clients['config'], set(idle.CONFIG_RESOURCE_TYPES.values()))
+
+    findings = list(idle.iter_idle_volumes(inventory))
+
+    assert [(f.volume_id, f.size) for f in findings] == [('vol-1', 8), ('vol-2', 20)]
+    assert findings[0].create_time.year == 2024
+
+
+def test_config_network_interfaces_with_null_fields(stubbed):
+    clients, stubbers = stubbed
+    stubbers['config'].add_response('select_resource_config', config_page([
+        {'networkInterfaceId': 'eni-1', 'groups': [{'groupId': 'sg-1', 'groupName': 'web'}],
+         'association': None, 'attachment': None, 'requesterId': None},
+    ]), {'Expression': ANY, 'Limit': ANY})
+    inventory = idle.ConfigInventory(clients['ec2'], clients['config'], set(idle.CONFIG_RESOURCE_TYPES.values()))
+
+    enis = list(inventory.network_interfaces())
+
+    assert enis == [{'NetworkInterfaceId': 'eni-1', 'Groups': [{'GroupId': 'sg-1', 'GroupName': 'web'}], 'Tags': []}]
+
+
+def test_config_query_error_falls_back_to_describe(stubbed):
+    clients, stubbers = stubbed
+    stubbers['config'].add_client_error('select_resource_config', service_error_code='ValidationException')
+    stubbers['ec2'].add_response('describe_security_groups', {'SecurityGroups': [
+        {'GroupId': 'sg-1', 'GroupName': 'default'},
+        {'GroupId': 'sg-2', 'GroupName': 'web'},
+    ]}, {})
+    inventory = idle.ConfigInventory(clients['ec2'], clients['config'], set(idle.CONFIG_RESOURCE_TYPES.values()))
+
+    findings = list(idle.iter_security_groups(inventory))
+
+    assert [f.group_id for f in findings] == ['sg-2']
+
+
+def test_unrecorded_type_uses_describe_without_querying_config(stubbed):
+    clients, stubbers = stubbed
+    stubbers['ec2'].add_response('describe_instances', {'Reservations': [{'Instances': [
+        {'InstanceId': 'i-1', 'InstanceType': 't3.micro', 'State': {'Name': 'stopped'}},
+    ]}]}, {'Filters': [{'Name': 'instance-state-name', 'Values': ['stopped']}]})
+    inventory = idle.ConfigInventory(clients['ec2'], clients['config'], {'AWS::EC2::Volume'})
+
+    findings = list(idle.iter_instances(inventory, ['stopped']))
+
+    assert [f.instance_id for f in findings] == ['i-1']
+
+
+def test_auto_backend_without_recording_uses_describe(stubbed, monkeypatch):
+    clients, stubbers = stubbed
+    monkeypatch.setenv('INVENTORY_BACKEND', 'auto')
+    monkeypatch.delenv('CONFIG_AGGREGATOR_NAME', raising=False)
+    stubbers['config'].add_response('describe_configuration_recorder_status', {'ConfigurationRecordersStatus': [
+        {'name': 'default', 'recording': False},
+    ]})
+
+    inventory = idle.get_inventory(clients['ec2'], clients['config'])
+
+    assert inventory.name == 'describe'
+
+
+def test_aggregator_queries_are_scoped_to_this_account_and_region(stubbed):
+    clients, stubbers = stubbed
+    stubbers['config'].add_response('select_aggregate_resource_config', config_page([
+        {'instanceId': 'i-1', 'instanceType': 't3.micro', 'state': {'name': 'stopped'}},
+    ]), {
+        'ConfigurationAggregatorName': 'org',
+        'Expression': (
+            "SELECT resourceId, configuration, tags WHERE resourceType = 'AWS::EC2::Instance'"
+            " AND accountId = '111122223333' AND awsRegion = 'us-east-1'"
+            " AND configuration.state.name IN ('stopped')"
+        ),
+        'Limit': idle.CONFIG_QUERY_PAGE_SIZE,
+    })
+    inventory = idle.ConfigInventory(
+        clients['ec2'], clients['config'], set(idle.CONFIG_RESOURCE_TYPES.values()), 'org', '111122223333'
+    )
+
+    findings = list(idle.iter_instances(inventory, ['stopped']))
+
+    assert [f.instance_id for f in findings] == ['i-1']
+
+
+def test_snapshot_section_keeps_only_flagged_snapshots(stubbed):
+    clients, stubbers = stubbed
+    clients['inventory'] = idle.DescribeInventory(clients['ec2'])
+    stubbers['ec2'].add_response('describe_volumes', {'Volumes': []})
+    stubbers['ec2'].add_response('describe_instances', {'Reservations': []})
+    stubbers['ec2'].add_response('describe_images', {'Images': []})
+    soon = (datetime.date.today() + datetime.timedelta(days=30)).isoformat()
+    late = (datetime.date.today() + datetime.timedelta(days=365)).isoformat()
+    pages, page_size = 20, 1000
+    for page in range(pages):
+        snapshots = []
+        for index in range(page * page_size, (page + 1) * page_size):
+            # One in a hundred lacks the tag, one in a thousand expires too late, the rest are fine
+            tags = [] if index % 100 == 0 else [{'Key': 'ExpiryDate', 'Value': late if index % 1000 == 1 else soon}]
+            snapshots.append({'SnapshotId': f'snap-{index:017x}', 'VolumeId': 'vol-gone', 'VolumeSize': 8, 'Tags': tags})
+        response = {'Snapshots': snapshots}
+        if page < pages - 1:
+            response['NextToken'] = f'page-{page + 1}'
+        expected = {'OwnerIds': ['self'], 'NextToken': f'page-{page}'} if page else {'OwnerIds': ['self']}
+        stubbers['ec2'].add_response('describe_snapshots', response, expected)
+
+    findings = idle.collect_snapshot_section(clients, datetime.datetime.now(datetime.timezone.utc))
+
+    assert findings.snapshots_scanned == pages * page_size
+    assert len(findings.missing_expiry_snapshots) == len(findings.orphaned_snapshots) == pages * page_size // 100
+    assert len(findings.long_expiry_snapshots) == pages
+    # The sheet reads only the flagged snapshots, the healthy ones are not held
+    assert len(findings.snapshots) == pages * page_size // 100 + pages
+    assert all(snapshot.expiry_tag in (None, late) for snapshot in findings.snapshots)
+
+
+def count_calls(client, calls):
+    """Helper function to count the operations and parameters a client sends"""
+    def record(params, model, **kwargs):
+        calls[model.name] += 1
+        calls[(model.name, json.dumps(params, sort_keys=True, default=str))] += 1
+    client.meta.events.register('before-parameter-build', record)
+
+
+def test_each_role_and_function_is_queried_once(monkeypatch, capsys):
+    clients = {name: make_client(name) for name in ('iam', 'lambda', 'cloudwatch')}
+    calls = Counter()
+    stubbers = {}
+    for name, client in clients.items():
+        count_calls(client, calls)
+        stubbers[name] = Stubber(client)
+        stubbers[name].activate()
+    roles = ['bare-role', 'managed-role', 'inline-role']
+    now = datetime.datetime(2024, 6, 1, tzinfo=datetime.timezone.utc)
+    stubbers['iam'].add_response('list_roles', {'Roles': [
+        {'RoleName': name, 'Path': '/', 'RoleId': 'AROAEXAMPLE00000000' + str(i), 'Arn': f'arn:aws:iam::111122223333:role/{name}', 'CreateDate': now}
+        for i, name in enumerate(roles)
+    ]})
+    for name in roles:
+        attached = [{'PolicyName': 'ReadOnly', 'PolicyArn': 'arn:aws:iam::aws:policy/ReadOnlyAccess'}] if name == 'managed-role' else []
+        stubbers['iam'].add_response('list_attached_role_policies', {'AttachedPolicies': attached}, {'RoleName': name})
+        stubbers['iam'].add_response('list_role_policies', {'PolicyNames': ['inline'] if name == 'inline-role' else []}, {'RoleName': name})
+    functions = ['busy', 'idle']
+    stubbers['lambda'].add_response('list_functions', {'Functions': [
+        {'FunctionName': name, 'LastModified': '2024-01-01T00:00:00.000+0000'} for name in functions
+    ]})
+    stubbers['cloudwatch'].add_response('get_metric_data', {'MetricDataResults': [
+        {'Id': 'm0', 'Values': [3.0]}, {'Id': 'm1', 'Values': []},
+    ]})
+    # Only the IAM and Lambda sections, the rest are covered by their own collectors
+    monkeypatch.setattr(idle, 'AUDIT_SECTIONS', [s for s in idle.AUDIT_SECTIONS if s[0] in ('IAMRoles', 'IdleLambdas')])
+
+    findings = idle.collect_findings(clients, now, lambda clients, now: {'bare-role': 'alice'})
+    # Rendering every output reuses the findings without calling AWS again
+    idle.print_findings(findings)
+    idle.build_workbook(findings, 'us-east-1').save(io.BytesIO())
+    summary = idle.build_sns_summary(findings, '20240601', 's3://bucket/report.xlsx')
+
+    for stubber in stubbers.values():
+        stubber.assert_no_pending_responses()
+    assert calls['ListRoles'] == 1 and calls['ListFunctions'] == 1 and calls['GetMetricData'] == 1
+    for name in roles:
+        assert calls[('ListAttachedRolePolicies', json.dumps({'RoleName': name}))] == 1
+        assert calls[('ListRolePolicies', json.dumps({'RoleName': name}))] == 1
+    assert calls['ListAttachedRolePolicies'] == calls['ListRolePolicies'] == len(roles)
+    assert [(r.role_name, r.created_by) for r in findings.roles_without_policies] == [('bare-role', 'alice')]
+    assert [f.function_name for f in findings.idle_functions] == ['idle']
+    assert 'bare-role' in capsys.readouterr().out
+    assert summary
+
+
+def test_creator_index_drops_entries_past_the_retention():
+    s3, cloudtrail = make_client('s3'), make_client('cloudtrail')
+    now = datetime.datetime(2024, 6, 1, tzinfo=datetime.timezone.utc)
+    watermark = now - datetime.timedelta(days=1)
+    saved = {'watermark': watermark.isoformat(), 'creators': {
+        'vol-recent': ['alice', (now - datetime.timedelta(days=10)).isoformat()],
+        'vol-expired': ['bob', (now - datetime.timedelta(days=idle.CREATOR_INDEX_RETENTION_DAYS + 1)).isoformat()],
+        # Saved by an earlier version without an event time
+        'vol-legacy': 'carol',
+    }}
+    with Stubber(s3) as s3_stubber, Stubber(cloudtrail) as cloudtrail_stubber:
+        s3_stubber.add_response('get_object', {'Body': io.BytesIO(json.dumps(saved).encode())}, {'Bucket': 'out', 'Key': 'index.json'})
+        for event_name in idle.CREATOR_EVENTS:
+            events = [{
+                'EventTime': now - datetime.timedelta(hours=2),
+                'Resources': [{'ResourceType': 'AWS::EC2::Volume', 'ResourceName': 'vol-new'}],
+                'CloudTrailEvent': json.dumps({'userIdentity': {'userName': 'dave'}}),
+            }] if event_name == 'CreateVolume' else []
+            cloudtrail_stubber.add_response('lookup_events', {'Events': events}, {
+                'LookupAttributes': [{'AttributeKey': 'EventName', 'AttributeValue': event_name}],
+                'StartTime': watermark - datetime.timedelta(hours=1),
+                'EndTime': now,
+            })
+        s3_stubber.add_response('put_object', {}, {'Bucket': 'out', 'Key': 'index.json', 'Body': ANY, 'ContentType': 'application/json'})
+        put_bodies = []
+        s3.meta.events.register('before-parameter-build.s3.PutObject', lambda params, **kwargs: put_bodies.append(params['Body']))
+
+        creators = idle.build_creator_index(cloudtrail, s3, 'out', now, key='index.json')
+
+    assert creators == {'vol-recent': 'alice', 'vol-new': 'dave'}
+    assert json.loads(put_bodies[0]) == {'watermark': now.isoformat(), 'creators': {
+        'vol-recent': saved['creators']['vol-recent'],
+        'vol-new': ['dave', (now - datetime.timedelta(hours=2)).isoformat()],
+    }}
@@ -1,6 +1,97 @@
 import boto3
 import datetime
+import json
 import os
+from concurrent.futures import ThreadPoolExecutor
+from botocore.config import Config
+from botocore.exceptions import ClientError
+
+# Status check values other than 'ok' that mark an instance as having issues
+# ('not-applicable' is what stopped instances report with IncludeAllInstances)
+NOT_OK_STATUSES = ['impaired', 'initializing', 'insufficient-data', 'not-applicable']
+
+# Maximum number of regions scanned at the same time
+MAX_REGION_WORKERS = int(os.environ.get('MAX_REGION_WORKERS', '20'))
+
+# Maximum number of values in a single describe_instances filter
+FILTER_BATCH_SIZE = 200
+
+# S3 bucket holding the alert state and the full reports
+# Without it every run reports all instances with issues as new and no report is written
+ALERT_STATE_BUCKET = os.environ.get('ALERT_STATE_BUCKET', '')
+ALERT_STATE_KEY = os.environ.get('ALERT_STATE_KEY', 'alert-state/state.json')
+REPORT_PREFIX = os.environ.get('REPORT_PREFIX', 'reports')
+# How long the report link in a notification stays valid, the link also stops working when the function's credentials expire
+REPORT_LINK_EXPIRY_SECONDS = int(os.environ.get('REPORT_LINK_EXPIRY_SECONDS', '604800'))
+# Report links are signed with SigV4, which every region accepts and which allows up to 7 days
+S3_CONFIG = Config(signature_version='s3v4')
+
+# Fields compared with the previous run to decide if a reported instance changed
+ALERT_FIELDS = ['State', 'SystemStatus', 'InstanceStatus']
+
+# SNS rejects messages over 256 KB, leave room for the subject and attributes
+MAX_MESSAGE_BYTES = 240 * 1024
+
+# Get instances whose system or instance status check is not 'ok'
+# Filters are ANDed within a request, so each status check is queried separately and the results merged
+def get_impaired_statuses(ec2):
+    statuses = {}
+    paginator = ec2.get_paginator('describe_instance_status')
+    for filter_name in ['system-status.status', 'instance-status.status']:
+        for page in paginator.paginate(
+            IncludeAllInstances=True,
+            Filters=[{'Name': filter_name, 'Values': NOT_OK_STATUSES}]
+        ):
+            for status in page['InstanceStatuses']:
+                statuses[status['InstanceId']] = status
+    return statuses
+
+# Get the name, type and state of the given instances only
+def get_instance_details(ec2, instance_ids):
+    instance_names = {}
+    paginator = ec2.get_paginator('describe_instances')
+    for i in range(0, len(instance_ids), FILTER_BATCH_SIZE):
+        batch = instance_ids[i:i + FILTER_BATCH_SIZE]
+        for page in paginator.paginate(Filters=[{'Name': 'instance-id', 'Values': batch}]):
+            for reservation in page['Reservations']:
+                for instance in reservation['Instances']:
+                    # Get instance name from tags
+                    instance_name = 'No Name'
+                    for tag in instance.get('Tags', []):
+                        if tag['Key'] == 'Name':
+                            instance_name = tag['Value']
+                    
+                    instance_names[instance['InstanceId']] = {
+                        'Name': instance_name,
+                        'Type': instance['InstanceType'],
+                        'State': instance['State']['Name']
+                    }
+    return instance_names
+
+def check_region(region):
+    print(f"Checking region: {region}")
+    
+    # Clients are created from a session per thread, the default session is not thread-safe
+    ec2 = boto3.session.Session().client('ec2', region_name=region)
+    
+    statuses = get_impaired_statuses(ec2)
+    instance_names = get_instance_details(ec2, list(statuses))
+    
+    instances_with_issues = []
+    for instance_id, status in statuses.items():
+        instance_info = instance_names.get(instance_id, {'Name': 'Unknown', 'Type': 'Unknown', 'State': 'Unknown'})
+        instances_with_issues.append({
+            'InstanceId': instance_id,
+            'Name': instance_info['Name'],
+            'Type': instance_info['Type'],
+            'State': instance_info['State'],
+            'SystemStatus': status['SystemStatus']['Status'],
+            'InstanceStatus': status['InstanceStatus']['Status'],
+            'Region': region
+        })
+    
+    print(f"Region {region}: {len(instances_with_issues)} instance(s) with issues")
+    return instances_with_issues
 
 def lambda_handler(event, context):
     # Get regions or use specific regions from environment variables
@@ -8,107 +99,202 @@ def lambda_handler(event, context):
     if not regions or regions[0] == '':
         ec2_client = boto3.client('ec2')
         regions = [region['RegionName'] for region in ec2_client.describe_regions()['Regions']]
+    regions = [region.strip() for region in regions]
     
     # Store instances with issues
     instances_with_issues = []
-    total_instances = 0
+    failed_regions = []
     
-    for region in regions:
-        print(f"Checking region: {region}")
-        
-        # Create EC2 client for this region
-        ec2 = boto3.client('ec2', region_name=region)
-        
-        # Get all EC2 instances with status
-        instance_statuses = ec2.describe_instance_status(IncludeAllInstances=True)
-        
-        # Get instance details
-        instances_response = ec2.describe_instances()
-        
-        # Create a mapping of instance IDs to names
-        instance_names = {}
-        for reservation in instances_response['Reservations']:
-            for instance in reservation['Instances']:
-                instance_id = instance['InstanceId']
-                instance_type = instance['InstanceType']
-                instance_state = instance['State']['Name']
-                
-                # Get instance name from tags
-                instance_name = 'No Name'
-                if 'Tags' in instance:
-                    for tag in instance['Tags']:
-                        if tag['Key'] == 'Name':
-                            instance_name = tag['Value']
-                
-                instance_names[instance_id] = {
-                    'Name': instance_name,
-                    'Type': instance_type,
-                    'State': instance_state
-                }
+    # Scan all regions concurrently, a failing region is reported without stopping the others
+    with ThreadPoolExecutor(max_workers=max(1, min(len(regions), MAX_REGION_WORKERS))) as executor:
+        futures = {region: executor.submit(check_region, region) for region in regions}
+        for region, future in futures.items():
+            try:
+                instances_with_issues.extend(future.result())
+            except Exception as e:
+                print(f"Error checking region {region}: {e}")
+                failed_regions.append(region)
+    
+    # Only notify about instances that are new, changed or recovered since the last run
+    s3 = boto3.client('s3', config=S3_CONFIG)
+    state = load_alert_state(s3)
+    new_instances, changed_instances, recovered_instances, current = diff_alert_state(
+        state['instances'], instances_with_issues, regions, failed_regions
+    )
+    
+    if new_instances or changed_instances or recovered_instances or sorted(failed_regions) != sorted(state['failedRegions']):
+        checked_at = datetime.datetime.utcnow().strftime('%Y-%m-%dT%H-%M-%SZ')
+        report_location = write_report(s3, {
+            'checkedAt': checked_at,
+            'regionsChecked': regions,
+            'failedRegions': failed_regions,
+            'newInstances': new_instances,
+            'changedInstances': changed_instances,
+            'recoveredInstances': recovered_instances,
+            'instancesWithIssues': list(current.values())
+        })
+        send_notification(new_instances, changed_instances, recovered_instances, len(current), len(regions), failed_regions, report_location)
         
-        # Process instance statuses
-        for status in instance_statuses['InstanceStatuses']:
-            instance_id = status['InstanceId']
-            system_status = status['SystemStatus']['Status']
-            instance_status = status['InstanceStatus']['Status']
-            
-            total_instances += 1
-            
-            # Check for issues
-            if system_status != 'ok' or instance_status != 'ok':
-                instance_info = instance_names.get(instance_id, {'Name': 'Unknown', 'Type': 'Unknown', 'State': 'Unknown'})
-                instances_with_issues.append({
-                    'InstanceId': instance_id,
-                    'Name': instance_info['Name'],
-                    'Type': instance_info['Type'],
-                    'State': instance_info['State'],
-                    'SystemStatus': system_status,
-                    'InstanceStatus': instance_status,
-                    'Region': region
-                })
-    
-    # If there are instances with issues, send notification
-    if instances_with_issues:
-        send_notification(instances_with_issues, total_instances)
+        # Saved after publishing, so a failed publish is retried on the next run
+        save_alert_state(s3, {'instances': current, 'failedRegions': failed_regions})
+    else:
+        print("No changes since the last run, notification skipped")
         
-    print(f"EC2 status check completed. Total instances: {total_instances}, Issues: {len(instances_with_issues)}")
+    print(f"EC2 status check completed. Regions checked: {len(regions)}, Issues: {len(instances_with_issues)}, Failed regions: {failed_regions}")
     return {
-        'instancesChecked': total_instances,
-        'instancesWithIssues': len(instances_with_issues)
+        'regionsChecked': len(regions),
+        # Healthy instances are no longer listed, so this replaces the former instancesChecked total
+        'instancesFlagged': len(instances_with_issues),
+        'instancesWithIssues': len(current),
+        'newInstances': len(new_instances),
+        'changedInstances': len(changed_instances),
+        'recoveredInstances': len(recovered_instances),
+        'failedRegions': failed_regions
     }
 
-def send_notification(instances_with_issues, total_instances):
+# Load the instances reported by the previous run, keyed by instance ID
+def load_alert_state(s3):
+    state = {'instances': {}, 'failedRegions': []}
+    if not ALERT_STATE_BUCKET:
+        return state
+    try:
+        response = s3.get_object(Bucket=ALERT_STATE_BUCKET, Key=ALERT_STATE_KEY)
+    except ClientError as e:
+        if e.response['Error']['Code'] in ('NoSuchKey', '404'):
+            print("No previous alert state found, every instance with issues is new")
+            return state
+        raise
+    state.update(json.loads(response['Body'].read()))
+    return state
+
+def save_alert_state(s3, state):
+    if not ALERT_STATE_BUCKET:
+        return
+    s3.put_object(
+        Bucket=ALERT_STATE_BUCKET,
+        Key=ALERT_STATE_KEY,
+        Body=json.dumps(state).encode('utf-8'),
+        ContentType='application/json'
+    )
+
+# Compare this run with the previous one
+# Instances in regions that could not be checked keep their last known state instead of being reported as recovered
+def diff_alert_state(previous, instances_with_issues, regions, failed_regions):
+    current = {instance['InstanceId']: instance for instance in instances_with_issues}
+    new_instances, changed_instances, recovered_instances = [], [], []
+    
+    for instance_id, instance in current.items():
+        before = previous.get(instance_id)
+        if before is None:
+            new_instances.append(instance)
+        elif any(before[field] != instance[field] for field in ALERT_FIELDS):
+            changed_instances.append(dict(instance, Previous={field: before[field] for field in ALERT_FIELDS}))
+    
+    for instance_id, before in previous.items():
+        if instance_id in current:
+            continue
+        if before['Region'] in failed_regions:
+            current[instance_id] = before
+        elif before['Region'] in regions:
+            recovered_instances.append(before)
+    
+    return new_instances, changed_instances, recovered_instances, current
+
+# Write the full list of instances with issues to S3 and return a presigned link to it
+def write_report(s3, report):
+    if not ALERT_STATE_BUCKET:
+        return None
+    key = f"{REPORT_PREFIX}/{report['checkedAt']}.json"
+    s3.put_object(
+        Bucket=ALERT_STATE_BUCKET,
+        Key=key,
+        Body=json.dumps(report, indent=2).encode('utf-8'),
+        ContentType='application/json'
+    )
+    # A link opens in a browser or mail client, an s3:// location does not
+    return s3.generate_presigned_url(
+        'get_object',
+        Params={'Bucket': ALERT_STATE_BUCKET, 'Key': key},
+        ExpiresIn=REPORT_LINK_EXPIRY_SECONDS
+    )
+
+def format_instance(instance):
+    lines = [
+        f"\nInstance ID: {instance['InstanceId']}",
+        f"Name: {instance['Name']}",
+        f"Type: {instance['Type']}",
+        f"State: {instance['State']}",
+        f"System Status: {instance['SystemStatus']}",
+        f"Instance Status: {instance['InstanceStatus']}",
+        f"Region: {instance['Region']}"
+    ]
+    if 'Previous' in instance:
+        previous = instance['Previous']
+        lines.append(f"Previously: State {previous['State']}, System Status {previous['SystemStatus']}, Instance Status {previous['InstanceStatus']}")
+    
+    # Determine health check ratio (3-part check)
+    health_checks_passing = 0
+    if instance['SystemStatus'] == 'ok':
+        health_checks_passing += 1
+    if instance['InstanceStatus'] == 'ok':
+        health_checks_passing += 1
+    if instance['State'] == 'running':
+        health_checks_passing += 1
+    
+    lines.append(f"Health Check Ratio: {health_checks_passing}/3")
+    return '\n'.join(lines) + '\n'
+
+# Split the message blocks into messages of at most MAX_MESSAGE_BYTES, each starting with the header
+def build_messages(header, blocks):
+    header_size = len(header.encode('utf-8'))
+    messages = []
+    parts, size = [header], header_size
+    for block in blocks:
+        block_size = len(block.encode('utf-8'))
+        if size + block_size > MAX_MESSAGE_BYTES and len(parts) > 1:
+            messages.append(''.join(parts))
+            parts, size = [header], header_size
+        parts.append(block)
+        size += block_size
+    messages.append(''.join(parts))
+    return messages
+
+def send_notification(new_instances, changed_instances, recovered_instances, total_with_issues, regions_checked, failed_regions, report_location):
     sns = boto3.client('sns')
     topic_arn = os.environ['SNS_TOPIC_ARN']
     
     # Format message
-    message = f"EC2 Status Check Alert - {len(instances_with_issues)} instance(s) with issues detected\n\n"
-    message += f"Total instances checked: {total_instances}\n\n"
-    message += "Instances with issues:\n"
-    
-    for instance in instances_with_issues:
-        message += f"\nInstance ID: {instance['InstanceId']}\n"
-        message += f"Name: {instance['Name']}\n"
-        message += f"Type: {instance['Type']}\n"
-        message += f"State: {instance['State']}\n"
-        message += f"System Status: {instance['SystemStatus']}\n"
-        message += f"Instance Status: {instance['InstanceStatus']}\n"
-        message += f"Region: {instance['Region']}\n"
-        
-        # Determine health check ratio (3-part check)
-        health_checks_passing = 0
-        if instance['SystemStatus'] == 'ok':
-            health_checks_passing += 1
-        if instance['InstanceStatus'] == 'ok':
-            health_checks_passing += 1
-        if instance['State'] == 'running':
-            health_checks_passing += 1
-            
-        message += f"Health Check Ratio: {health_checks_passing}/3\n"
-    
-    # Send SNS notification
-    sns.publish(
-        TopicArn=topic_arn,
-        Subject="EC2 Instance Status Check Alert",
-        Message=message
-    )
+    header = [
+        f"EC2 Status Check Alert - {len(new_instances)} new, {len(changed_instances)} changed, {len(recovered_instances)} recovered\n\n",
+        f"Instances with issues: {total_with_issues}\n",
+        f"Regions checked: {regions_checked}\n"
+    ]
+    if failed_regions:
+        header.append(f"Regions that could not be checked: {', '.join(failed_regions)}\n")
+    if report_location:
+        header.append(f"Full list: {report_location}\n")
+    header = ''.join(header)
+    
+    blocks = []
+    for title, instances in [
+        ("New issues", new_instances),
+        ("Changed status", changed_instances),
+        ("Recovered", recovered_instances)
+    ]:
+        if instances:
+            blocks.append(f"\n{title} ({len(instances)}):\n")
+            blocks.extend(format_instance(instance) for instance in instances)
+    
+    messages = build_messages(header, blocks)
+    
+    # Send SNS notifications
+    for index, message in enumerate(messages, 1):
+        subject = "EC2 Instance Status Check Alert"
+        if len(messages) > 1:
+            subject += f" ({index}/{len(messages)})"
+        sns.publish(
+            TopicArn=topic_arn,
+            Subject=subject,
+            Message=message
+        )
+    print(f"Published {len(messages)} notification(s)")
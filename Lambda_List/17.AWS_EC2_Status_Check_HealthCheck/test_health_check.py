@@ -0,0 +1,157 @@
+import importlib.util
+import os
+from urllib.parse import parse_qs, urlparse
+
+import boto3
+import pytest
+from botocore.stub import ANY, Stubber
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def load_lambda():
+    """Helper function to import this folder's lambda_function.py under its own module name"""
+    spec = importlib.util.spec_from_file_location('health_check', os.path.join(HERE, 'lambda_function.py'))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+health_check = load_lambda()
+
+
+def make_client(service_name, **kwargs):
+    return boto3.client(
+        service_name, region_name='us-east-1',
+        aws_access_key_id='testing', aws_secret_access_key='testing', **kwargs
+    )
+
+
+def instance(instance_id, region='us-east-1', state='running', system='ok', status='impaired'):
+    return {
+        'InstanceId': instance_id, 'Name': instance_id, 'Type': 't3.micro', 'State': state,
+        'SystemStatus': system, 'InstanceStatus': status, 'Region': region,
+    }
+
+
+def test_write_report_links_a_presigned_get(monkeypatch):
+    monkeypatch.setattr(health_check, 'ALERT_STATE_BUCKET', 'alerts')
+    s3 = make_client('s3', config=health_check.S3_CONFIG)
+    with Stubber(s3) as stubber:
+        stubber.add_response('put_object', {}, {
+            'Bucket': 'alerts', 'Key': 'reports/2024-01-01T12-00-00Z.json', 'Body': ANY, 'ContentType': 'application/json',
+        })
+
+        link = health_check.write_report(s3, {'checkedAt': '2024-01-01T12-00-00Z', 'instancesWithIssues': []})
+
+    url = urlparse(link)
+    query = parse_qs(url.query)
+    assert url.scheme == 'https'
+    assert query['X-Amz-Algorithm'] == ['AWS4-HMAC-SHA256']
+    assert url.path.endswith('reports/2024-01-01T12-00-00Z.json')
+    assert query['X-Amz-Expires'] == [str(health_check.REPORT_LINK_EXPIRY_SECONDS)]
+
+
+def test_write_report_without_a_bucket(monkeypatch):
+    monkeypatch.setattr(health_check, 'ALERT_STATE_BUCKET', '')
+    # No S3 call is stubbed, so this must not reach S3
+    with Stubber(make_client('s3')) as stubber:
+        assert health_check.write_report(stubber.client, {'checkedAt': 'now'}) is None
+
+
+def test_diff_alert_state_reports_new_changed_and_recovered():
+    previous = {
+        'i-same': instance('i-same'),
+        'i-changed': instance('i-changed', state='stopped', status='not-applicable'),
+        'i-recovered': instance('i-recovered'),
+    }
+    checked = [instance('i-same'), instance('i-changed'), instance('i-new')]
+
+    new, changed, recovered, current = health_check.diff_alert_state(previous, checked, ['us-east-1'], [])
+
+    assert [i['InstanceId'] for i in new] == ['i-new']
+    assert [i['InstanceId'] for i in changed] == ['i-changed']
+    assert changed[0]['Previous'] == {'State': 'stopped', 'SystemStatus': 'ok', 'InstanceStatus': 'not-applicable'}
+    assert [i['InstanceId'] for i in recovered] == ['i-recovered']
+    assert set(current) == {'i-same', 'i-changed', 'i-new'}
+
+
+def test_diff_alert_state_keeps_failed_regions():
+    previous = {
+        'i-east': instance('i-east'),
+        'i-west': instance('i-west', region='us-west-2'),
+        'i-unchecked': instance('i-unchecked', region='eu-west-1'),
+    }
+
+    new, changed, recovered, current = health_check.diff_alert_state(previous, [], ['us-east-1', 'us-west-2'], ['us-west-2'])
+
+    # A region that could not be checked is not reported as recovered, and its instances stay in the state
+    assert new == changed == []
+    assert [i['InstanceId'] for i in recovered] == ['i-east']
+    assert current == {'i-west': previous['i-west']}
+
+
+def test_build_messages_stays_under_the_limit(monkeypatch):
+    monkeypatch.setattr(health_check, 'MAX_MESSAGE_BYTES', 1000)
+    header = 'H' * 100
+    blocks = ['b' * 300 for _ in range(7)]
+
+    messages = health_check.build_messages(header, blocks)
+
+    # Three blocks fit after the header, every message repeats the header and no block is lost
+    assert [len(message) for message in messages] == [1000, 1000, 400]
+    assert all(message.startswith(header) for message in messages)
+    assert sum(message.count('b' * 300) for message in messages) == 7
+
+
+def test_build_messages_at_the_sns_limit():
+    header = 'EC2 Status Check Alert - 2000 new, 0 changed, 0 recovered\n\n'
+    blocks = [health_check.format_instance(instance(f'i-{index:017x}')) for index in range(2000)]
+
+    messages = health_check.build_messages(header, blocks)
+
+    assert len(messages) > 1
+    assert all(len(message.encode('utf-8')) <= 240 * 1024 for message in messages)
+    assert ''.join(message[len(header):] for message in messages) == ''.join(blocks)
+
+
+def test_build_messages_keeps_an_oversized_block():
+    header = 'header\n'
+    block = 'x' * (health_check.MAX_MESSAGE_BYTES + 1)
+
+    # A block is never split, even one larger than the limit
+    assert health_check.build_messages(header, [block]) == [header + block]
+
+
+
+@pytest.fixture
+def ec2():
+    client = make_client('ec2')
+    with Stubber(client) as stubber:
+        yield client, stubber
+        stubber.assert_no_pending_responses()
+
+
+def instance_status(instance_id, system, status):
+    return {'InstanceId': instance_id, 'SystemStatus': {'Status': system}, 'InstanceStatus': {'Status': status}}
+
+
+def test_get_impaired_statuses_merges_both_status_queries(ec2):
+    client, stubber = ec2
+    system_filter = [{'Name': 'system-status.status', 'Values': health_check.NOT_OK_STATUSES}]
+    instance_filter = [{'Name': 'instance-status.status', 'Values': health_check.NOT_OK_STATUSES}]
+    stubber.add_response('describe_instance_status', {
+        'InstanceStatuses': [instance_status('i-system', 'impaired', 'ok')], 'NextToken': 'page-2',
+    }, {'IncludeAllInstances': True, 'Filters': system_filter})
+    stubber.add_response('describe_instance_status', {
+        'InstanceStatuses': [instance_status('i-both', 'impaired', 'impaired')],
+    }, {'IncludeAllInstances': True, 'Filters': system_filter, 'NextToken': 'page-2'})
+    stubber.add_response('describe_instance_status', {
+        'InstanceStatuses': [instance_status('i-instance', 'ok', 'initializing'), instance_status('i-both', 'impaired', 'impaired')],
+    }, {'IncludeAllInstances': True, 'Filters': instance_filter})
+
+    statuses = health_check.get_impaired_statuses(client)
+
+    # Each query has its own filter, since filters in one request are ANDed, and an instance in both is listed once
+    assert sorted(statuses) == ['i-both', 'i-instance', 'i-system']
+    assert statuses['i-instance']['InstanceStatus']['Status'] == 'initializing'
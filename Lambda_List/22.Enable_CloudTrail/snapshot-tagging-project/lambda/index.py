@@ -3,6 +3,9 @@ import os
 import json
 from datetime import datetime, timedelta
 
+from idempotency import idempotent
+
+@idempotent
 def lambda_handler(event, context):
     print("Event received:", json.dumps(event))
 
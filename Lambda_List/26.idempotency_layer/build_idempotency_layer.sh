@@ -0,0 +1,5 @@
+#!/bin/bash
+# Build the idempotency Lambda layer, boto3 is already in the Lambda runtime
+rm -f idempotency_layer.zip
+zip -r idempotency_layer.zip python -x '*__pycache__*'
+echo "Created idempotency_layer.zip"
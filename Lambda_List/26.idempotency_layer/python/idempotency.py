@@ -0,0 +1,145 @@
+"""Shared idempotency layer for the EventBridge-triggered Lambdas.
+
+EventBridge (and SQS) deliver at least once, so the same event can reach a
+handler twice. Handlers wrapped in @idempotent claim the event id before
+running and drop a duplicate before any AWS call is made.
+
+A claim is an IN_PROGRESS record that expires with the invocation's remaining
+time, so a run killed by a timeout, OOM or crash does not hold the event. Once
+the handler succeeds the record becomes COMPLETED for IDEMPOTENCY_TTL_SECONDS.
+Only a COMPLETED or unexpired IN_PROGRESS record suppresses a delivery. Records
+are kept in a warm-container LRU and, when IDEMPOTENCY_TABLE is set, in a
+DynamoDB table with TTL enabled on expires_at so duplicates are caught across
+containers. The table is shared by every function, so its keys are prefixed
+with the function name.
+"""
+import os
+import time
+from collections import OrderedDict
+
+import boto3
+
+IDEMPOTENCY_TTL_SECONDS = int(os.environ.get('IDEMPOTENCY_TTL_SECONDS', '86400'))
+IDEMPOTENCY_CACHE_SIZE = 1024
+# Lambda's maximum timeout, used when a claim is made without an invocation context
+IDEMPOTENCY_IN_PROGRESS_SECONDS = 900
+
+IN_PROGRESS = 'IN_PROGRESS'
+COMPLETED = 'COMPLETED'
+
+
+class DynamoDBIdempotencyStore:
+    """Persistent store, one conditional put per claim and one put per completion"""
+
+    def __init__(self, table_name, client=None, key_prefix=''):
+        self.table_name = table_name
+        self.client = client or boto3.client('dynamodb')
+        self.key_prefix = key_prefix
+
+    def item_id(self, key):
+        # Two functions can receive the same event, each must be able to claim it
+        return f"{self.key_prefix}#{key}" if self.key_prefix else key
+
+    def claim(self, key, expires_at, now):
+        try:
+            self.client.put_item(
+                TableName=self.table_name,
+                Item={'id': {'S': self.item_id(key)}, 'status': {'S': IN_PROGRESS}, 'expires_at': {'N': str(int(expires_at))}},
+                # TTL deletion is lazy, so an expired item still in the table can be claimed again.
+                # That covers both a finished TTL and an IN_PROGRESS claim whose invocation died
+                ConditionExpression='attribute_not_exists(id) OR expires_at < :now',
+                ExpressionAttributeValues={':now': {'N': str(int(now))}}
+            )
+            return True
+        except self.client.exceptions.ConditionalCheckFailedException:
+            return False
+
+    def complete(self, key, expires_at):
+        self.client.put_item(
+            TableName=self.table_name,
+            Item={'id': {'S': self.item_id(key)}, 'status': {'S': COMPLETED}, 'expires_at': {'N': str(int(expires_at))}}
+        )
+
+    def release(self, key):
+        self.client.delete_item(TableName=self.table_name, Key={'id': {'S': self.item_id(key)}})
+
+
+class IdempotencyGuard:
+    """Claims and completes event ids, checking the warm-container LRU before the optional persistent store"""
+
+    def __init__(self, store=None, ttl_seconds=IDEMPOTENCY_TTL_SECONDS, cache_size=IDEMPOTENCY_CACHE_SIZE):
+        self.store = store
+        self.ttl_seconds = ttl_seconds
+        self.cache_size = cache_size
+        self.seen = OrderedDict()  # event id -> expiry, least recently used first
+
+    def claim(self, event_id, in_progress_seconds=IDEMPOTENCY_IN_PROGRESS_SECONDS):
+        """Return True if the event id is free to process, False while it is completed or in progress elsewhere
+
+        The claim lapses after in_progress_seconds unless complete() is called.
+        """
+        now = time.time()
+        if self.seen.get(event_id, 0) > now:
+            self.seen.move_to_end(event_id)
+            return False
+        expires_at = now + in_progress_seconds
+        if self.store is not None and not self.store.claim(event_id, expires_at, now):
+            # Not cached, another container may still release its claim or let it lapse
+            return False
+        self.remember(event_id, expires_at)
+        return True
+
+    def complete(self, event_id):
+        """Mark a claimed event id processed, so deliveries within the TTL are dropped"""
+        expires_at = time.time() + self.ttl_seconds
+        if self.store is not None:
+            self.store.complete(event_id, expires_at)
+        self.remember(event_id, expires_at)
+
+    def remember(self, event_id, expires_at):
+        self.seen[event_id] = expires_at
+        self.seen.move_to_end(event_id)
+        while len(self.seen) > self.cache_size:
+            self.seen.popitem(last=False)
+
+    def release(self, event_id):
+        """Give a claim back after a failed run, so the retried delivery is processed"""
+        self.seen.pop(event_id, None)
+        if self.store is not None:
+            self.store.release(event_id)
+
+
+def remaining_seconds(context):
+    """Helper function to bound an IN_PROGRESS claim by the invocation's remaining time"""
+    if context is None or not hasattr(context, 'get_remaining_time_in_millis'):
+        return IDEMPOTENCY_IN_PROGRESS_SECONDS
+    return context.get_remaining_time_in_millis() / 1000
+
+
+guard = IdempotencyGuard(
+    DynamoDBIdempotencyStore(os.environ['IDEMPOTENCY_TABLE'], key_prefix=os.environ.get('AWS_LAMBDA_FUNCTION_NAME', ''))
+    if os.environ.get('IDEMPOTENCY_TABLE') else None
+)
+
+
+def idempotent(handler):
+    """Decorator that drops duplicate deliveries of an event before the handler runs"""
+    def wrapper(event, context):
+        event_id = event.get('id') if isinstance(event, dict) else None
+        if event_id and not guard.claim(event_id, remaining_seconds(context)):
+            print(f"Skipping duplicate event {event_id}")
+            return {'statusCode': 200, 'body': f'Duplicate event {event_id} skipped'}
+        try:
+            result = handler(event, context)
+        except Exception:
+            if event_id:
+                guard.release(event_id)
+            raise
+        if event_id:
+            try:
+                guard.complete(event_id)
+            except Exception as e:
+                # The work is done, failing now would only trigger a retry once the claim lapses
+                print(f"Could not mark event {event_id} completed: {str(e)}")
+        return result
+    return wrapper
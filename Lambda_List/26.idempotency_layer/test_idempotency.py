@@ -0,0 +1,157 @@
+import importlib.util
+import os
+
+import boto3
+import pytest
+from botocore.stub import ANY, Stubber
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def load_layer():
+    """Helper function to import the layer's idempotency.py without a table configured"""
+    spec = importlib.util.spec_from_file_location('idempotency_layer', os.path.join(HERE, 'python', 'idempotency.py'))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+idempotency = load_layer()
+
+
+@pytest.fixture
+def dynamodb():
+    client = boto3.client(
+        'dynamodb', region_name='us-east-1',
+        aws_access_key_id='testing', aws_secret_access_key='testing'
+    )
+    with Stubber(client) as stubber:
+        yield client, stubber
+        stubber.assert_no_pending_responses()
+
+
+def put_params(event_id):
+    return {
+        'TableName': 'events',
+        'Item': {'id': {'S': event_id}, 'status': {'S': 'IN_PROGRESS'}, 'expires_at': {'N': ANY}},
+        'ConditionExpression': 'attribute_not_exists(id) OR expires_at < :now',
+        'ExpressionAttributeValues': {':now': {'N': ANY}},
+    }
+
+
+def test_store_claim_is_a_conditional_put(dynamodb):
+    client, stubber = dynamodb
+    store = idempotency.DynamoDBIdempotencyStore('events', client)
+    stubber.add_response('put_item', {}, put_params('evt-1'))
+    stubber.add_client_error('put_item', service_error_code='ConditionalCheckFailedException',
+                             expected_params=put_params('evt-1'))
+
+    assert store.claim('evt-1', 200, 100) is True
+    assert store.claim('evt-1', 200, 100) is False
+
+
+def test_store_prefixes_keys_with_the_function_name(dynamodb):
+    client, stubber = dynamodb
+    store = idempotency.DynamoDBIdempotencyStore('events', client, key_prefix='snapshot-tagger')
+    stubber.add_response('put_item', {}, put_params('snapshot-tagger#evt-1'))
+    stubber.add_response('delete_item', {}, {'TableName': 'events', 'Key': {'id': {'S': 'snapshot-tagger#evt-1'}}})
+
+    # Another function claiming evt-1 in the shared table writes a different item
+    assert store.claim('evt-1', 200, 100) is True
+    store.release('evt-1')
+
+
+def complete_params(event_id):
+    return {'TableName': 'events', 'Item': {'id': {'S': event_id}, 'status': {'S': 'COMPLETED'}, 'expires_at': {'N': ANY}}}
+
+
+class FakeContext:
+    def __init__(self, remaining_ms):
+        self.remaining_ms = remaining_ms
+
+    def get_remaining_time_in_millis(self):
+        return self.remaining_ms
+
+
+def test_guard_answers_warm_duplicates_from_memory(dynamodb):
+    client, stubber = dynamodb
+    guard = idempotency.IdempotencyGuard(idempotency.DynamoDBIdempotencyStore('events', client))
+    stubber.add_response('put_item', {}, put_params('evt-1'))
+    stubber.add_response('put_item', {}, complete_params('evt-1'))
+
+    assert guard.claim('evt-1') is True
+    guard.complete('evt-1')
+    # No second put_item is stubbed, so this must not reach DynamoDB
+    assert guard.claim('evt-1') is False
+
+
+def test_guard_release_lets_the_retry_through(dynamodb):
+    client, stubber = dynamodb
+    guard = idempotency.IdempotencyGuard(idempotency.DynamoDBIdempotencyStore('events', client))
+    stubber.add_response('put_item', {}, put_params('evt-1'))
+    stubber.add_response('delete_item', {}, {'TableName': 'events', 'Key': {'id': {'S': 'evt-1'}}})
+    stubber.add_response('put_item', {}, put_params('evt-1'))
+
+    assert guard.claim('evt-1') is True
+    guard.release('evt-1')
+    assert guard.claim('evt-1') is True
+
+
+def test_in_progress_claim_lapses_with_the_invocation(monkeypatch):
+    guard = idempotency.IdempotencyGuard()
+    clock = [1000.0]
+    monkeypatch.setattr(idempotency.time, 'time', lambda: clock[0])
+
+    assert guard.claim('evt-1', 30) is True
+    # A concurrent delivery is dropped while the claim is live
+    assert guard.claim('evt-1', 30) is False
+    # The run timed out without completing or releasing, its retry is processed
+    clock[0] += 31
+    assert guard.claim('evt-1', 30) is True
+    guard.complete('evt-1')
+    clock[0] += 3600
+    assert guard.claim('evt-1', 30) is False
+
+
+def test_guard_cache_is_bounded():
+    guard = idempotency.IdempotencyGuard(cache_size=2)
+    for event_id in ('a', 'b', 'c'):
+        assert guard.claim(event_id) is True
+        guard.complete(event_id)
+    assert list(guard.seen) == ['b', 'c']
+    assert guard.claim('a') is True
+
+
+def test_decorator_skips_duplicates_and_releases_on_error(monkeypatch):
+    monkeypatch.setattr(idempotency, 'guard', idempotency.IdempotencyGuard())
+    calls = []
+
+    @idempotency.idempotent
+    def handler(event, context):
+        calls.append(event['id'])
+        if event.get('fail'):
+            raise RuntimeError('boom')
+        return 'done'
+
+    assert handler({'id': 'evt-1'}, None) == 'done'
+    assert handler({'id': 'evt-1'}, None)['statusCode'] == 200
+    with pytest.raises(RuntimeError):
+        handler({'id': 'evt-2', 'fail': True}, None)
+    assert handler({'id': 'evt-2'}, None) == 'done'
+    assert calls == ['evt-1', 'evt-2', 'evt-2']
+
+
+def test_decorator_claims_for_the_remaining_time_and_completes(dynamodb, monkeypatch):
+    client, stubber = dynamodb
+    monkeypatch.setattr(idempotency, 'guard', idempotency.IdempotencyGuard(idempotency.DynamoDBIdempotencyStore('events', client)))
+    monkeypatch.setattr(idempotency.time, 'time', lambda: 1000.0)
+    claim = put_params('evt-1')
+    claim['Item'] = {'id': {'S': 'evt-1'}, 'status': {'S': 'IN_PROGRESS'}, 'expires_at': {'N': '1030'}}
+    stubber.add_response('put_item', {}, claim)
+    completion = complete_params('evt-1')
+    completion['Item']['expires_at'] = {'N': str(1000 + idempotency.IDEMPOTENCY_TTL_SECONDS)}
+    stubber.add_response('put_item', {}, completion)
+
+    handler = idempotency.idempotent(lambda event, context: 'done')
+
+    assert handler({'id': 'evt-1'}, FakeContext(30000)) == 'done'